@@ -0,0 +1,460 @@
+# Generated by renamer.grammars, do not edit.
+from pymeta.runtime import OMetaBase as GrammarBase
+
+grammarHash = '20bfcee9445c06ce742b53b42475bbc2a21a5f98'
+
+
+
+class Parser(GrammarBase):
+    def rule_complete_strict(self):
+        _locals = {'self': self}
+        self.locals['complete_strict'] = _locals
+        _G_apply_1, lastError = self._apply(self.rule_series_strict, "series_strict", [])
+        self.considerError(lastError)
+        _locals['series'] = _G_apply_1
+        _G_apply_2, lastError = self._apply(self.rule_separator, "separator", [])
+        self.considerError(lastError)
+        _G_apply_3, lastError = self._apply(self.rule_episode_strict, "episode_strict", [])
+        self.considerError(lastError)
+        _locals['episode'] = _G_apply_3
+        _G_python_4, lastError = eval('series, episode', self.globals, _locals), None
+        self.considerError(lastError)
+        return (_G_python_4, self.currentError)
+
+
+    def rule_complete_lenient(self):
+        _locals = {'self': self}
+        self.locals['complete_lenient'] = _locals
+        _G_apply_1, lastError = self._apply(self.rule_series_lenient, "series_lenient", [])
+        self.considerError(lastError)
+        _locals['series'] = _G_apply_1
+        _G_apply_2, lastError = self._apply(self.rule_separator, "separator", [])
+        self.considerError(lastError)
+        _G_apply_3, lastError = self._apply(self.rule_episode_lenient, "episode_lenient", [])
+        self.considerError(lastError)
+        _locals['episode'] = _G_apply_3
+        _G_python_4, lastError = eval('series, episode', self.globals, _locals), None
+        self.considerError(lastError)
+        return (_G_python_4, self.currentError)
+
+
+    def rule_partial_silly(self):
+        _locals = {'self': self}
+        self.locals['partial_silly'] = _locals
+        _G_apply_1, lastError = self._apply(self.rule_series_silly, "series_silly", [])
+        self.considerError(lastError)
+        _locals['series'] = _G_apply_1
+        _G_apply_2, lastError = self._apply(self.rule_separator, "separator", [])
+        self.considerError(lastError)
+        _G_apply_3, lastError = self._apply(self.rule_episode_silly, "episode_silly", [])
+        self.considerError(lastError)
+        _locals['episode'] = _G_apply_3
+        _G_python_4, lastError = eval('series, episode', self.globals, _locals), None
+        self.considerError(lastError)
+        return (_G_python_4, self.currentError)
+
+
+    def rule_only_episode_silly(self):
+        _locals = {'self': self}
+        self.locals['only_episode_silly'] = _locals
+        _G_apply_1, lastError = self._apply(self.rule_episode_silly, "episode_silly", [])
+        self.considerError(lastError)
+        _locals['episode'] = _G_apply_1
+        _G_python_2, lastError = eval('None, episode', self.globals, _locals), None
+        self.considerError(lastError)
+        return (_G_python_2, self.currentError)
+
+
+    def rule_only_episode(self):
+        _locals = {'self': self}
+        self.locals['only_episode'] = _locals
+        _G_apply_1, lastError = self._apply(self.rule_episode_strict, "episode_strict", [])
+        self.considerError(lastError)
+        _locals['episode'] = _G_apply_1
+        _G_python_2, lastError = eval('None, episode', self.globals, _locals), None
+        self.considerError(lastError)
+        return (_G_python_2, self.currentError)
+
+
+    def rule_only_series(self):
+        _locals = {'self': self}
+        self.locals['only_series'] = _locals
+        def _G_many1_1():
+            _G_apply_1, lastError = self._apply(self.rule_series_word, "series_word", [])
+            self.considerError(lastError)
+            _locals['word'] = _G_apply_1
+            _G_apply_2, lastError = self._apply(self.rule_separator, "separator", [])
+            self.considerError(lastError)
+            _G_python_3, lastError = eval('word', self.globals, _locals), None
+            self.considerError(lastError)
+            return (_G_python_3, self.currentError)
+        _G_many1_2, lastError = self.many(_G_many1_1, _G_many1_1())
+        self.considerError(lastError)
+        _locals['words'] = _G_many1_2
+        _G_python_3, lastError = eval("' '.join(words), [None, None]", self.globals, _locals), None
+        self.considerError(lastError)
+        return (_G_python_3, self.currentError)
+
+
+    def rule_separator(self):
+        _locals = {'self': self}
+        self.locals['separator'] = _locals
+        def _G_or_1():
+            _G_apply_1, lastError = self._apply(self.rule_hard_separator, "hard_separator", [])
+            self.considerError(lastError)
+            return (_G_apply_1, self.currentError)
+        def _G_or_2():
+            _G_apply_1, lastError = self._apply(self.rule_soft_separator, "soft_separator", [])
+            self.considerError(lastError)
+            return (_G_apply_1, self.currentError)
+        _G_or_3, lastError = self._or([_G_or_1, _G_or_2])
+        self.considerError(lastError)
+        return (_G_or_3, self.currentError)
+
+
+    def rule_soft_separator(self):
+        _locals = {'self': self}
+        self.locals['soft_separator'] = _locals
+        def _G_or_1():
+            _G_exactly_1, lastError = self.exactly('.')
+            self.considerError(lastError)
+            return (_G_exactly_1, self.currentError)
+        def _G_or_2():
+            _G_exactly_1, lastError = self.exactly(' ')
+            self.considerError(lastError)
+            return (_G_exactly_1, self.currentError)
+        def _G_or_3():
+            _G_exactly_1, lastError = self.exactly('-')
+            self.considerError(lastError)
+            return (_G_exactly_1, self.currentError)
+        def _G_or_4():
+            _G_exactly_1, lastError = self.exactly('_')
+            self.considerError(lastError)
+            return (_G_exactly_1, self.currentError)
+        _G_or_5, lastError = self._or([_G_or_1, _G_or_2, _G_or_3, _G_or_4])
+        self.considerError(lastError)
+        return (_G_or_5, self.currentError)
+
+
+    def rule_hard_separator(self):
+        _locals = {'self': self}
+        self.locals['hard_separator'] = _locals
+        def _G_or_1():
+            _G_exactly_1, lastError = self.exactly('_')
+            self.considerError(lastError)
+            _G_exactly_2, lastError = self.exactly('-')
+            self.considerError(lastError)
+            _G_exactly_3, lastError = self.exactly('_')
+            self.considerError(lastError)
+            return (_G_exactly_3, self.currentError)
+        def _G_or_2():
+            _G_exactly_1, lastError = self.exactly(' ')
+            self.considerError(lastError)
+            _G_exactly_2, lastError = self.exactly('-')
+            self.considerError(lastError)
+            _G_exactly_3, lastError = self.exactly(' ')
+            self.considerError(lastError)
+            return (_G_exactly_3, self.currentError)
+        def _G_or_3():
+            _G_exactly_1, lastError = self.exactly('.')
+            self.considerError(lastError)
+            _G_exactly_2, lastError = self.exactly('-')
+            self.considerError(lastError)
+            _G_exactly_3, lastError = self.exactly('.')
+            self.considerError(lastError)
+            return (_G_exactly_3, self.currentError)
+        _G_or_4, lastError = self._or([_G_or_1, _G_or_2, _G_or_3])
+        self.considerError(lastError)
+        return (_G_or_4, self.currentError)
+
+
+    def rule_series_strict(self):
+        _locals = {'self': self}
+        self.locals['series_strict'] = _locals
+        def _G_many_1():
+            _G_apply_1, lastError = self._apply(self.rule_series_word, "series_word", [])
+            self.considerError(lastError)
+            _locals['word'] = _G_apply_1
+            _G_apply_2, lastError = self._apply(self.rule_separator, "separator", [])
+            self.considerError(lastError)
+            def _G_not_3():
+                _G_apply_1, lastError = self._apply(self.rule_episode_strict, "episode_strict", [])
+                self.considerError(lastError)
+                _G_apply_2, lastError = self._apply(self.rule_separator, "separator", [])
+                self.considerError(lastError)
+                return (_G_apply_2, self.currentError)
+            _G_not_4, lastError = self._not(_G_not_3)
+            self.considerError(lastError)
+            _G_python_5, lastError = eval('word', self.globals, _locals), None
+            self.considerError(lastError)
+            return (_G_python_5, self.currentError)
+        _G_many_2, lastError = self.many(_G_many_1)
+        self.considerError(lastError)
+        _locals['words'] = _G_many_2
+        _G_apply_3, lastError = self._apply(self.rule_series_word, "series_word", [])
+        self.considerError(lastError)
+        _locals['word'] = _G_apply_3
+        _G_python_4, lastError = eval("' '.join(words + [word])", self.globals, _locals), None
+        self.considerError(lastError)
+        return (_G_python_4, self.currentError)
+
+
+    def rule_series_lenient(self):
+        _locals = {'self': self}
+        self.locals['series_lenient'] = _locals
+        def _G_many_1():
+            _G_apply_1, lastError = self._apply(self.rule_series_word, "series_word", [])
+            self.considerError(lastError)
+            _locals['word'] = _G_apply_1
+            _G_apply_2, lastError = self._apply(self.rule_separator, "separator", [])
+            self.considerError(lastError)
+            def _G_not_3():
+                _G_apply_1, lastError = self._apply(self.rule_episode_lenient, "episode_lenient", [])
+                self.considerError(lastError)
+                _G_apply_2, lastError = self._apply(self.rule_separator, "separator", [])
+                self.considerError(lastError)
+                return (_G_apply_2, self.currentError)
+            _G_not_4, lastError = self._not(_G_not_3)
+            self.considerError(lastError)
+            _G_python_5, lastError = eval('word', self.globals, _locals), None
+            self.considerError(lastError)
+            return (_G_python_5, self.currentError)
+        _G_many_2, lastError = self.many(_G_many_1)
+        self.considerError(lastError)
+        _locals['words'] = _G_many_2
+        _G_apply_3, lastError = self._apply(self.rule_series_word, "series_word", [])
+        self.considerError(lastError)
+        _locals['word'] = _G_apply_3
+        _G_python_4, lastError = eval("' '.join(words + [word])", self.globals, _locals), None
+        self.considerError(lastError)
+        return (_G_python_4, self.currentError)
+
+
+    def rule_series_silly(self):
+        _locals = {'self': self}
+        self.locals['series_silly'] = _locals
+        def _G_many_1():
+            _G_apply_1, lastError = self._apply(self.rule_series_word, "series_word", [])
+            self.considerError(lastError)
+            _locals['word'] = _G_apply_1
+            _G_apply_2, lastError = self._apply(self.rule_soft_separator, "soft_separator", [])
+            self.considerError(lastError)
+            def _G_not_3():
+                _G_apply_1, lastError = self._apply(self.rule_episode_silly, "episode_silly", [])
+                self.considerError(lastError)
+                _G_apply_2, lastError = self._apply(self.rule_separator, "separator", [])
+                self.considerError(lastError)
+                return (_G_apply_2, self.currentError)
+            _G_not_4, lastError = self._not(_G_not_3)
+            self.considerError(lastError)
+            _G_python_5, lastError = eval('word', self.globals, _locals), None
+            self.considerError(lastError)
+            return (_G_python_5, self.currentError)
+        _G_many_2, lastError = self.many(_G_many_1)
+        self.considerError(lastError)
+        _locals['words'] = _G_many_2
+        _G_apply_3, lastError = self._apply(self.rule_separator, "separator", [])
+        self.considerError(lastError)
+        _G_python_4, lastError = eval("' '.join(words)", self.globals, _locals), None
+        self.considerError(lastError)
+        return (_G_python_4, self.currentError)
+
+
+    def rule_series_word(self):
+        _locals = {'self': self}
+        self.locals['series_word'] = _locals
+        def _G_many1_1():
+            def _G_or_1():
+                _G_apply_1, lastError = self._apply(self.rule_letter, "letter", [])
+                self.considerError(lastError)
+                return (_G_apply_1, self.currentError)
+            def _G_or_2():
+                _G_apply_1, lastError = self._apply(self.rule_digit, "digit", [])
+                self.considerError(lastError)
+                return (_G_apply_1, self.currentError)
+            _G_or_3, lastError = self._or([_G_or_1, _G_or_2])
+            self.considerError(lastError)
+            return (_G_or_3, self.currentError)
+        _G_many1_2, lastError = self.many(_G_many1_1, _G_many1_1())
+        self.considerError(lastError)
+        _locals['name'] = _G_many1_2
+        _G_python_3, lastError = eval("''.join(name)", self.globals, _locals), None
+        self.considerError(lastError)
+        return (_G_python_3, self.currentError)
+
+
+    def rule_episode_strict(self):
+        _locals = {'self': self}
+        self.locals['episode_strict'] = _locals
+        def _G_or_1():
+            _G_apply_1, lastError = self._apply(self.rule_episode_x, "episode_x", [])
+            self.considerError(lastError)
+            return (_G_apply_1, self.currentError)
+        def _G_or_2():
+            _G_apply_1, lastError = self._apply(self.rule_episode_x2, "episode_x2", [])
+            self.considerError(lastError)
+            return (_G_apply_1, self.currentError)
+        def _G_or_3():
+            _G_apply_1, lastError = self._apply(self.rule_episode_lettered, "episode_lettered", [])
+            self.considerError(lastError)
+            return (_G_apply_1, self.currentError)
+        _G_or_4, lastError = self._or([_G_or_1, _G_or_2, _G_or_3])
+        self.considerError(lastError)
+        _locals['ep'] = _G_or_4
+        _G_python_5, lastError = eval("map(''.join, ep)", self.globals, _locals), None
+        self.considerError(lastError)
+        return (_G_python_5, self.currentError)
+
+
+    def rule_episode_lenient(self):
+        _locals = {'self': self}
+        self.locals['episode_lenient'] = _locals
+        def _G_or_1():
+            _G_apply_1, lastError = self._apply(self.rule_episode_strict, "episode_strict", [])
+            self.considerError(lastError)
+            return (_G_apply_1, self.currentError)
+        def _G_or_2():
+            _G_apply_1, lastError = self._apply(self.rule_episode_numbers, "episode_numbers", [])
+            self.considerError(lastError)
+            return (_G_apply_1, self.currentError)
+        _G_or_3, lastError = self._or([_G_or_1, _G_or_2])
+        self.considerError(lastError)
+        _locals['ep'] = _G_or_3
+        _G_python_4, lastError = eval("map(''.join, ep)", self.globals, _locals), None
+        self.considerError(lastError)
+        return (_G_python_4, self.currentError)
+
+
+    def rule_episode_silly(self):
+        _locals = {'self': self}
+        self.locals['episode_silly'] = _locals
+        def _G_many1_1():
+            _G_apply_1, lastError = self._apply(self.rule_digit, "digit", [])
+            self.considerError(lastError)
+            return (_G_apply_1, self.currentError)
+        _G_many1_2, lastError = self.many(_G_many1_1, _G_many1_1())
+        self.considerError(lastError)
+        _locals['ep'] = _G_many1_2
+        _G_python_3, lastError = eval("map(''.join, [ep, ep])", self.globals, _locals), None
+        self.considerError(lastError)
+        return (_G_python_3, self.currentError)
+
+
+    def rule_episode_lettered(self):
+        _locals = {'self': self}
+        self.locals['episode_lettered'] = _locals
+        def _G_or_1():
+            _G_exactly_1, lastError = self.exactly('S')
+            self.considerError(lastError)
+            return (_G_exactly_1, self.currentError)
+        def _G_or_2():
+            _G_exactly_1, lastError = self.exactly('s')
+            self.considerError(lastError)
+            return (_G_exactly_1, self.currentError)
+        _G_or_3, lastError = self._or([_G_or_1, _G_or_2])
+        self.considerError(lastError)
+        def _G_many1_4():
+            _G_apply_1, lastError = self._apply(self.rule_digit, "digit", [])
+            self.considerError(lastError)
+            return (_G_apply_1, self.currentError)
+        _G_many1_5, lastError = self.many(_G_many1_4, _G_many1_4())
+        self.considerError(lastError)
+        _locals['season'] = _G_many1_5
+        def _G_or_6():
+            _G_exactly_1, lastError = self.exactly('E')
+            self.considerError(lastError)
+            return (_G_exactly_1, self.currentError)
+        def _G_or_7():
+            _G_exactly_1, lastError = self.exactly('e')
+            self.considerError(lastError)
+            return (_G_exactly_1, self.currentError)
+        _G_or_8, lastError = self._or([_G_or_6, _G_or_7])
+        self.considerError(lastError)
+        def _G_many1_9():
+            _G_apply_1, lastError = self._apply(self.rule_digit, "digit", [])
+            self.considerError(lastError)
+            return (_G_apply_1, self.currentError)
+        _G_many1_10, lastError = self.many(_G_many1_9, _G_many1_9())
+        self.considerError(lastError)
+        _locals['episode'] = _G_many1_10
+        _G_python_11, lastError = eval('season, episode', self.globals, _locals), None
+        self.considerError(lastError)
+        return (_G_python_11, self.currentError)
+
+
+    def rule_episode_numbers(self):
+        _locals = {'self': self}
+        self.locals['episode_numbers'] = _locals
+        _G_apply_1, lastError = self._apply(self.rule_digit, "digit", [])
+        self.considerError(lastError)
+        _locals['a'] = _G_apply_1
+        _G_apply_2, lastError = self._apply(self.rule_digit, "digit", [])
+        self.considerError(lastError)
+        _locals['b'] = _G_apply_2
+        _G_apply_3, lastError = self._apply(self.rule_digit, "digit", [])
+        self.considerError(lastError)
+        _locals['c'] = _G_apply_3
+        def _G_optional_4():
+            _G_apply_1, lastError = self._apply(self.rule_digit, "digit", [])
+            self.considerError(lastError)
+            return (_G_apply_1, self.currentError)
+        def _G_optional_5():
+            return (None, self.input.nullError())
+        _G_or_6, lastError = self._or([_G_optional_4, _G_optional_5])
+        self.considerError(lastError)
+        _locals['d'] = _G_or_6
+        _G_python_7, lastError = eval('([a, b], [c, d]) if d else ([a], [b, c])', self.globals, _locals), None
+        self.considerError(lastError)
+        return (_G_python_7, self.currentError)
+
+
+    def rule_episode_x(self):
+        _locals = {'self': self}
+        self.locals['episode_x'] = _locals
+        def _G_many1_1():
+            _G_apply_1, lastError = self._apply(self.rule_digit, "digit", [])
+            self.considerError(lastError)
+            return (_G_apply_1, self.currentError)
+        _G_many1_2, lastError = self.many(_G_many1_1, _G_many1_1())
+        self.considerError(lastError)
+        _locals['season'] = _G_many1_2
+        _G_exactly_3, lastError = self.exactly('x')
+        self.considerError(lastError)
+        def _G_many1_4():
+            _G_apply_1, lastError = self._apply(self.rule_digit, "digit", [])
+            self.considerError(lastError)
+            return (_G_apply_1, self.currentError)
+        _G_many1_5, lastError = self.many(_G_many1_4, _G_many1_4())
+        self.considerError(lastError)
+        _locals['episode'] = _G_many1_5
+        _G_python_6, lastError = eval('season, episode', self.globals, _locals), None
+        self.considerError(lastError)
+        return (_G_python_6, self.currentError)
+
+
+    def rule_episode_x2(self):
+        _locals = {'self': self}
+        self.locals['episode_x2'] = _locals
+        _G_exactly_1, lastError = self.exactly('[')
+        self.considerError(lastError)
+        def _G_many1_2():
+            _G_apply_1, lastError = self._apply(self.rule_digit, "digit", [])
+            self.considerError(lastError)
+            return (_G_apply_1, self.currentError)
+        _G_many1_3, lastError = self.many(_G_many1_2, _G_many1_2())
+        self.considerError(lastError)
+        _locals['season'] = _G_many1_3
+        _G_exactly_4, lastError = self.exactly('x')
+        self.considerError(lastError)
+        def _G_many1_5():
+            _G_apply_1, lastError = self._apply(self.rule_digit, "digit", [])
+            self.considerError(lastError)
+            return (_G_apply_1, self.currentError)
+        _G_many1_6, lastError = self.many(_G_many1_5, _G_many1_5())
+        self.considerError(lastError)
+        _locals['episode'] = _G_many1_6
+        _G_exactly_7, lastError = self.exactly(']')
+        self.considerError(lastError)
+        _G_python_8, lastError = eval('season, episode', self.globals, _locals), None
+        self.considerError(lastError)
+        return (_G_python_8, self.currentError)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+Benchmark reading audio tags for the audio command, in the main process, in
+worker processes and from the tag index, from a generated corpus of MP3, FLAC
+and Ogg Vorbis files with embedded cover art.
+
+Usage: python benchmarks/audiotags.py [count] [processes]
+"""
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+from mutagen._vorbis import VComment
+from mutagen.id3 import APIC, ID3, TALB, TDRC, TIT2, TPE1, TRCK
+from mutagen.ogg import OggPage
+
+from twisted.internet import defer, task
+from twisted.python.filepath import FilePath
+
+from renamer.application import Options
+from renamer.plugins.audio import Audio
+
+
+
+def comment(index):
+    vc = VComment()
+    vc.vendor = u'renamer'
+    for key, value in [(u'artist', u'Artist %d' % (index % 10,)),
+                       (u'album', u'Album %d' % (index % 50,)),
+                       (u'title', u'Title %d' % (index,)),
+                       (u'date', u'2010'),
+                       (u'tracknumber', u'%d' % (index % 20 + 1,))]:
+        vc.append((key, value))
+    return vc
+
+
+
+def writeMP3(path, index, picture):
+    # MPEG-1 layer III, 128kbps, 44.1kHz frames.
+    frame = '\xff\xfb\x90\x64' + '\x00' * 413
+    path.setContent(frame * 100)
+    vc = dict(comment(index))
+    tags = ID3()
+    for frameType, key in [(TPE1, u'artist'), (TALB, u'album'),
+                           (TIT2, u'title'), (TDRC, u'date'),
+                           (TRCK, u'tracknumber')]:
+        tags.add(frameType(encoding=3, text=[vc[key]]))
+    tags.add(APIC(encoding=3, mime=u'image/jpeg', type=3, desc=u'',
+                  data=picture))
+    tags.save(path.path)
+
+
+
+def writeFLAC(path, index, picture):
+    streaminfo = (
+        struct.pack('>HH', 4096, 4096) + '\x00' * 6 +
+        struct.pack('>Q', (44100 << 44) | (1 << 41) | (15 << 36) | 44100) +
+        '\x00' * 16)
+    data = comment(index).write(framing=False)
+    path.setContent(
+        'fLaC' +
+        '\x00' + struct.pack('>I', len(streaminfo))[1:] + streaminfo +
+        '\x84' + struct.pack('>I', len(data))[1:] + data)
+
+
+
+def writeOgg(path, index, picture):
+    packets = [
+        '\x01vorbis' + struct.pack(
+            '<IBIiiiBB', 0, 2, 44100, 0, 128000, 0, 0xb8, 1),
+        '\x03vorbis' + comment(index).write(),
+        '\x05vorbis']
+    pages = []
+    for sequence, packet in enumerate(packets):
+        page = OggPage()
+        page.serial = 1
+        page.sequence = sequence
+        page.packets = [packet]
+        page.position = 44100 if sequence == len(packets) - 1 else 0
+        page.first = sequence == 0
+        page.last = sequence == len(packets) - 1
+        pages.append(page.write())
+    path.setContent(''.join(pages))
+
+
+
+def createCorpus(directory, count):
+    directory.makedirs()
+    picture = os.urandom(64 * 1024)
+    writers = [('mp3', writeMP3), ('flac', writeFLAC), ('ogg', writeOgg)]
+    paths = []
+    for index in xrange(count):
+        ext, writer = writers[index % len(writers)]
+        path = directory.child('%06d.%s' % (index, ext))
+        writer(path, index, picture)
+        paths.append(path)
+    return paths
+
+
+
+def createCommand(*args):
+    command = Audio()
+    command.parent = Options(None)
+    command.parseOptions(list(args))
+    return command
+
+
+
+@defer.inlineCallbacks
+def benchmark(label, command, paths):
+    start = time.time()
+    yield defer.gatherResults(
+        [defer.maybeDeferred(command.processArgument, path)
+         for path in paths])
+    elapsed = time.time() - start
+    print '%-16s %d files in %.3fs (%.0f/s)' % (
+        label, len(paths), elapsed, len(paths) / elapsed)
+
+
+
+@defer.inlineCallbacks
+def main(reactor, count=3000, processes=4):
+    directory = FilePath(tempfile.mkdtemp())
+    try:
+        paths = createCorpus(directory.child('corpus'), count)
+        yield benchmark('main process', createCommand('--no-index'), paths)
+        command = createCommand(
+            '--no-index', '--processes=%d' % (processes,))
+        yield benchmark('%d processes' % (processes,), command, paths)
+        command._tagReader.stop()
+
+        index = '--index=' + directory.child('audio.axiom').path
+        command = createCommand(index)
+        yield benchmark('indexing', command, paths)
+        command.index.flush()
+        yield benchmark('indexed', createCommand(index), paths)
+    finally:
+        shutil.rmtree(directory.path)
+
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    task.react(main, args)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Benchmark moving a large file between two filesystems, with
+L{twisted.python.filepath.FilePath.moveTo}, as Renamer used to do, and with
+L{renamer.util.moveAcrossDevices}, with and without verification.
+
+The directories should be on different local filesystems, such as two tmpfs
+mounts or loop-mounted images, for instance::
+
+    mkdir -p /tmp/a /tmp/b
+    mount -t tmpfs -o size=2g tmpfs /tmp/a
+    mount -t tmpfs -o size=2g tmpfs /tmp/b
+
+Usage: python benchmarks/crossdevice.py srcdir dstdir [megabytes]
+"""
+import os
+import sys
+import time
+
+from twisted.python.filepath import FilePath
+
+from renamer import util
+
+
+
+def createFile(path, megabytes):
+    chunk = os.urandom(1024 * 1024)
+    with open(path.path, 'wb') as fd:
+        for i in xrange(megabytes):
+            fd.write(chunk)
+    path.changed()
+
+
+
+def benchmark(label, move, src, dst, megabytes):
+    createFile(src, megabytes)
+    start = time.time()
+    move(src, dst)
+    elapsed = time.time() - start
+    dst.remove()
+    print '%-18s %d MB in %.3fs (%.1f MB/s)' % (
+        label, megabytes, elapsed, megabytes / elapsed)
+
+
+
+def main(srcdir, dstdir, megabytes=512):
+    src = FilePath(srcdir).child('renamer-benchmark')
+    dst = FilePath(dstdir).child('renamer-benchmark')
+    if os.stat(srcdir).st_dev == os.stat(dstdir).st_dev:
+        print 'Warning: %s and %s are on the same filesystem' % (
+            srcdir, dstdir)
+    print 'sendfile: %s' % ('available' if util.sendfile else 'unavailable',)
+
+    benchmark('FilePath.moveTo', FilePath.moveTo, src, dst, megabytes)
+    benchmark('moveAcrossDevices', util.moveAcrossDevices, src, dst, megabytes)
+    benchmark(
+        'verified',
+        lambda src, dst: util.moveAcrossDevices(src, dst, verify=True),
+        src, dst, megabytes)
+
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        raise SystemExit(__doc__.strip())
+    megabytes = 512
+    if len(sys.argv) > 3:
+        megabytes = int(sys.argv[3])
+    main(sys.argv[1], sys.argv[2], megabytes)
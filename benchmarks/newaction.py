@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+Benchmark how quickly actions can be created and adapted to
+L{renamer.irenamer.IRenamingAction}s, with the action registry and with a
+plugin scan for every lookup, as Renamer used to do.
+
+Usage: python benchmarks/newaction.py [count]
+"""
+import sys
+import time
+
+from axiom.store import Store
+
+from twisted.python.filepath import FilePath
+
+from renamer import plugin
+from renamer.history import History
+from renamer.irenamer import IRenamingAction
+
+
+
+def benchmark(count, invalidate):
+    store = Store()
+    changeset = store.findOrCreate(History).newChangeset()
+    src = FilePath(u'src')
+    dst = FilePath(u'dst')
+
+    def _run():
+        for i in xrange(count):
+            if invalidate:
+                plugin.invalidateActionRegistry()
+            action = changeset.newAction(u'move', src, dst)
+            IRenamingAction(action)
+
+    start = time.time()
+    store.transact(_run)
+    return time.time() - start
+
+
+
+def main(count=10000):
+    plugin.getActionRegistry()
+    for label, invalidate in [('registry', False), ('scan', True)]:
+        elapsed = benchmark(count, invalidate)
+        print '%-8s %d actions in %.3fs (%.0f/s)' % (
+            label, count, elapsed, count / elapsed)
+
+
+
+if __name__ == '__main__':
+    count = 10000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    main(count)
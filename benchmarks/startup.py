@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Benchmark how long Renamer takes to parse its command line, with and without
+the persistent plugin index.
+
+Each run happens in a fresh interpreter, since most of the cost is importing
+plugin modules.
+
+Usage: python benchmarks/startup.py [runs] [command ...]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+
+SNIPPET = """
+import sys
+from twisted.python.filepath import FilePath
+from renamer.application import Options
+from renamer.plugin import PluginIndex
+index = None
+if sys.argv[1] != '-':
+    index = PluginIndex(FilePath(sys.argv[1]))
+Options({}, index).parseOptions(sys.argv[2:])
+"""
+
+
+
+def timeRun(indexPath, args):
+    """
+    Time parsing C{args} in a new interpreter.
+    """
+    start = time.time()
+    subprocess.check_call(
+        [sys.executable, '-W', 'ignore', '-c', SNIPPET, indexPath] + args)
+    return time.time() - start
+
+
+
+def main(runs=10, args=['undo', 'list']):
+    fd, indexPath = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    os.unlink(indexPath)
+    try:
+        # Populate the index.
+        timeRun(indexPath, args)
+        for label, path in [('scan', '-'), ('index', indexPath)]:
+            times = sorted(timeRun(path, args) for _ in xrange(runs))
+            print '%-6s min %.3fs  median %.3fs' % (
+                label, times[0], times[len(times) // 2])
+    finally:
+        if os.path.exists(indexPath):
+            os.unlink(indexPath)
+
+
+
+if __name__ == '__main__':
+    runs = 10
+    if len(sys.argv) > 1:
+        runs = int(sys.argv[1])
+    main(runs, sys.argv[2:] or ['undo', 'list'])
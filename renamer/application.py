@@ -1,7 +1,6 @@
 """
 Renamer application logic.
 """
-import itertools
 import os
 import string
 import sys
@@ -9,22 +8,42 @@ import sys
 from axiom.store import Store
 
 from twisted.internet import defer
-from twisted.python import usage, log, versions
+from twisted.python import usage
 from twisted.python.filepath import FilePath
 
-from renamer import config, logging, plugin, util, version
-from renamer.irenamer import IRenamingCommand
-from renamer.history import History
+from renamer import __version__, config, errors, logging, plugin, util
+from renamer.planner import RenamePlan
+from renamer.irenamer import ICommand, IRenamingCommand
+from renamer.history import BatchedChangeset, History, upgradeStore
+
+
+
+def _patterns(value):
+    """
+    Split a comma-separated list of shell-style patterns.
+    """
+    return [pattern for pattern in value.split(u',') if pattern]
 
 
 
 class Options(usage.Options, plugin._CommandMixin):
     optFlags = [
         ('glob',            'g',  'Expand arguments as UNIX-style globs.'),
+        ('recursive',       'r',
+         'Rename the files within directory arguments recursively.'),
         ('one-file-system', 'x',  "Don't cross filesystems."),
         ('no-act',          'n',  'Perform a trial run with no changes made.'),
+        ('verify',          None,
+         'Verify files copied across filesystems before removing the '
+         'originals.'),
         ('link-src',        None, 'Create a symlink at the source.'),
-        ('link-dst',        None, 'Create a symlink at the destination.')]
+        ('link-dst',        None, 'Create a symlink at the destination.'),
+        ('defer-history',   None,
+         'Keep performed actions in memory and only commit them to the undo '
+         'history once the command completes.'),
+        ('plan',            None,
+         'Process all arguments before renaming anything, detecting '
+         'conflicting renames and performing cycles of renames safely.')]
 
 
     optParameters = [
@@ -34,30 +53,46 @@ class Options(usage.Options, plugin._CommandMixin):
          'Formatted filename.', None),
         ('prefix', 'p', None,
          'Formatted path to prefix to files before renaming.', None),
+        ('include', None, None,
+         'Comma-separated shell-style patterns, only rename files found '
+         'recursively whose names match one of them.', _patterns),
+        ('exclude', None, None,
+         'Comma-separated shell-style patterns, skip files and directories '
+         'found recursively whose names match any of them.', _patterns),
         ('concurrency', 'l',  10,
-         'Maximum number of asynchronous tasks to perform concurrently.', int)]
+         'Maximum number of asynchronous tasks to perform concurrently.', int),
+        ('fs-concurrency', None, 4,
+         'Maximum number of filesystem actions to perform concurrently.', int),
+        ('batch-size', None, 1,
+         'Number of actions to commit to the undo history at once.', int),
+        ('batch-interval', None, None,
+         'Maximum milliseconds to wait before committing actions to the undo '
+         'history.', int)]
 
 
     @property
     def subCommands(self):
-        commands = itertools.chain(
-            plugin.getRenamingCommands(), plugin.getCommands())
-        for plg in commands:
-            try:
-                yield (
-                    plg.name,
-                    None,
-                    config.defaultsFromConfigFactory(self.config, plg),
-                    plg.description)
-            except AttributeError:
-                raise RuntimeError('Malformed plugin: %r' % (plg,))
+        def _factory(plg):
+            def _createCommand():
+                commandClass = plg.load()
+                return config.defaultsFromConfigFactory(
+                    self.config, commandClass)()
+            return _createCommand
 
+        for plg in self.pluginIndex.getPlugins(ICommand):
+            yield plg.name, None, _factory(plg), plg.description
 
-    def __init__(self, config):
+
+    def __init__(self, config, pluginIndex=None):
         super(Options, self).__init__()
         self['verbosity'] = 1
         self['name'] = self['prefix'] = None
         self.config = config
+        self.directoryCache = util.DirectoryCache()
+        self.destinationsChecked = False
+        if pluginIndex is None:
+            pluginIndex = plugin.PluginIndex()
+        self.pluginIndex = pluginIndex
 
 
     @property
@@ -97,7 +132,7 @@ class Options(usage.Options, plugin._CommandMixin):
         """
         Display version information.
         """
-        print versions.getVersionString(version)
+        print 'renamer %s' % (__version__,)
         sys.exit(0)
 
 
@@ -106,6 +141,16 @@ class Options(usage.Options, plugin._CommandMixin):
         if self['glob']:
             args = util.globArguments(args)
         self.args = (FilePath(arg) for arg in args)
+        if self['recursive']:
+            include, exclude = [
+                [self.decodeCommandLine(pattern)
+                 for pattern in self[name] or []]
+                for name in ('include', 'exclude')]
+            self.args = util.walkArguments(
+                self.args,
+                include=include,
+                exclude=exclude,
+                oneFileSystem=self['one-file-system'])
 
 
 
@@ -114,35 +159,65 @@ class Renamer(object):
     Renamer main logic.
 
     @type store: L{axiom.store.Store}
-    @ivar store: Renamer database Store.
+    @ivar store: Renamer database Store, opened on first use.
 
     @type history: L{renamer.history.History}
-    @ivar history: Renamer history Item.
+    @ivar history: Renamer history Item, found or created on first use.
 
     @type options: L{renamer.application.Options}
     @ivar options: Parsed command-line options.
 
     @type command: L{renamer.irenamer.ICommand}
     @ivar command: Renamer command being executed.
+
+    @type pluginIndex: L{renamer.plugin.PluginIndex}
+    @ivar pluginIndex: Index of available plugins.
+
+    @type batch: L{renamer.history.BatchedChangeset}
+    @ivar batch: Batch of actions, performed by a renaming command, to commit
+        to the current changeset.
+
+    @type touchedChangesets: C{set} of L{renamer.history.Changeset}
+    @ivar touchedChangesets: Changesets created or modified by the command,
+        that need to be examined when pruning the history.
     """
     def __init__(self):
-        self._obs = logging.RenamerObserver()
-        log.startLoggingWithObserver(self._obs.emit, setStdout=False)
+        self._obs = logging.startLogging()
 
+        self.pluginIndex = plugin.PluginIndex(
+            FilePath(os.path.expanduser('~/.renamer/plugins.json')))
         self.options = self.parseOptions()
-        self.store = Store(os.path.expanduser('~/.renamer/renamer.axiom'))
-        # XXX: One day there might be more than one History item.
-        self.history = self.store.findOrCreate(History)
+        self._store = None
+        self._history = None
+        self.touchedChangesets = set()
 
         self.args = getattr(self.options, 'args', [])
         self.command = self.getCommand(self.options)
 
 
+    @property
+    def store(self):
+        if self._store is None:
+            path = os.path.expanduser('~/.renamer/renamer.axiom')
+            logging.msg('Opening history "%s"', path, verbosity=4)
+            self._store = Store(path)
+            upgradeStore(self._store)
+        return self._store
+
+
+    @property
+    def history(self):
+        if self._history is None:
+            # XXX: One day there might be more than one History item.
+            self._history = self.store.findOrCreate(History)
+        return self._history
+
+
     def parseOptions(self):
         """
         Parse configuration file and command-line options.
         """
-        _options = Options({})
+        _options = Options({}, self.pluginIndex)
         _options.parseOptions()
         self._obs.verbosity = _options['verbosity']
 
@@ -150,7 +225,7 @@ class Renamer(object):
             FilePath(os.path.expanduser(_options['config'])))
         command = self.getCommand(_options)
 
-        options = Options(self._configFile)
+        options = Options(self._configFile, self.pluginIndex)
         # Apply global defaults.
         options.update(self._configFile.get('renamer', options))
         # Apply command-specific overrides for the global config.
@@ -162,7 +237,7 @@ class Renamer(object):
         options.parseOptions()
 
         logging.msg(
-            'Global options: %r' % (options,),
+            'Global options: %r', options,
             verbosity=5)
 
         return options
@@ -185,27 +260,28 @@ class Renamer(object):
     def performRename(self, dst, src):
         """
         Perform a file rename.
+
+        @rtype:  C{Deferred}
+        @return: A deferred that fires once the rename has been performed, or
+            C{None} if there was nothing to perform.
         """
         if self.options['no-act']:
-            logging.msg('Simulating: %s => %s' % (src.path, dst.path))
+            logging.msg('Simulating: %s => %s', src.path, dst.path)
             return
 
         if src == dst:
-            logging.msg('Skipping noop "%s"' % (src.path,), verbosity=2)
+            logging.msg('Skipping noop "%s"', src.path, verbosity=2)
             return
 
         if self.options['link-dst']:
-            self.changeset.do(
-                self.changeset.newAction(u'symlink', src, dst),
-                self.options)
-        else:
-            self.changeset.do(
-                self.changeset.newAction(u'move', src, dst),
-                self.options)
-            if self.options['link-src']:
-                self.changeset.do(
-                    self.changeset.newAction(u'symlink', dst, src),
-                    self.options)
+            return self.batch.do(u'symlink', src, dst, self.options)
+
+        d = self.batch.do(u'move', src, dst, self.options)
+        if self.options['link-src']:
+            d.addCallback(
+                lambda ignored: self.batch.do(
+                    u'symlink', dst, src, self.options))
+        return d
 
 
     def runCommand(self, command):
@@ -213,10 +289,10 @@ class Renamer(object):
         Run a generic command.
         """
         logging.msg(
-            'Using command "%s"' % (command.name,),
+            'Using command "%s"', command.name,
             verbosity=4)
         logging.msg(
-            'Command options: %r' % (command,),
+            'Command options: %r', command,
             verbosity=5)
         return defer.maybeDeferred(command.process, self, self.options)
 
@@ -224,20 +300,111 @@ class Renamer(object):
     def runRenamingCommand(self, command):
         """
         Run a renaming command.
+
+        Arguments are processed by the command in one pipeline stage, limited
+        by the C{'concurrency'} option, and the resulting renames performed in
+        another, limited by the C{'fs-concurrency'} option. Filesystem actions
+        are performed in a dedicated thread pool of the same size, so that
+        slow filesystems do not block the reactor.
+
+        With the C{'plan'} option, renames are instead collected into a
+        L{renamer.planner.RenamePlan} and only performed, in the order it
+        determines, once every argument has been processed. Groups of renames
+        that do not depend on each other are performed concurrently, limited
+        by the C{'fs-concurrency'} option, and destinations are not checked
+        again by each action since the plan has already checked them. If any
+        rename could not be added to the plan, such as two arguments being
+        renamed to the same destination, nothing is renamed at all.
+
+        The command is prepared for the run, compiling and checking its
+        destination templates, before any argument is processed.
         """
         def _processOne(src):
             self.currentArgument = src
             d = self.runCommand(command)
-            d.addCallback(self.performRename, src)
+            d.addCallback(lambda dst: (dst, src))
+            return d
+
+        def _renameOne((dst, src)):
+            return self.performRename(dst, src)
+
+        def _planOne((dst, src)):
+            try:
+                plan.add(src, dst)
+            except:
+                planFailures.append((src, dst))
+                raise
+
+        def _renameGroup(steps):
+            d = defer.succeed(None)
+            for src, dst in steps:
+                d.addCallback(
+                    lambda ignored, src=src, dst=dst:
+                        self.performRename(dst, src))
             return d
 
-        self.changeset = self.history.newChangeset()
+        def _performPlan(result):
+            if planFailures:
+                raise errors.ConflictingRenames(
+                    '%d rename(s) could not be planned, no files were '
+                    'renamed' % (len(planFailures),))
+            groups = plan.groups()
+            logging.msg(
+                'Performing %d planned rename(s) in %d independent group(s)',
+                sum(map(len, groups)), len(groups),
+                verbosity=3)
+            self.options.destinationsChecked = True
+            pipeline = util.Pipeline([
+                util.Stage(
+                    'rename', _renameGroup, self.options['fs-concurrency'])])
+            d = pipeline.run(groups)
+            d.addCallback(lambda failures: result + failures)
+            return d
+
+        def _flush(result):
+            threads.stop()
+            self.batch.flush()
+            return result
+
+        def _newChangeset():
+            changeset = self.history.newChangeset()
+            self.touchedChangesets.add(changeset)
+            return changeset
+
+        command.beginRun(self.options)
+        size = self.options['batch-size']
+        interval = self.options['batch-interval']
+        if self.options['defer-history']:
+            size, interval = 0, None
+        threads = util.ThreadRunner(
+            self.options['fs-concurrency'], 'renamer-fs')
+        self.batch = BatchedChangeset(
+            size=size,
+            interval=interval,
+            changesetFactory=_newChangeset,
+            runInThread=threads)
         logging.msg(
-            'Running, doing at most %d concurrent operations' % (
-                self.options['concurrency'],),
+            'Running, doing at most %d concurrent operations and %d '
+            'concurrent filesystem actions',
+            self.options['concurrency'], self.options['fs-concurrency'],
             verbosity=3)
-        return util.parallel(
-            self.args, self.options['concurrency'], _processOne)
+        if self.options['plan']:
+            plan = RenamePlan(
+                sourcesVacated=not (self.options['link-src'] or
+                                    self.options['link-dst']))
+            planFailures = []
+            rename = util.Stage('plan', _planOne, 1)
+        else:
+            rename = util.Stage(
+                'rename', _renameOne, self.options['fs-concurrency'])
+        pipeline = util.Pipeline([
+            util.Stage('process', _processOne, self.options['concurrency']),
+            rename])
+        d = pipeline.run(self.args)
+        if self.options['plan']:
+            d.addCallback(_performPlan)
+        d.addBoth(_flush)
+        return d
 
 
     def run(self):
@@ -256,6 +423,7 @@ class Renamer(object):
         """
         Perform the exit routine.
         """
-        # We can safely do this even with "no-act", since nothing was actioned
-        # and there is no point leaving orphaned Items around.
-        self.history.pruneChangesets()
+        # Commands that never needed the history, such as "no-act" runs, have
+        # nothing to prune.
+        if self._store is not None:
+            self.history.pruneChangesets(self.touchedChangesets)
@@ -23,3 +23,25 @@ class NoClobber(RuntimeError):
     """
     A destination file already exists.
     """
+
+
+
+class ConflictingRenames(RuntimeError):
+    """
+    Several renames conflict with each other, such as two files being renamed
+    to the same destination.
+    """
+
+
+
+class VerificationFailed(RuntimeError):
+    """
+    A copy of a file is not identical to the original.
+    """
+
+
+
+class WorkerError(RuntimeError):
+    """
+    A call made in a worker process failed.
+    """
@@ -0,0 +1,130 @@
+"""
+PyMeta grammar definitions.
+
+This module must not import anything beyond the standard library, so that the
+grammars can be compiled into Python modules at build time.
+"""
+import hashlib
+import os
+
+
+
+filenameGrammar = """
+complete_strict    ::= <series_strict>:series <separator> <episode_strict>:episode
+                    => series, episode
+complete_lenient   ::= <series_lenient>:series <separator> <episode_lenient>:episode
+                    => series, episode
+partial_silly      ::= <series_silly>:series <separator> <episode_silly>:episode
+                    => series, episode
+only_episode_silly ::= <episode_silly>:episode
+                    => None, episode
+only_episode       ::= <episode_strict>:episode
+                    => None, episode
+only_series        ::= (<series_word>:word <separator> => word)+:words
+                    => ' '.join(words), [None, None]
+
+separator          ::= <hard_separator> | <soft_separator>
+soft_separator     ::= '.' | ' ' | '-' | '_'
+hard_separator     ::= ('_' '-' '_'
+                       |' ' '-' ' '
+                       |'.' '-' '.')
+
+series_strict      ::= (<series_word>:word <separator> ~(<episode_strict> <separator>) => word)*:words <series_word>:word
+                      => ' '.join(words + [word])
+series_lenient     ::= (<series_word>:word <separator> ~(<episode_lenient> <separator>) => word)*:words <series_word>:word
+                      => ' '.join(words + [word])
+series_silly       ::= (<series_word>:word <soft_separator> ~(<episode_silly> <separator>) => word)*:words <separator>
+                      => ' '.join(words)
+series_word        ::= (<letter> | <digit>)+:name => ''.join(name)
+
+episode_strict     ::= (<episode_x> | <episode_x2> | <episode_lettered>):ep
+                      => map(''.join, ep)
+episode_lenient    ::= (<episode_strict> | <episode_numbers>):ep
+                      => map(''.join, ep)
+episode_silly      ::= <digit>+:ep
+                      => map(''.join, [ep, ep])
+
+episode_lettered   ::= ('S' | 's') <digit>+:season ('E' | 'e') <digit>+:episode
+                      => season, episode
+episode_numbers    ::= <digit>:a <digit>:b <digit>:c <digit>?:d
+                      => ([a, b], [c, d]) if d else ([a], [b, c])
+episode_x          ::= <digit>+:season 'x' <digit>+:episode
+                      => season, episode
+episode_x2         ::= '[' <digit>+:season 'x' <digit>+:episode ']'
+                    => season, episode
+"""
+
+
+
+compiledGrammars = {
+    'tv': filenameGrammar}
+
+
+
+def grammarHash(grammar):
+    """
+    Compute a hash identifying a version of a grammar.
+
+    @type  grammar: C{str}
+
+    @rtype: C{str}
+    """
+    return hashlib.sha1(grammar).hexdigest()
+
+
+
+def generateParserSource(grammar, className='Parser'):
+    """
+    Generate the source of a Python module containing a PyMeta parser for a
+    grammar.
+
+    The module also defines C{grammarHash}, the L{grammarHash} of C{grammar},
+    so that outdated compiled grammars can be detected.
+
+    @raise ImportError: If PyMeta is not installed.
+
+    @rtype: C{str}
+    """
+    from pymeta.builder import TreeBuilder, writePython
+    from pymeta.grammar import OMeta
+    tree = OMeta.metagrammarClass(grammar).parseGrammar(
+        className, TreeBuilder)
+    return '\n'.join([
+        '# Generated by renamer.grammars, do not edit.',
+        'from pymeta.runtime import OMetaBase as GrammarBase',
+        '',
+        'grammarHash = %r' % (grammarHash(grammar),),
+        '',
+        '',
+        '',
+        writePython(tree),
+        ''])
+
+
+
+def writeCompiledGrammars(path):
+    """
+    Compile every grammar in L{compiledGrammars} into a module in the package
+    directory C{path}, creating it if necessary.
+
+    @type  path: C{str}
+
+    @raise ImportError: If PyMeta is not installed.
+
+    @rtype:  C{list} of C{str}
+    @return: Paths of the files written.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    sources = [('__init__', '')]
+    for name, grammar in sorted(compiledGrammars.iteritems()):
+        sources.append((name, generateParserSource(grammar)))
+
+    written = []
+    for name, source in sources:
+        modulePath = os.path.join(path, name + '.py')
+        with open(modulePath, 'w') as fd:
+            fd.write(source)
+        written.append(modulePath)
+    return written
@@ -1,12 +1,21 @@
+import json
+import os
+import sys
+from collections import deque
+
 from epsilon.extime import Time
 
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, fail, maybeDeferred
 from twisted.python.components import registerAdapter
 from twisted.python.filepath import FilePath
 
-from axiom.attributes import reference, text, timestamp
-from axiom.item import Item, transacted
+from axiom.attributes import (
+    AND, OR, compoundIndex, integer, reference, text, timestamp)
+from axiom.item import Item, declareLegacyItem, transacted
+from axiom.upgrade import registerUpgrader
 
-from renamer import logging
+from renamer import errors, logging, util
 from renamer.irenamer import IRenamingAction
 from renamer.plugin import getActionByName
 
@@ -21,32 +30,97 @@ class History(Item):
     """, defaultFactory=lambda: Time())
 
 
-    def getChangesets(self):
+    def getChangesets(self, newestFirst=False, since=None, path=None,
+                      limit=None, offset=None):
         """
         Get L{renamer.history.Changeset}s for this history.
+
+        All filtering is done by the store, so only the changesets requested
+        are ever loaded.
+
+        @type  newestFirst: C{bool}
+        @param newestFirst: Sort changesets by descending, instead of
+            ascending, modification time.
+
+        @type  since: L{epsilon.extime.Time}
+        @param since: Only include changesets modified since this time, or
+            C{None} to include all changesets.
+
+        @type  path: C{unicode}
+        @param path: Only include changesets with actions involving this path,
+            or anything beneath it, or C{None} to include all changesets.
+
+        @type  limit: C{int}
+        @param limit: Maximum number of changesets to return, or C{None} for
+            no limit.
+
+        @type  offset: C{int}
+        @param offset: Number of changesets to skip, or C{None} to skip none.
         """
+        if offset is not None and limit is None:
+            # Axiom does not support an offset without a limit.
+            limit = sys.maxint
+        comparisons = [Changeset.history == self]
+        if since is not None:
+            comparisons.append(Changeset.modified >= since)
+        if path is not None:
+            actions = self.store.query(Action, actionsInvolving(path))
+            comparisons.append(
+                Changeset.storeID.oneOf(actions.getColumn('changeset')))
+
+        if newestFirst:
+            sort = Changeset.modified.descending
+        else:
+            sort = Changeset.modified.ascending
         return iter(self.store.query(
             Changeset,
-            Changeset.history == self,
-            sort=Changeset.modified.ascending))
+            AND(*comparisons),
+            sort=sort,
+            limit=limit,
+            offset=offset))
 
 
     @transacted
-    def pruneChangesets(self):
+    def pruneChangesets(self, changesets=None):
         """
         Prune empty changesets from the currently active changesets.
+
+        @type  changesets: C{iterable} of L{renamer.history.Changeset}
+        @param changesets: Changesets to examine, such as those modified
+            since the history was last pruned, or C{None} to examine every
+            changeset. Non-empty changesets that do not yet belong to a
+            history, such as those left by an interrupted run, are always
+            adopted.
         """
-        prunedChangesets = 0
         prunedActions = self.pruneActions()
-        for cs in self.store.query(Changeset):
-            if not cs.numActions:
-                cs.deleteFromStore()
-                prunedChangesets += 1
-            elif cs.history is None:
+        if changesets is None:
+            empty = self.store.query(Changeset, Changeset.actionCount == 0)
+            prunedChangesets = empty.count()
+            empty.deleteFromStore()
+            changesets = self.store.query(
+                Changeset,
+                AND(Changeset.history == None,
+                    Changeset.actionCount > 0))
+        else:
+            prunedChangesets = 0
+            changesets = list(changesets)
+            for cs in changesets:
+                if not cs.actionCount:
+                    cs.deleteFromStore()
+                    prunedChangesets += 1
+            # Changesets committed to by an interrupted run were never
+            # adopted, look for them too.
+            changesets.extend(self.store.query(
+                Changeset,
+                AND(Changeset.history == None,
+                    Changeset.actionCount > 0)))
+
+        for cs in changesets:
+            if cs.actionCount and cs.history is None:
                 cs.history = self
 
         logging.msg(
-            'Pruned %d changesets' % (prunedChangesets,),
+            'Pruned %d changesets', prunedChangesets,
             verbosity=3)
 
         return prunedChangesets, prunedActions
@@ -59,18 +133,67 @@ class History(Item):
         L{renamer.history.Changeset}. These are actions most likely created and
         never used, so there is no need to store them.
         """
-        count = 0
-        for action in self.store.query(Action, Action.changeset == None):
-            action.deleteFromStore()
-            count += 1
+        unused = self.store.query(Action, Action.changeset == None)
+        count = unused.count()
+        unused.deleteFromStore()
 
         logging.msg(
-            'Pruned %d actions' % (count,),
+            'Pruned %d actions', count,
             verbosity=3)
 
         return count
 
 
+    def archiveChangesets(self, before, archive, batchSize=500):
+        """
+        Remove changesets last modified before a certain time from the
+        history, after writing them to an archive.
+
+        Each changeset, with its actions, is written to C{archive} as a line
+        of JSON. Changesets are archived in batches, each batch is written and
+        flushed before it is removed from the store, so a changeset is never
+        lost, although it may be archived twice if Renamer is interrupted.
+
+        @type  before: L{epsilon.extime.Time}
+
+        @param archive: File-like object to write archived changesets to.
+
+        @rtype:  C{int}
+        @return: Number of changesets archived.
+        """
+        count = 0
+        while True:
+            changesets = list(self.store.query(
+                Changeset,
+                AND(Changeset.history == self,
+                    Changeset.modified < before),
+                sort=Changeset.modified.ascending,
+                limit=batchSize))
+            if not changesets:
+                break
+
+            for cs in changesets:
+                archive.write(json.dumps(cs.asArchived()) + '\n')
+            archive.flush()
+            self.store.transact(self._removeChangesets, changesets)
+            count += len(changesets)
+            logging.msg(
+                'Archived %d changesets', count,
+                verbosity=3)
+        return count
+
+
+    def _removeChangesets(self, changesets):
+        """
+        Remove changesets, and their actions, from the store in bulk.
+        """
+        storeIDs = [cs.storeID for cs in changesets]
+        self.store.query(
+            Action, Action.changeset.oneOf(changesets)).deleteFromStore()
+        self.store.query(
+            Changeset, Changeset.storeID.oneOf(storeIDs)).deleteFromStore()
+
+
     def newChangeset(self):
         """
         Begin a new changeset.
@@ -86,6 +209,9 @@ class Changeset(Item):
     """
     A history changeset containing at least one action.
     """
+    schemaVersion = 2
+
+
     created = timestamp(doc="""
     Timestamp of when the changeset was first created.
     """, defaultFactory=lambda: Time())
@@ -93,12 +219,21 @@ class Changeset(Item):
 
     modified = timestamp(doc="""
     Timestamp of when the changeset was last modified.
-    """, defaultFactory=lambda: Time())
+    """, defaultFactory=lambda: Time(), indexed=True)
 
 
     history = reference(doc="""
     Parent history Item.
-    """, reftype=History, whenDeleted=reference.CASCADE)
+    """, reftype=History, whenDeleted=reference.CASCADE, indexed=True)
+
+
+    actionCount = integer(doc="""
+    Number of actions performed as part of this changeset, maintained as
+    actions are done and undone so that it need not be counted.
+    """, default=0, allowNone=False, indexed=True)
+
+
+    compoundIndex(history, modified)
 
 
     def __repr__(self):
@@ -109,15 +244,22 @@ class Changeset(Item):
             self.modified)
 
 
-    def getActions(self):
+    def getActions(self, path=None):
         """
         Get an iterable of L{renamer.history.Action}s for this changeset,
         sorted by ascending order of creation.
+
+        @type  path: C{unicode}
+        @param path: Only include actions involving this path, or anything
+            beneath it, or C{None} to include all actions.
         """
+        comparison = Action.changeset == self
+        if path is not None:
+            comparison = AND(comparison, actionsInvolving(path))
         return iter(
             self.store.query(
                 Action,
-                Action.changeset == self,
+                comparison,
                 sort=Action.created.ascending))
 
 
@@ -126,7 +268,25 @@ class Changeset(Item):
         """
         Number of actions contained in this changeset.
         """
-        return self.store.query(Action, Action.changeset == self).count()
+        return self.actionCount
+
+
+    def asArchived(self):
+        """
+        Construct a representation of the changeset, and its actions,
+        suitable for serializing as JSON.
+        """
+        return dict(
+            changeset=self.storeID,
+            created=self.created.asISO8601TimeAndDate(),
+            modified=self.modified.asISO8601TimeAndDate(),
+            actions=[
+                dict(action=action.storeID,
+                     name=action.name,
+                     src=action.src,
+                     dst=action.dst,
+                     created=action.created.asISO8601TimeAndDate())
+                for action in self.getActions()])
 
 
     def asHumanly(self):
@@ -164,6 +324,7 @@ class Changeset(Item):
         renamingAction = _adapter(action)
         renamingAction.do(options)
         action.changeset = self
+        self.actionCount += 1
         self.modified = Time()
 
 
@@ -178,7 +339,39 @@ class Changeset(Item):
         """
         renamingAction = _adapter(action)
         renamingAction.undo(options)
+        self.forget(action)
+
+
+    @transacted
+    def forget(self, action):
+        """
+        Remove an action from this changeset, without undoing it.
+
+        @type  action: L{renamer.history.Action}
+        """
         action.deleteFromStore()
+        self.actionCount -= 1
+        self.modified = Time()
+
+
+    @transacted
+    def forgetActions(self, actions, _chunkSize=500):
+        """
+        Remove several actions from this changeset, without undoing them.
+
+        The actions are deleted in bulk, a chunk at a time to stay within
+        SQLite's limit on query parameters.
+
+        @type  actions: C{list} of L{renamer.history.Action}
+        """
+        storeIDs = [action.storeID for action in actions]
+        for i in xrange(0, len(storeIDs), _chunkSize):
+            self.store.query(
+                Action,
+                AND(Action.changeset == self,
+                    Action.storeID.oneOf(storeIDs[i:i + _chunkSize]))
+                ).deleteFromStore()
+        self.actionCount -= len(storeIDs)
         self.modified = Time()
 
 
@@ -191,7 +384,7 @@ class Action(Item):
     """
     created = timestamp(doc="""
     Timestamp of when the action was first created.
-    """, defaultFactory=lambda: Time())
+    """, defaultFactory=lambda: Time(), indexed=True)
 
 
     name = text(doc="""
@@ -202,17 +395,20 @@ class Action(Item):
 
     src = text(doc="""
     Path to the source file of the action.
-    """, allowNone=False)
+    """, allowNone=False, indexed=True)
 
 
     dst = text(doc="""
     Path to the destination file of the action.
-    """, allowNone=False)
+    """, allowNone=False, indexed=True)
 
 
     changeset = reference(doc="""
     Parent changeset Item.
-    """, reftype=Changeset, whenDeleted=reference.CASCADE)
+    """, reftype=Changeset, whenDeleted=reference.CASCADE, indexed=True)
+
+
+    compoundIndex(changeset, created)
 
 
     def __repr__(self):
@@ -241,3 +437,456 @@ class Action(Item):
             dst=FilePath(self.dst))
 
 registerAdapter(Action.toRenamingAction, Action, IRenamingAction)
+
+
+
+def _textPath(path):
+    """
+    Get the path of a L{twisted.python.filepath.FilePath} as C{unicode}, as
+    stored in the history, decoding it with the filesystem encoding if
+    necessary.
+
+    @raise UnicodeDecodeError: If the path cannot be decoded.
+    """
+    path = path.path
+    if not isinstance(path, unicode):
+        path = path.decode(
+            sys.getfilesystemencoding() or sys.getdefaultencoding())
+    return path
+
+
+
+def actionsInvolving(path):
+    """
+    Build a comparison matching L{renamer.history.Action}s whose source or
+    destination is C{path}, or anything beneath it.
+
+    Paths beneath C{path} are matched as a range, rather than with C{LIKE},
+    so that no characters in C{path} need escaping.
+
+    @type  path: C{unicode}
+
+    @rtype: L{axiom.iaxiom.IComparison}
+    """
+    sep = unicode(os.sep)
+    path = path.rstrip(sep) or sep
+    lower = path.rstrip(sep) + sep
+    upper = lower[:-1] + unichr(ord(sep) + 1)
+    def _involving(attr):
+        return OR(attr == path, AND(attr > lower, attr < upper))
+    return OR(_involving(Action.src), _involving(Action.dst))
+
+
+
+def _ancestors(path):
+    """
+    Generate the ancestors of a path, nearest first.
+    """
+    parent = os.path.dirname(path)
+    while parent != path:
+        yield parent
+        path, parent = parent, os.path.dirname(parent)
+
+
+
+def undoDependencies(paths):
+    """
+    Determine which actions must be undone before others.
+
+    Two actions conflict when they involve the same path or one involves a
+    path beneath a path the other involves, such as a move followed by a
+    symlink at the original location, and conflicting actions must be undone
+    in order. Only the nearest conflicting actions are listed; the remaining
+    ordering follows from theirs.
+
+    @type  paths: C{iterable} of C{iterable} of C{unicode}
+    @param paths: Paths involved in each action, in the order the actions are
+        to be undone.
+
+    @rtype:  C{list} of C{set} of C{int}
+    @return: Indexes of the actions each action must wait for.
+    """
+    lastInvolved = {}
+    beneath = {}
+    result = []
+    for index, involved in enumerate(paths):
+        dependencies = set()
+        for path in involved:
+            if path in lastInvolved:
+                dependencies.add(lastInvolved[path])
+            dependencies.update(beneath.pop(path, ()))
+            for parent in _ancestors(path):
+                if parent in lastInvolved:
+                    dependencies.add(lastInvolved[parent])
+
+        for path in involved:
+            lastInvolved[path] = index
+            for parent in _ancestors(path):
+                beneath.setdefault(parent, set()).add(index)
+
+        dependencies.discard(index)
+        result.append(dependencies)
+    return result
+
+
+
+class ParallelUndo(object):
+    """
+    Undo actions from a changeset concurrently, on a thread pool, only
+    ordering the actions that conflict according to L{undoDependencies}.
+
+    Actions are adapted to L{renamer.irenamer.IRenamingAction} and the store
+    updated only in the reactor thread, all the undone actions are removed
+    from the changeset in a single transaction once undoing is complete.
+
+    @type changeset: L{renamer.history.Changeset}
+
+    @type actions: C{list} of L{renamer.history.Action}
+    @ivar actions: Actions to undo, in the order they would be undone one at a
+        time.
+
+    @type concurrency: C{int}
+    @ivar concurrency: Maximum number of actions to undo at once.
+
+    @type ignoreErrors: C{bool}
+    @ivar ignoreErrors: Continue undoing other actions when one fails with an
+        C{OSError}, rather than stopping.
+
+    @type undone: C{list} of L{renamer.history.Action}
+    @ivar undone: Actions that have been undone successfully.
+    """
+    def __init__(self, changeset, actions, options, concurrency=4,
+                 ignoreErrors=False, runInThread=None,
+                 _adapter=IRenamingAction):
+        self.changeset = changeset
+        self.actions = list(actions)
+        self.options = options
+        self.concurrency = concurrency
+        self.ignoreErrors = ignoreErrors
+        self.runInThread = runInThread
+        self.undone = []
+        self._adapter = _adapter
+
+
+    def run(self):
+        """
+        Undo the actions.
+
+        @rtype:  C{Deferred}
+        @return: Fires with the list of actions undone, or fails with the
+            first error encountered, once no actions are being undone and the
+            undone actions have been removed from the changeset.
+        """
+        runner = None
+        if self.runInThread is None:
+            runner = self.runInThread = util.ThreadRunner(
+                self.concurrency, 'renamer-undo')
+
+        dependencies = undoDependencies(
+            (action.src, action.dst) for action in self.actions)
+        self._waiting = map(len, dependencies)
+        self._dependents = [[] for _ in self.actions]
+        for index, deps in enumerate(dependencies):
+            for dep in deps:
+                self._dependents[dep].append(index)
+        self._ready = deque(
+            index for index, waiting in enumerate(self._waiting)
+            if not waiting)
+        self._active = 0
+        self._failure = None
+        self._done = Deferred()
+        self._pump()
+
+        def _stopThreads(result):
+            if runner is not None:
+                runner.stop()
+            return result
+        return self._done.addBoth(_stopThreads)
+
+
+    def _pump(self):
+        while (self._failure is None and self._ready and
+               self._active < self.concurrency):
+            index = self._ready.popleft()
+            self._start(index)
+
+        if not self._active and (self._failure is not None or
+                                 not self._ready):
+            self._finish()
+
+
+    def _start(self, index):
+        action = self.actions[index]
+        logging.msg(
+            'Undo: %s', logging.Lazy(action.asHumanly), verbosity=3)
+        renamingAction = self._adapter(action)
+        self._active += 1
+        d = self.runInThread(renamingAction.undo, self.options)
+        d.addCallbacks(self._undone, self._failed,
+                       callbackArgs=(index,), errbackArgs=(index,))
+        d.addCallback(self._release, index)
+
+
+    def _undone(self, result, index):
+        self.undone.append(self.actions[index])
+
+
+    def _failed(self, f, index):
+        if self.ignoreErrors and f.check(OSError):
+            logging.msg('Ignoring %r', f.value, verbosity=3)
+        elif self._failure is None:
+            self._failure = f
+        else:
+            logging.err(f, 'Undo failed')
+
+
+    def _release(self, ignored, index):
+        self._active -= 1
+        for dependent in self._dependents[index]:
+            self._waiting[dependent] -= 1
+            if not self._waiting[dependent]:
+                self._ready.append(dependent)
+        self._pump()
+
+
+    def _finish(self):
+        if self._done.called:
+            return
+        self.changeset.forgetActions(self.undone)
+        logging.msg(
+            'Removed %d undone action(s) from history', len(self.undone),
+            verbosity=4)
+        if self._failure is not None:
+            self._done.errback(self._failure)
+        else:
+            self._done.callback(self.undone)
+
+
+
+declareLegacyItem(Changeset.typeName, 1, dict(
+    created=timestamp(),
+    modified=timestamp(),
+    history=reference()))
+
+
+
+def changeset1to2(old):
+    """
+    Upgrade a L{renamer.history.Changeset} to count its actions.
+    """
+    actionCount = old.store.query(
+        Action, Action.changeset == old).count()
+    return old.upgradeVersion(
+        Changeset.typeName, 1, 2,
+        created=old.created,
+        modified=old.modified,
+        history=old.history,
+        actionCount=actionCount)
+
+registerUpgrader(changeset1to2, Changeset.typeName, 1, 2)
+
+
+
+def vacuumStore(store):
+    """
+    Rebuild a store's database, returning the space freed by deleted items to
+    the filesystem.
+    """
+    store.createSQL('VACUUM')
+
+
+
+def upgradeStore(store):
+    """
+    Upgrade all the items in a store to their current schema versions.
+
+    Axiom normally upgrades items in the background, via a service that
+    Renamer never starts, so upgrades are performed here before the store is
+    used.
+    """
+    if store._upgradeManager.upgradesPending:
+        # Legacy tables are always reported as pending, even once they are
+        # empty, so only mention upgrades that actually happen.
+        batches = 0
+        for _ in store._upgradeManager.upgradeBatch(100):
+            batches += 1
+        if batches:
+            logging.msg('Upgraded history', verbosity=2)
+
+
+
+class BatchedChangeset(object):
+    """
+    Perform actions for a changeset, committing them to the store in batches.
+
+    Actions are only recorded, in memory, once they have been successfully
+    performed and are written to the store, in a single transaction, when
+    C{size} actions are pending or C{interval} milliseconds have passed since
+    the oldest pending action was performed. This ensures that the undo history
+    never refers to an action that did not happen; however actions performed
+    since the last commit will be missing from the history if the process is
+    abruptly terminated.
+
+    @type changeset: L{renamer.history.Changeset}
+    @ivar changeset: Changeset to commit actions to, or C{None} to create one
+        with C{changesetFactory} when actions are first committed.
+
+    @type changesetFactory: C{callable}
+    @ivar changesetFactory: Called with no arguments to create the changeset
+        to commit actions to, allowing the store to be left alone until
+        there is something to commit.
+
+    @type size: C{int}
+    @ivar size: Number of pending actions that triggers a commit, or C{0} to
+        never commit based on the number of pending actions.
+
+    @type interval: C{int}
+    @ivar interval: Milliseconds after which pending actions are committed, or
+        C{None} to never commit based on time.
+
+    @ivar clock: L{twisted.internet.interfaces.IReactorTime} provider used to
+        schedule time-based commits.
+
+    @type runInThread: C{callable}
+    @ivar runInThread: Called with a function, and its arguments, to perform
+        each action in a thread and return a C{Deferred} that fires in the
+        reactor thread, such as L{renamer.util.ThreadRunner}; or C{None} to
+        perform actions in the calling thread. Performed actions are always
+        recorded in the reactor thread.
+
+    @type _pending: C{list} of C{(unicode, unicode, unicode, Time)}
+    @ivar _pending: Performed actions that have not yet been committed.
+
+    @type _destinations: C{set} of C{unicode}
+    @ivar _destinations: Destination paths of the actions currently being
+        performed. Checking that a destination does not exist and then
+        renaming to it is not atomic, so while an action is in flight no
+        other action may target the same destination.
+    """
+    def __init__(self, changeset=None, size=1, interval=None, clock=reactor,
+                 changesetFactory=None, runInThread=None):
+        if changeset is None and changesetFactory is None:
+            raise ValueError('A changeset or changeset factory is required')
+        self.changeset = changeset
+        self.changesetFactory = changesetFactory
+        self.size = size
+        self.interval = interval
+        self.clock = clock
+        self.runInThread = runInThread
+        self._pending = []
+        self._delayedCall = None
+        self._destinations = set()
+
+
+    def __len__(self):
+        return len(self._pending)
+
+
+    def do(self, name, src, dst, options, _getAction=getActionByName):
+        """
+        Perform an action and queue it to be committed.
+
+        @type  name: C{unicode}
+        @param name: Action name.
+
+        @type  src: L{twisted.python.filepath.FilePath}
+
+        @type  dst: L{twisted.python.filepath.FilePath}
+
+        @type  options: L{twisted.python.usage.Options}
+
+        @rtype:  C{Deferred}
+        @return: A deferred that fires once the action has been performed and
+            queued, or fails if performing it failed. Fails with
+            L{renamer.errors.NoClobber} if another action to the same
+            destination is still being performed.
+        """
+        if dst.path in self._destinations:
+            msg = ('Refusing to clobber file "%s" that another action is '
+                   'renaming to' % (dst.path,))
+            logging.msg(msg)
+            return fail(errors.NoClobber(msg))
+
+        try:
+            # Make sure the action can be recorded before performing it.
+            record = unicode(name), _textPath(src), _textPath(dst)
+            renamingAction = _getAction(name)(src=src, dst=dst)
+        except:
+            return fail()
+
+        self._destinations.add(dst.path)
+        if self.runInThread is None:
+            d = maybeDeferred(renamingAction.do, options)
+        else:
+            d = self.runInThread(renamingAction.do, options)
+        d.addBoth(self._released, dst)
+        d.addCallback(self._performed, record)
+        return d
+
+
+    def _released(self, result, dst):
+        """
+        Allow other actions to target C{dst} again, once an action involving it
+        is no longer in flight.
+        """
+        self._destinations.discard(dst.path)
+        return result
+
+
+    def _performed(self, ignored, (name, src, dst)):
+        """
+        Queue a performed action to be committed.
+        """
+        self._pending.append((name, src, dst, Time()))
+
+        if self.size and len(self._pending) >= self.size:
+            self.flush()
+        elif self.interval is not None and self._delayedCall is None:
+            self._delayedCall = self.clock.callLater(
+                self.interval / 1000.0, self.flush)
+
+
+    def flush(self):
+        """
+        Commit all pending actions to the store in a single transaction.
+
+        If the transaction fails, the actions remain pending and the error is
+        raised.
+
+        @rtype:  C{int}
+        @return: Number of actions committed.
+        """
+        if self._delayedCall is not None:
+            if self._delayedCall.active():
+                self._delayedCall.cancel()
+            self._delayedCall = None
+
+        pending, self._pending = self._pending, []
+        if pending:
+            try:
+                if self.changeset is None:
+                    self.changeset = self.changesetFactory()
+                self.changeset.store.transact(self._commit, pending)
+            except:
+                # Keep the actions to try committing them again, rather than
+                # losing the history of files that have already been renamed.
+                self._pending[:0] = pending
+                raise
+            logging.msg(
+                'Committed %d action(s) to history', len(pending),
+                verbosity=4)
+        return len(pending)
+
+
+    def _commit(self, pending):
+        store = self.changeset.store
+        for name, src, dst, created in pending:
+            Action(
+                store=store,
+                name=name,
+                src=src,
+                dst=dst,
+                created=created,
+                changeset=self.changeset)
+        self.changeset.actionCount += len(pending)
+        self.changeset.modified = Time()
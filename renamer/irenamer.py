@@ -42,6 +42,12 @@ class IRenamingCommand(ICommand):
     """)
 
 
+    placeholders = Attribute("""
+    Names of the placeholders available to templates, or C{None} if templates
+    should not be checked.
+    """)
+
+
     def processArgument(argument):
         """
         Process an argument.
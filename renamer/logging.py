@@ -41,7 +41,75 @@ class RenamerObserver(object):
 
 
 
-def msg(message, **kw):
+class Lazy(object):
+    """
+    Format argument for L{msg} that is only computed if the message is
+    emitted.
+    """
+    def __init__(self, f, *a, **kw):
+        self.f = f
+        self.a = a
+        self.kw = kw
+
+
+    def __call__(self):
+        return self.f(*self.a, **self.kw)
+
+
+
+_observer = None
+
+
+
+def startLogging(verbosity=1):
+    """
+    Start logging with a L{RenamerObserver}.
+
+    Messages more verbose than the observer's C{verbosity} are discarded by
+    L{msg} before they are formatted.
+
+    @rtype:  L{RenamerObserver}
+    @return: The observer, whose C{verbosity} may be changed later.
+    """
+    global _observer
+    _observer = RenamerObserver(verbosity)
+    log.startLoggingWithObserver(_observer.emit, setStdout=False)
+    return _observer
+
+
+
+def isEnabled(verbosity=1):
+    """
+    Will messages of C{verbosity} be emitted?
+
+    Without a L{RenamerObserver} started by L{startLogging} every message is
+    emitted, for the benefit of other log observers.
+    """
+    return _observer is None or _observer.verbosity >= verbosity
+
+
+
+def msg(message, *args, **kw):
+    """
+    Log a message.
+
+    Format arguments, if any, are only substituted into C{message} if it is
+    going to be emitted, so that messages which are too verbose cost nothing
+    to format.
+
+    @type  message: C{str} or C{unicode}
+    @param message: Message, or format string if C{args} are given.
+
+    @param *args: Format arguments for C{message}, L{Lazy} arguments are
+        computed before being substituted.
+
+    @param verbosity: Verbosity level of the message, defaults to 1.
+    """
+    if not isEnabled(kw.get('verbosity', 1)):
+        return
+    if args:
+        message = message % tuple(
+            arg() if isinstance(arg, Lazy) else arg for arg in args)
     # Passing unicode to log.msg is not supported, don't do it.
     if isinstance(message, unicode):
         codec = (
@@ -0,0 +1,159 @@
+"""
+Planning of bulk renames.
+"""
+import os
+
+from renamer import errors, logging
+
+
+
+class RenamePlan(object):
+    """
+    Collect renames and determine a safe order to perform them in.
+
+    Conflicts, such as duplicate destinations or destinations that already
+    exist, are detected before anything is renamed. When sources are vacated
+    by renaming, a rename may target the source of another, in which case that
+    rename is performed first; renames that form a cycle, such as swapping two
+    names, are broken by renaming one source to a temporary name.
+
+    @type sourcesVacated: C{bool}
+    @ivar sourcesVacated: Do sources cease to exist once renamed? This is not
+        the case when symlinks are created at sources or destinations.
+
+    @type renames: C{dict} mapping L{twisted.python.filepath.FilePath} to
+        L{twisted.python.filepath.FilePath}
+    @ivar renames: Mapping of destinations to sources.
+    """
+    def __init__(self, sourcesVacated=True):
+        self.sourcesVacated = sourcesVacated
+        self.renames = {}
+        self._sources = {}
+
+
+    def __len__(self):
+        return len(self.renames)
+
+
+    def add(self, src, dst):
+        """
+        Add a rename to the plan.
+
+        @type  src: L{twisted.python.filepath.FilePath}
+
+        @type  dst: L{twisted.python.filepath.FilePath}
+
+        @raise renamer.errors.ConflictingRenames: If C{dst} is already the
+            destination of a different source, or C{src} is already being
+            renamed to a different destination.
+        """
+        if src == dst:
+            logging.msg('Skipping noop "%s"', src.path, verbosity=2)
+            return
+
+        existing = self.renames.get(dst)
+        if existing is not None and existing != src:
+            raise errors.ConflictingRenames(
+                'Both "%s" and "%s" would be renamed to "%s"' % (
+                    existing.path, src.path, dst.path))
+        existing = self._sources.get(src)
+        if existing is not None and existing != dst:
+            raise errors.ConflictingRenames(
+                '"%s" would be renamed to both "%s" and "%s"' % (
+                    src.path, existing.path, dst.path))
+        self.renames[dst] = src
+        self._sources[src] = dst
+
+
+    def _checkDestinations(self, listdir=os.listdir):
+        """
+        Ensure no destination already exists, unless it is a source that will
+        be vacated before it is renamed to.
+
+        Each destination directory is only listed once, rather than checking
+        each destination individually.
+        """
+        listings = {}
+        for dst in sorted(self.renames):
+            if self.sourcesVacated and dst in self._sources:
+                continue
+            parent = dst.dirname()
+            if parent not in listings:
+                try:
+                    listings[parent] = set(listdir(parent))
+                except OSError:
+                    listings[parent] = set()
+            if dst.basename() in listings[parent]:
+                msg = 'Refusing to clobber existing file "%s"' % (dst.path,)
+                logging.msg(msg)
+                raise errors.NoClobber(msg)
+
+
+    def groups(self, listdir=os.listdir):
+        """
+        Determine the order to perform renames in, as groups of renames that
+        do not depend on any other group.
+
+        The renames in each group must be performed one at a time, in order,
+        but different groups can be performed concurrently. Groups are ordered
+        by destination, so that renames into the same directory happen
+        together.
+
+        @raise renamer.errors.NoClobber: If a destination already exists.
+
+        @rtype:  C{list} of C{list} of C{(FilePath, FilePath)}
+        @return: Groups of C{(src, dst)} pairs, in the order they should be
+            renamed.
+        """
+        self._checkDestinations(listdir)
+
+        if not self.sourcesVacated:
+            return [[(self.renames[dst], dst)] for dst in sorted(self.renames)]
+
+        groups = []
+        remaining = set(self.renames)
+
+        def _chain(dst):
+            # Renames that free up the destination of the previous one.
+            steps = []
+            while dst in remaining:
+                remaining.remove(dst)
+                src = self.renames[dst]
+                steps.append((src, dst))
+                dst = src
+            return steps
+
+        # Chains start with a destination that is not also a source.
+        for dst in sorted(self.renames):
+            if dst not in self._sources:
+                groups.append((dst, _chain(dst)))
+
+        # Everything else is part of a cycle.
+        for dst in sorted(remaining):
+            if dst not in remaining:
+                continue
+            src = self.renames[dst]
+            temporary = src.temporarySibling()
+            logging.msg(
+                'Breaking rename cycle with "%s"', temporary.path,
+                verbosity=2)
+            remaining.remove(dst)
+            steps = [(src, temporary)]
+            steps.extend(_chain(src))
+            steps.append((temporary, dst))
+            groups.append((dst, steps))
+
+        groups.sort()
+        return [steps for dst, steps in groups]
+
+
+    def steps(self, listdir=os.listdir):
+        """
+        Determine the order to perform renames in, one at a time.
+
+        @see: L{groups}
+
+        @rtype:  C{list} of C{(FilePath, FilePath)}
+        @return: C{(src, dst)} pairs, in the order they should be renamed.
+        """
+        return [step for steps in self.groups(listdir) for step in steps]
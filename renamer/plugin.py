@@ -1,5 +1,6 @@
+import errno
+import json
 import os
-import string
 import sys
 from zope.interface import noLongerProvides
 
@@ -7,10 +8,11 @@ from twisted.plugin import getPlugins, IPlugin
 from twisted.internet import defer
 from twisted.python import usage
 from twisted.python.filepath import FilePath
+from twisted.python.reflect import namedAny, qual
 
-from renamer import errors, logging, plugins
+from renamer import __version__, errors, logging, plugins
 from renamer.irenamer import ICommand, IRenamingCommand, IRenamingAction
-from renamer.util import InterfaceProvidingMetaclass
+from renamer.util import CompiledTemplate, InterfaceProvidingMetaclass
 
 
 
@@ -38,6 +40,42 @@ def getActions():
 
 
 
+_actionRegistry = None
+
+
+
+def getActionRegistry():
+    """
+    Get the process-wide registry of L{renamer.irenamer.IRenamingAction}s,
+    building it on first use.
+
+    Finding actions imports and inspects plugins, which is far too slow to do
+    for every action performed or undone; call L{invalidateActionRegistry} if
+    the available actions change.
+
+    @rtype:  C{dict} mapping C{unicode} to L{renamer.irenamer.IRenamingAction}
+    @return: Mapping of action names to actions.
+    """
+    global _actionRegistry
+    if _actionRegistry is None:
+        registry = {}
+        for action in getActions():
+            registry.setdefault(action.name, action)
+        _actionRegistry = registry
+    return _actionRegistry
+
+
+
+def invalidateActionRegistry():
+    """
+    Discard the action registry, so that it is built again the next time it
+    is needed.
+    """
+    global _actionRegistry
+    _actionRegistry = None
+
+
+
 def getActionByName(name):
     """
     Get an L{renamer.irenamer.IRenamingAction} by name.
@@ -50,11 +88,227 @@ def getActionByName(name):
 
     @rtype: L{renamer.irenamer.IRenamingAction}
     """
-    for action in getActions():
-        if action.name == name:
-            return action
+    try:
+        return getActionRegistry()[name]
+    except KeyError:
+        raise errors.NoSuchAction(name)
+
+
+
+class IndexedPlugin(object):
+    """
+    A plugin described by a L{PluginIndex}, that has not necessarily been
+    imported yet.
+
+    @type name: C{str}
+    @ivar name: Plugin name, as used on the command line.
+
+    @type description: C{str}
+    @ivar description: Brief description of the plugin.
+
+    @type interfaces: C{list} of C{str}
+    @ivar interfaces: Fully-qualified names of the plugin interfaces the
+        plugin provides.
+
+    @type module: C{str}
+    @ivar module: Fully-qualified name of the module defining the plugin.
+
+    @type attribute: C{str}
+    @ivar attribute: Name of the plugin in C{module}.
+    """
+    def __init__(self, name, description, interfaces, module, attribute):
+        self.name = name
+        self.description = description
+        self.interfaces = interfaces
+        self.module = module
+        self.attribute = attribute
+
+
+    def __repr__(self):
+        return '<%s name=%r interfaces=%r plugin=%r>' % (
+            type(self).__name__,
+            self.name,
+            self.interfaces,
+            self.fqpn)
+
+
+    @property
+    def fqpn(self):
+        """
+        Fully-qualified Python name of the plugin.
+        """
+        return '%s.%s' % (self.module, self.attribute)
+
+
+    def asDict(self):
+        """
+        Serialize this plugin description for storing in an index.
+        """
+        return dict(
+            name=self.name,
+            description=self.description,
+            interfaces=self.interfaces,
+            module=self.module,
+            attribute=self.attribute)
+
+
+    def load(self):
+        """
+        Import and return the plugin.
+        """
+        return namedAny(self.fqpn)
+
+
+
+class PluginIndex(object):
+    """
+    Persistent index of available Renamer plugins.
+
+    Finding plugins with L{twisted.plugin.getPlugins} imports every plugin
+    module, and their dependencies, which makes up most of Renamer's startup
+    time. The index records enough about each plugin to list and select it
+    without importing it, and is rebuilt when the plugin modules or Renamer's
+    version change.
+
+    @type path: L{twisted.python.filepath.FilePath}
+    @ivar path: Path to the index file, or C{None} to not persist the index.
+
+    @type package: C{module}
+    @ivar package: Plugin package to index.
+    """
+    formatVersion = 1
+
+
+    interfaces = [ICommand, IRenamingCommand, IRenamingAction]
 
-    raise errors.NoSuchAction(name)
+
+    def __init__(self, path=None, package=plugins):
+        self.path = path
+        self.package = package
+        self._plugins = None
+
+
+    def sources(self):
+        """
+        Find the plugin modules in the plugin package.
+
+        @rtype:  C{dict} mapping C{unicode} to C{float}
+        @return: Mapping of plugin module paths to their modification times.
+        """
+        sources = {}
+        for directory in self.package.__path__:
+            directory = FilePath(directory)
+            if not directory.isdir():
+                continue
+            for child in directory.globChildren('*.py'):
+                sources[unicode(child.path)] = child.getModificationTime()
+        return sources
+
+
+    def scan(self):
+        """
+        Find the available plugins by importing every plugin module.
+
+        @rtype:  C{list} of L{IndexedPlugin}
+        """
+        logging.msg('Scanning for plugins', verbosity=4)
+        result = []
+        byName = {}
+        for interface in self.interfaces:
+            for plg in getPlugins(interface, self.package):
+                fqpn = qual(plg)
+                if fqpn not in byName:
+                    try:
+                        byName[fqpn] = IndexedPlugin(
+                            name=plg.name,
+                            description=getattr(plg, 'description', None),
+                            interfaces=[],
+                            module=plg.__module__,
+                            attribute=plg.__name__)
+                    except AttributeError:
+                        raise RuntimeError('Malformed plugin: %r' % (plg,))
+                    result.append(byName[fqpn])
+                byName[fqpn].interfaces.append(qual(interface))
+        return result
+
+
+    def read(self, sources):
+        """
+        Read the index file, if it is still valid.
+
+        @type  sources: C{dict}
+        @param sources: Current plugin module modification times, as returned
+            by L{sources}.
+
+        @rtype:  C{list} of L{IndexedPlugin}
+        @return: Indexed plugins or C{None} if the index is missing or out of
+            date.
+        """
+        if self.path is None or not self.path.exists():
+            return None
+
+        try:
+            index = json.loads(self.path.getContent())
+            if (index['formatVersion'] != self.formatVersion or
+                index['version'] != __version__ or
+                index['sources'] != sources):
+                return None
+            return [IndexedPlugin(**dict((str(k), v) for k, v in p.items()))
+                    for p in index['plugins']]
+        except (IOError, ValueError, KeyError, TypeError):
+            logging.msg('Ignoring unreadable plugin index "%s"',
+                        self.path.path, verbosity=3)
+            return None
+
+
+    def write(self, sources, indexed):
+        """
+        Write the index file.
+
+        Failing to write the index is not fatal, the plugins will just be
+        scanned for again next time.
+        """
+        if self.path is None:
+            return
+
+        index = dict(
+            formatVersion=self.formatVersion,
+            version=__version__,
+            sources=sources,
+            plugins=[p.asDict() for p in indexed])
+        try:
+            if not self.path.parent().exists():
+                self.path.parent().makedirs()
+            self.path.setContent(json.dumps(index))
+        except (IOError, OSError), e:
+            logging.msg('Unable to write plugin index "%s": %s',
+                        self.path.path, e, verbosity=3)
+
+
+    def plugins(self):
+        """
+        Get all indexed plugins, reading or rebuilding the index on first use.
+
+        @rtype: C{list} of L{IndexedPlugin}
+        """
+        if self._plugins is None:
+            sources = self.sources()
+            indexed = self.read(sources)
+            if indexed is None:
+                indexed = self.scan()
+                self.write(sources, indexed)
+            self._plugins = indexed
+        return self._plugins
+
+
+    def getPlugins(self, interface):
+        """
+        Get indexed plugins that provide a particular interface.
+
+        @rtype: C{iterable} of L{IndexedPlugin}
+        """
+        interface = qual(interface)
+        return (p for p in self.plugins() if interface in p.interfaces)
 
 
 
@@ -127,13 +381,71 @@ class RenamingCommand(_CommandMixin, usage.Options):
     defaultNameTemplate = None
 
 
+    placeholders = None
+
+
+    _templates = None
+
+
+    def compileTemplates(self, options):
+        """
+        Compile the destination templates for this run.
+
+        The C{'prefix'} command-line option (defaulting to
+        L{defaultPrefixTemplate}) and the C{'name'} command-line option
+        (defaulting to L{defaultNameTemplate}) are compiled into
+        L{renamer.util.CompiledTemplate}s once, rather than being parsed for
+        every argument, and their placeholders checked against
+        L{placeholders}, if the command specifies them.
+
+        @type  options: C{dict}
+
+        @raise usage.UsageError: If a template uses a placeholder the command
+            does not provide.
+        """
+        templates = []
+        for key, default in [('prefix', self.defaultPrefixTemplate),
+                             ('name', self.defaultNameTemplate)]:
+            template = options[key]
+            if template is None:
+                template = default
+            if template is not None:
+                template = CompiledTemplate(template)
+                if self.placeholders is not None:
+                    unknown = template.placeholders - set(self.placeholders)
+                    if unknown:
+                        raise usage.UsageError(
+                            'Unknown placeholder(s) in %s template: %s '
+                            '(available placeholders are: %s)' % (
+                                key,
+                                ', '.join(sorted(unknown)),
+                                ', '.join(self.placeholders)))
+            templates.append(template)
+        self._templates = templates
+        self._prefixes = {}
+
+
+    def beginRun(self, options):
+        """
+        Prepare for a run, before any argument is processed.
+
+        The destination templates are compiled with L{compileTemplates},
+        commands with anything else to prepare should extend this.
+
+        @type  options: C{dict}
+        """
+        self.compileTemplates(options)
+
+
     def buildDestination(self, mapping, options, src):
         """
         Build a destination path.
 
         Substitution of C{mapping} into the C{'prefix'} command-line option
         (defaulting to L{defaultPrefixTemplate}) and the C{'name'} command-line
-        option (defaulting to L{defaultNameTemplate}) is performed.
+        option (defaulting to L{defaultNameTemplate}) is performed, the
+        templates are compiled with L{compileTemplates} if they have not been
+        already.
 
         @type  mapping: C{dict} mapping C{str} to C{unicode}
         @param mapping: Mapping of template variables, used for template
@@ -147,29 +459,26 @@ class RenamingCommand(_CommandMixin, usage.Options):
         @rtype:  L{twisted.python.filepath.FilePath}
         @return: Destination path.
         """
-        prefixTemplate = options['prefix']
-        if prefixTemplate is None:
-            prefixTemplate = self.defaultPrefixTemplate
+        if self._templates is None:
+            self.compileTemplates(options)
+        prefixTemplate, nameTemplate = self._templates
 
         if prefixTemplate is not None:
-            prefix = os.path.expanduser(
-                prefixTemplate.safe_substitute(mapping))
+            prefix = prefixTemplate.substitute(mapping)
+            parent = self._prefixes.get(prefix)
+            if parent is None:
+                parent = self._prefixes[prefix] = FilePath(
+                    os.path.expanduser(prefix))
         else:
-            prefixTemplate = string.Template(src.dirname())
-            prefix = prefixTemplate.template
+            parent = src.parent()
 
         ext = src.splitext()[-1]
-
-        nameTemplate = options['name']
-        if nameTemplate is None:
-            nameTemplate = self.defaultNameTemplate
-
-        filename = nameTemplate.safe_substitute(mapping)
+        filename = nameTemplate.substitute(mapping)
         logging.msg(
-            'Building filename: prefix=%r  name=%r  mapping=%r' % (
-                prefixTemplate.template, nameTemplate.template, mapping),
+            'Building filename: prefix=%r  name=%r  mapping=%r',
+            parent.path, nameTemplate.template, mapping,
             verbosity=3)
-        return FilePath(prefix).child(filename).siblingExtension(ext)
+        return parent.child(filename).siblingExtension(ext)
 
 
     def parseArgs(self, *args):
@@ -183,7 +492,7 @@ class RenamingCommand(_CommandMixin, usage.Options):
 
     def process(self, renamer, options):
         arg = renamer.currentArgument
-        logging.msg('Processing "%s"' % (arg.path,),
+        logging.msg('Processing "%s"', arg.path,
                     verbosity=3)
         d = defer.maybeDeferred(self.processArgument, arg)
         d.addCallback(self.buildDestination, options, arg)
@@ -228,14 +537,40 @@ class RenamingAction(object):
             self.dst)
 
 
-    def makedirs(self, parent):
+    def makedirs(self, parent, cache=None):
         """
         Create any directory structure that does not yet exist.
+
+        @type  cache: L{renamer.util.DirectoryCache}
+        @param cache: Directories known to exist, which are not checked again,
+            or C{None} to always check.
         """
+        if cache is not None and parent in cache:
+            return
+
         if not parent.exists():
-            logging.msg('Creating directory structure for "%s"' % (
-                parent.path,), verbosity=2)
-            parent.makedirs()
+            logging.msg('Creating directory structure for "%s"',
+                        parent.path, verbosity=2)
+            try:
+                parent.makedirs()
+            except OSError, e:
+                # Another action may have created it in the meantime.
+                parent.changed()
+                if e.errno != errno.EEXIST or not parent.isdir():
+                    raise
+
+        if cache is not None:
+            cache.add(parent)
+
+
+    def forgetDirectory(self, dst, options):
+        """
+        Forget that the directory containing C{dst} is known to exist, after
+        an action involving it failed because it no longer does.
+        """
+        cache = getattr(options, 'directoryCache', None)
+        if cache is not None:
+            cache.discard(dst.parent())
 
 
     def checkExisting(self, dst):
@@ -255,12 +590,16 @@ class RenamingAction(object):
 
         The following preparations are done:
 
-            * Check that C{dst} does not already exist.
+            * Check that C{dst} does not already exist, unless C{options} has
+              a true C{destinationsChecked} attribute, such as when a
+              L{renamer.planner.RenamePlan} already checked every destination.
 
-            * Create any directory structure required for C{dst}.
+            * Create any directory structure required for C{dst}, unless
+              C{options} has a C{directoryCache} that knows it exists.
         """
-        self.checkExisting(dst)
-        self.makedirs(dst.parent())
+        if not getattr(options, 'destinationsChecked', False):
+            self.checkExisting(dst)
+        self.makedirs(dst.parent(), getattr(options, 'directoryCache', None))
 
 
     # IRenamingAction
@@ -1,3 +1,5 @@
+import errno
+
 from renamer import logging, util
 from renamer.plugin import RenamingAction
 
@@ -9,15 +11,24 @@ class MoveAction(RenamingAction):
 
     If the source and destination are on different logical devices a
     copy-delete will be used, unless the C{'one-file-system'} option is
-    specified.
+    specified. The copy is verified before the original is deleted with the
+    C{'verify'} option.
     """
     name = 'move'
 
 
     def _move(self, src, dst, options):
         self.prepare(dst, options)
-        logging.msg('Move: %s => %s' % (src.path, dst.path))
-        util.rename(src, dst, oneFileSystem=options['one-file-system'])
+        logging.msg('Move: %s => %s', src.path, dst.path)
+        try:
+            util.rename(
+                src, dst,
+                oneFileSystem=options['one-file-system'],
+                verify=options.get('verify', False))
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                self.forgetDirectory(dst, options)
+            raise
 
 
     # IRenamingAction
@@ -42,11 +53,16 @@ class SymlinkAction(RenamingAction):
 
     def do(self, options):
         self.prepare(self.dst, options)
-        logging.msg('Symlink: %s => %s' % (self.src.path, self.dst.path))
-        self.src.linkTo(self.dst)
+        logging.msg('Symlink: %s => %s', self.src.path, self.dst.path)
+        try:
+            self.src.linkTo(self.dst)
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                self.forgetDirectory(self.dst, options)
+            raise
 
 
     def undo(self, options):
         if self.dst.islink():
-            logging.msg('Symlink: Removing %s' % (self.dst.path,))
+            logging.msg('Symlink: Removing %s', self.dst.path)
             self.dst.remove()
@@ -1,4 +1,8 @@
+import json
+import os
 import string
+import sys
+from collections import OrderedDict
 from functools import partial
 
 try:
@@ -7,9 +11,324 @@ try:
 except ImportError:
     mutagen = None
 
+from axiom.attributes import (
+    AND, compoundIndex, ieee754_double, integer, text)
+from axiom.item import Item
+from axiom.store import Store
+
+from twisted.internet import reactor
+
 from renamer import logging
 from renamer.plugin import RenamingCommand
 from renamer.errors import PluginError
+from renamer.util import LRUCache, ProcessPool
+
+
+
+_missing = object()
+
+
+
+def extractTags(metadata, tagNames):
+    """
+    Extract the first value of specific tags from audio metadata.
+
+    @param metadata: Metadata returned by C{mutagen.File}, or C{None}.
+
+    @type  tagNames: C{iterable} of C{unicode}
+    @param tagNames: Names of the tags to extract.
+
+    @rtype:  C{dict} mapping C{unicode} to C{list} of C{unicode}
+    @return: Mapping of the names of the tags present in C{metadata} to their
+        first value, indexable in the same way as C{metadata} itself.
+    """
+    tags = {}
+    if metadata is not None:
+        for tagName in tagNames:
+            value = firstTag(metadata, [tagName], None)
+            if value is not None:
+                tags[tagName] = [value]
+    return tags
+
+
+
+def readTags(filename, tagNames):
+    """
+    Read specific tags from an audio file, suitable for calling in a worker
+    process.
+
+    @type  filename: C{unicode}
+
+    @type  tagNames: C{iterable} of C{unicode}
+
+    @rtype:  C{dict}
+    @return: Tags, as returned by L{extractTags}.
+    """
+    return extractTags(mutagen.File(filename), tagNames)
+
+
+
+def firstTag(metadata, tagNames, default=u'UNKNOWN'):
+    """
+    Get the first value of the first present tag from audio metadata.
+
+    @param metadata: Metadata returned by C{mutagen.File} or L{extractTags}.
+
+    @type  tagNames: C{list} of C{unicode}
+    @param tagNames: Names of the tags to attempt, in order.
+
+    @return: Tag value as C{unicode} or C{default}.
+    """
+    for tagName in tagNames:
+        try:
+            return unicode(metadata[tagName][0])
+        except KeyError:
+            pass
+    return default
+
+
+
+def metadataSize(metadata):
+    """
+    Estimate the number of bytes of memory used by audio metadata.
+
+    Only tag values and embedded pictures, which account for nearly all of
+    it, are considered.
+
+    @param metadata: Metadata returned by C{mutagen.File} or L{extractTags},
+        or C{None}.
+
+    @rtype: C{int}
+    """
+    size = 256
+    if metadata is None:
+        return size
+
+    tags = getattr(metadata, 'tags', None)
+    if tags is None and isinstance(metadata, dict):
+        tags = metadata
+    for picture in getattr(metadata, 'pictures', None) or []:
+        size += len(picture.data)
+
+    for key, value in (tags or {}).items():
+        data = getattr(value, 'data', None)
+        if data is None:
+            data = repr(value)
+        size += len(key) + len(data)
+    return size
+
+
+
+def _decodePath(filename):
+    """
+    Decode a byte string path with the filesystem encoding.
+    """
+    if isinstance(filename, str):
+        filename = filename.decode(
+            sys.getfilesystemencoding() or 'utf-8', 'replace')
+    return filename
+
+
+
+class TagIndexEntry(Item):
+    """
+    Tags extracted from an audio file, and the identity of the file they were
+    extracted from.
+    """
+    path = text(doc="""
+    Path of the file when its tags were extracted.
+    """, allowNone=False, indexed=True)
+
+
+    device = integer(doc="""
+    Device the file resides on.
+    """, allowNone=False)
+
+
+    inode = integer(doc="""
+    Inode number of the file.
+    """, allowNone=False)
+
+
+    size = integer(doc="""
+    Size of the file in bytes.
+    """, allowNone=False)
+
+
+    mtime = ieee754_double(doc="""
+    Modification time of the file.
+    """, allowNone=False)
+
+
+    tags = text(doc="""
+    JSON-encoded tags, as returned by L{renamer.plugins.audio.extractTags}.
+    """, allowNone=False)
+
+
+    compoundIndex(inode, device, size, mtime)
+
+
+
+class TagIndex(object):
+    """
+    Persistent index of the tags extracted from audio files, so that files
+    that have not changed since they were indexed need not be read again.
+
+    Files are identified by their device, inode, size and modification time,
+    so files that have since been renamed, such as by a previous run, are
+    still found. New entries are written in a single transaction once
+    C{batchSize} of them are pending, or when L{flush} is called, replacing
+    any previous entries for the same path or the same file.
+
+    @type store: L{axiom.store.Store}
+
+    @type batchSize: C{int}
+    @ivar batchSize: Number of pending entries that triggers a write.
+
+    @type maxEntries: C{int}
+    @ivar maxEntries: Maximum number of indexed files, the least recently
+        indexed files are evicted first.
+    """
+    def __init__(self, store, batchSize=100, maxEntries=100000):
+        self.store = store
+        self.batchSize = batchSize
+        self.maxEntries = maxEntries
+        self._pending = []
+
+
+    def identify(self, filename):
+        """
+        Determine the identity of a file.
+
+        @rtype:  C{(int, int, int, float)}
+        @return: The device, inode, size and modification time of the file.
+        """
+        st = os.stat(filename)
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime
+
+
+    def _matching(self, (device, inode, size, mtime)):
+        return AND(TagIndexEntry.inode == inode,
+                   TagIndexEntry.device == device,
+                   TagIndexEntry.size == size,
+                   TagIndexEntry.mtime == mtime)
+
+
+    def get(self, identity, filename=None):
+        """
+        Get the indexed tags for a file.
+
+        @param identity: File identity, as returned by L{identify}.
+
+        @param filename: Current path of the file, if known. If the file was
+            indexed under a different path, the entry is updated to this one.
+
+        @rtype:  C{dict}
+        @return: Indexed tags, or C{None} if the file is not indexed or has
+            changed since it was.
+        """
+        for entry in self.store.query(
+                TagIndexEntry, self._matching(identity), limit=1):
+            tags = json.loads(entry.tags)
+            if filename is not None and entry.path != _decodePath(filename):
+                self.put(filename, identity, tags)
+            return tags
+        return None
+
+
+    def put(self, filename, identity, tags):
+        """
+        Index the tags for a file, replacing any previous entry for the same
+        path or the same file.
+        """
+        self._pending.append((_decodePath(filename), identity, tags))
+        if len(self._pending) >= self.batchSize:
+            self.flush()
+
+
+    def flush(self):
+        """
+        Write all pending entries to the store in a single transaction.
+
+        @rtype:  C{int}
+        @return: Number of entries written.
+        """
+        pending, self._pending = self._pending, []
+        if pending:
+            self.store.transact(self._write, pending)
+            logging.msg(
+                'Indexed tags for %d file(s)', len(pending),
+                verbosity=4)
+        return len(pending)
+
+
+    def _write(self, pending):
+        # Only the last entry for each file in the batch is kept.
+        latest = OrderedDict()
+        for filename, identity, tags in pending:
+            latest.pop(identity[:2], None)
+            latest[identity[:2]] = filename, identity, tags
+        pending = latest.values()
+
+        self.store.query(
+            TagIndexEntry,
+            TagIndexEntry.path.oneOf(
+                filename for filename, identity, tags in pending)
+            ).deleteFromStore()
+        for entry in self.store.query(
+                TagIndexEntry,
+                TagIndexEntry.inode.oneOf(
+                    set(inode for device, inode in latest))):
+            if (entry.device, entry.inode) in latest:
+                entry.deleteFromStore()
+
+        for filename, (device, inode, size, mtime), tags in pending:
+            TagIndexEntry(
+                store=self.store,
+                path=filename,
+                device=device,
+                inode=inode,
+                size=size,
+                mtime=mtime,
+                tags=json.dumps(tags).decode('ascii'))
+
+        excess = self.store.query(TagIndexEntry).count() - self.maxEntries
+        if excess > 0:
+            self.store.query(
+                TagIndexEntry,
+                sort=TagIndexEntry.storeID.ascending,
+                limit=excess).deleteFromStore()
+
+
+    def prune(self, batchSize=500):
+        """
+        Remove entries whose path no longer holds the file, unchanged, that
+        they were indexed from. Entries for files that were renamed since
+        they were last looked up are removed too.
+
+        @rtype:  C{int}
+        @return: Number of entries removed.
+        """
+        self.flush()
+        stale = []
+        for entry in self.store.query(TagIndexEntry):
+            try:
+                identity = self.identify(entry.path)
+            except OSError:
+                identity = None
+            if identity != (entry.device, entry.inode, entry.size,
+                            entry.mtime):
+                stale.append(entry.storeID)
+
+        for i in xrange(0, len(stale), batchSize):
+            self.store.transact(
+                self.store.query(
+                    TagIndexEntry,
+                    TagIndexEntry.storeID.oneOf(stale[i:i + batchSize])
+                    ).deleteFromStore)
+        logging.msg(
+            'Pruned %d stale tag index entries', len(stale), verbosity=2)
+        return len(stale)
 
 
 
@@ -37,20 +356,152 @@ class Audio(RenamingCommand):
         u'${tracknumber}. ${title}')
 
 
+    optFlags = [
+        ('tags-only', None,
+         'Only keep the tag values used for renaming in memory, rather than '
+         'complete metadata including embedded pictures.'),
+        ('no-index', None, 'Do not index the tags read from files.'),
+        ('prune-index', None,
+         'Remove tag index entries for files that no longer exist, or have '
+         'changed, before renaming.')]
+
+
+    optParameters = [
+        ('cache-size', None, 64,
+         'Maximum megabytes of metadata to keep in memory.', int),
+        ('processes', None, 0,
+         'Number of worker processes to read tags in, 0 reads them in the '
+         'main process.', int),
+        ('index', None, '~/.renamer/audio.axiom',
+         'Tag index path.'),
+        ('index-size', None, 100000,
+         'Maximum number of files to index.', int)]
+
+
+    fields = [
+        ('artist', [u'artist', u'TPE1']),
+        ('album', [u'album', u'TALB']),
+        ('title', [u'title', u'TIT2']),
+        ('date', [u'date', u'year', u'TDRC']),
+        ('tracknumber', [u'tracknumber', u'TRCK'])]
+
+
+    placeholders = [field for field, tagNames in fields]
+
+
+    @property
+    def tagNames(self):
+        """
+        Names of every tag used by L{fields}.
+        """
+        return [tagName
+                for field, tagNames in self.fields
+                for tagName in tagNames]
+
+
     def postOptions(self):
         if mutagen is None:
             raise PluginError(
                 'The "mutagen" package is required for this command')
-        self._metadataCache = {}
+        self._metadataCache = LRUCache(
+            self['cache-size'] * 1024 * 1024, sizeOf=metadataSize)
+        self._tagReader = None
+        if self['processes'] > 0:
+            self._tagReader = ProcessPool(
+                partial(readTags, tagNames=self.tagNames),
+                self['processes'])
+        self.index = None
+
+
+    def getIndex(self):
+        """
+        Get the tag index, opening it on first use.
+
+        @rtype:  L{renamer.plugins.audio.TagIndex}
+        @return: The tag index, or C{None} if indexing is disabled.
+        """
+        if self.index is None and not self['no-index']:
+            store = Store(os.path.expanduser(self['index']))
+            self.index = TagIndex(store, maxEntries=self['index-size'])
+            reactor.addSystemEventTrigger(
+                'before', 'shutdown', self.index.flush)
+        return self.index
+
+
+    def beginRun(self, options):
+        """
+        Prepare for a run.
+
+        The tag index is not used at all for C{'no-act'} runs, otherwise with
+        the C{'prune-index'} option it is pruned now, rather than when the
+        first argument is processed.
+        """
+        RenamingCommand.beginRun(self, options)
+        if options['no-act']:
+            logging.msg('Not using the tag index for a trial run', verbosity=4)
+            self['no-index'] = True
+        elif self['prune-index']:
+            index = self.getIndex()
+            if index is not None:
+                index.prune()
+
+
+    def _lookup(self, filename):
+        """
+        Look for file metadata in the metadata cache and then the tag index,
+        without reading the file.
+
+        @return: C{(metadata, identity)}, where C{metadata} is C{_missing} if
+            it was not found and C{identity} is the file identity, as
+            returned by L{renamer.plugins.audio.TagIndex.identify}, if it had
+            to be determined.
+        """
+        metadata = self._metadataCache.get(filename, _missing)
+        if metadata is not _missing:
+            return metadata, None
+
+        index = self.getIndex()
+        if index is None:
+            return _missing, None
+
+        identity = index.identify(filename)
+        tags = index.get(identity, filename)
+        if tags is None:
+            return _missing, identity
+
+        logging.msg('Using indexed tags for "%s"', filename, verbosity=4)
+        self._metadataCache[filename] = tags
+        return tags, identity
+
+
+    def _store(self, filename, identity, metadata):
+        """
+        Cache file metadata and, if C{identity} is known, index its tags.
+
+        @return: C{metadata}
+        """
+        self._metadataCache[filename] = metadata
+        if identity is not None and metadata is not None:
+            self.getIndex().put(
+                filename, identity, extractTags(metadata, self.tagNames))
+        return metadata
 
 
     def _getMetadata(self, filename):
         """
         Get file metadata.
+
+        The tag index is consulted before reading the file. Metadata is kept
+        in a bounded cache, with the C{'tags-only'} option only the tags named
+        by L{fields} are kept.
         """
-        if filename not in self._metadataCache:
-            self._metadataCache[filename] = mutagen.File(filename)
-        return self._metadataCache[filename]
+        metadata, identity = self._lookup(filename)
+        if metadata is _missing:
+            metadata = mutagen.File(filename)
+            if self['tags-only']:
+                metadata = extractTags(metadata, self.tagNames)
+            self._store(filename, identity, metadata)
+        return metadata
 
 
     def getTag(self, path, tagNames, default=u'UNKNOWN'):
@@ -65,16 +516,9 @@ class Audio(RenamingCommand):
 
         @return: Tag value as C{unicode} or C{default}
         """
-        logging.msg('Getting metadata for %r from "%s"' % (tagNames, path.path),
+        logging.msg('Getting metadata for %r from "%s"', tagNames, path.path,
                     verbosity=4)
-        md = self._getMetadata(path.path)
-        for tagName in tagNames:
-            try:
-                return unicode(md[tagName][0])
-            except KeyError:
-                pass
-
-        return default
+        return firstTag(self._getMetadata(path.path), tagNames, default)
 
 
     def _saneTracknumber(self, tracknumber):
@@ -83,13 +527,28 @@ class Audio(RenamingCommand):
         return int(tracknumber)
 
 
+    def buildMapping(self, metadata):
+        """
+        Build the template mapping from file metadata.
+        """
+        mapping = dict(
+            (field, firstTag(metadata, tagNames))
+            for field, tagNames in self.fields)
+        mapping['tracknumber'] = self._saneTracknumber(mapping['tracknumber'])
+        return mapping
+
+
     # IRenamerCommand
 
     def processArgument(self, arg):
-        T = partial(self.getTag, arg)
-        return dict(
-            artist=T([u'artist', u'TPE1']),
-            album=T([u'album', u'TALB']),
-            title=T([u'title', u'TIT2']),
-            date=T([u'date', u'year', u'TDRC']),
-            tracknumber=self._saneTracknumber(T([u'tracknumber', u'TRCK'])))
+        logging.msg('Getting metadata from "%s"', arg.path, verbosity=4)
+        if self._tagReader is None:
+            return self.buildMapping(self._getMetadata(arg.path))
+
+        metadata, identity = self._lookup(arg.path)
+        if metadata is not _missing:
+            return self.buildMapping(metadata)
+        d = self._tagReader.call(arg.path)
+        d.addCallback(lambda tags: self._store(arg.path, identity, tags))
+        d.addCallback(self.buildMapping)
+        return d
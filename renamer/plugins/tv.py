@@ -1,79 +1,331 @@
+import os
+import re
 import string
 import urllib
+from datetime import timedelta
+from xml.etree import ElementTree
 
 try:
     import pymeta
-    from pymeta.grammar import OMeta
     from pymeta.runtime import ParseError
     pymeta # Ssssh, Pyflakes.
 except ImportError:
     pymeta = None
 
-from twisted.internet import reactor
+from epsilon.extime import Time
+
+from axiom.attributes import AND, compoundIndex, integer, text, timestamp
+from axiom.item import Item
+from axiom.store import Store
+
+from twisted.internet import defer, reactor
 from twisted.web.client import Agent
 
 from renamer import logging
+from renamer.grammars import filenameGrammar, grammarHash
 from renamer.plugin import RenamingCommand
 from renamer.errors import PluginError
-from renamer.util import deliverBody, BodyReceiver
-try:
-    from renamer._compiled_grammar.tv import Parser as FilenameGrammar
-    FilenameGrammar # Ssssh, Pyflakes.
-except ImportError:
-    FilenameGrammar = None
-
-
-
-filenameGrammar = """
-complete_strict    ::= <series_strict>:series <separator> <episode_strict>:episode
-                    => series, episode
-complete_lenient   ::= <series_lenient>:series <separator> <episode_lenient>:episode
-                    => series, episode
-partial_silly      ::= <series_silly>:series <separator> <episode_silly>:episode
-                    => series, episode
-only_episode_silly ::= <episode_silly>:episode
-                    => None, episode
-only_episode       ::= <episode_strict>:episode
-                    => None, episode
-only_series        ::= (<series_word>:word <separator> => word)+:words
-                    => ' '.join(words), [None, None]
-
-separator          ::= <hard_separator> | <soft_separator>
-soft_separator     ::= '.' | ' ' | '-' | '_'
-hard_separator     ::= ('_' '-' '_'
-                       |' ' '-' ' '
-                       |'.' '-' '.')
-
-series_strict      ::= (<series_word>:word <separator> ~(<episode_strict> <separator>) => word)*:words <series_word>:word
-                      => ' '.join(words + [word])
-series_lenient     ::= (<series_word>:word <separator> ~(<episode_lenient> <separator>) => word)*:words <series_word>:word
-                      => ' '.join(words + [word])
-series_silly       ::= (<series_word>:word <soft_separator> ~(<episode_silly> <separator>) => word)*:words <separator>
-                      => ' '.join(words)
-series_word        ::= (<letter> | <digit>)+:name => ''.join(name)
-
-episode_strict     ::= (<episode_x> | <episode_x2> | <episode_lettered>):ep
-                      => map(''.join, ep)
-episode_lenient    ::= (<episode_strict> | <episode_numbers>):ep
-                      => map(''.join, ep)
-episode_silly      ::= <digit>+:ep
-                      => map(''.join, [ep, ep])
-
-episode_lettered   ::= ('S' | 's') <digit>+:season ('E' | 'e') <digit>+:episode
-                      => season, episode
-episode_numbers    ::= <digit>:a <digit>:b <digit>:c <digit>?:d
-                      => ([a, b], [c, d]) if d else ([a], [b, c])
-episode_x          ::= <digit>+:season 'x' <digit>+:episode
-                      => season, episode
-episode_x2         ::= '[' <digit>+:season 'x' <digit>+:episode ']'
-                    => season, episode
-"""
-
-
-
-if pymeta is not None and FilenameGrammar is None:
-    class FilenameGrammar(OMeta.makeGrammar(filenameGrammar, globals())):
-        pass
+from renamer.util import (
+    BodyReceiver, Coalescer, CountingConnectionPool, deliverBody, timeout)
+
+
+
+FilenameGrammar = None
+
+
+
+def getFilenameGrammar():
+    """
+    Get the filename grammar parser class, loading it on first use.
+
+    The parser compiled at build time, in L{renamer._compiled_grammar}, is
+    used if it was compiled from the current L{filenameGrammar}, otherwise the
+    grammar is compiled now.
+    """
+    global FilenameGrammar
+    if FilenameGrammar is None:
+        try:
+            from renamer._compiled_grammar import tv as compiled
+        except ImportError:
+            compiled = None
+
+        if (compiled is not None and
+            getattr(compiled, 'grammarHash', None) ==
+            grammarHash(filenameGrammar)):
+            FilenameGrammar = compiled.Parser
+        else:
+            logging.msg('Compiling filename grammar', verbosity=4)
+            from pymeta.grammar import OMeta
+            FilenameGrammar = OMeta.makeGrammar(
+                filenameGrammar, {}, name='FilenameGrammar')
+    return FilenameGrammar
+
+
+
+def parseRules(filename, rules):
+    """
+    Parse a filename with each of several filename grammar rules in turn.
+
+    A single grammar instance is used for all the rules, so the memoized
+    results of rules applied at each position of the input (including
+    failures) are shared between them rather than reparsed for every rule.
+
+    @type  filename: C{unicode}
+
+    @type  rules: C{list} of C{str}
+    @param rules: Names of filename grammar rules to apply, in order.
+
+    @return: An iterable of C{(rule, result)} for every rule that matches.
+    """
+    g = getFilenameGrammar()(filename)
+    start = g.input
+    for rule in rules:
+        g.input = start
+        logging.msg('Trying grammar rule "%s"', rule, verbosity=5)
+        try:
+            res, err = g.apply(rule)
+        except ParseError, e:
+            if logging.isEnabled(5):
+                try:
+                    logging.msg('Parsing error:', verbosity=5)
+                    for line in (
+                        e.formatError(filename).strip()).splitlines():
+                        logging.msg(line, verbosity=5)
+                except:
+                    pass
+        else:
+            yield rule, res
+
+
+
+# Regular expressions equivalent to the "complete_strict" and
+# "complete_lenient" grammar rules. Only ASCII letters and digits are matched,
+# anything else is left to the grammar.
+_word = r'[A-Za-z0-9]+'
+_nonASCII = re.compile(u'[^\x00-\x7f]')
+_separator = r'(?:_-_| - |\.-\.|[. _-])'
+_episodeStrict = (
+    r'(?:(?P<season_x>\d+)x(?P<episode_x>\d+)'
+    r'|\[(?P<season_x2>\d+)x(?P<episode_x2>\d+)\]'
+    r'|[Ss](?P<season_lettered>\d+)[Ee](?P<episode_lettered>\d+))')
+_episodeLenient = r'(?:%s|(?P<numbers>\d{3}\d?))' % (_episodeStrict,)
+
+
+
+def _completePattern(episode):
+    # The series is the shortest run of words followed by an episode and a
+    # separator, which is what the grammar's negative lookahead amounts to.
+    return re.compile(r'(?P<series>%s(?:%s%s)*?)%s%s%s' % (
+        _word, _separator, _word, _separator, episode, _separator))
+
+
+
+fastPatterns = [
+    ('complete_strict', _completePattern(_episodeStrict)),
+    ('complete_lenient', _completePattern(_episodeLenient))]
+
+
+
+def fastParse(filename):
+    """
+    Parse the common forms of TV episode filenames with regular expressions,
+    avoiding the far slower filename grammar.
+
+    The results are the same as those of the first of the C{complete_strict}
+    or C{complete_lenient} grammar rules to match, for filenames where they
+    match. A lenient match followed by non-ASCII characters is not trusted,
+    since the grammar may find a strict match among them.
+
+    @rtype:  C{(str, (unicode, (unicode, unicode)))}
+    @return: The name of the equivalent grammar rule and its result, or
+        C{None} if no pattern matches.
+    """
+    for rule, pattern in fastPatterns:
+        match = pattern.match(filename)
+        if match is None:
+            continue
+        if (rule == 'complete_lenient' and
+            _nonASCII.search(filename, match.end()) is not None):
+            return None
+
+        series = ' '.join(re.findall(_word, match.group('series')))
+        groups = match.groupdict()
+        numbers = groups.get('numbers')
+        if numbers is not None:
+            split = len(numbers) - 2
+            season, episode = numbers[:split], numbers[split:]
+        else:
+            for form in ['x', 'x2', 'lettered']:
+                season = groups['season_' + form]
+                if season is not None:
+                    episode = groups['episode_' + form]
+                    break
+        return rule, (series, (season, episode))
+    return None
+
+
+
+_nonAlphanumeric = re.compile(r'[\W_]+', re.UNICODE)
+
+
+
+def normalizeSeriesName(seriesName):
+    """
+    Normalize a series name for use as a cache key.
+
+    Case and any punctuation or whitespace between words are ignored, so that
+    C{"Arrested.Development"} and C{"arrested development"} are equivalent.
+
+    @rtype: C{unicode}
+    """
+    if isinstance(seriesName, str):
+        seriesName = seriesName.decode('utf-8', 'replace')
+    return _nonAlphanumeric.sub(u' ', seriesName).strip().lower()
+
+
+
+class EpisodeCacheEntry(Item):
+    """
+    Cached TV episode metadata.
+    """
+    key = text(doc="""
+    Normalized series name that was looked up.
+    """, allowNone=False)
+
+
+    season = integer(doc="""
+    Season number that was looked up.
+    """, allowNone=False)
+
+
+    episode = integer(doc="""
+    Episode number that was looked up.
+    """, allowNone=False)
+
+
+    series = text(doc="""
+    Series name, as reported by TVRage.
+    """, allowNone=False)
+
+
+    reportedSeason = integer(doc="""
+    Season number, as reported by TVRage.
+    """, allowNone=False)
+
+
+    reportedEpisode = integer(doc="""
+    Episode number, as reported by TVRage.
+    """, allowNone=False)
+
+
+    title = text(doc="""
+    Episode title, as reported by TVRage.
+    """, allowNone=False)
+
+
+    fetched = timestamp(doc="""
+    Timestamp of when the metadata was fetched.
+    """, indexed=True, defaultFactory=lambda: Time())
+
+
+    compoundIndex(key, season, episode)
+
+
+    def asMetadata(self):
+        """
+        Get the cached metadata in the form returned by
+        L{renamer.plugins.tv.TVRage.extractMetadata}.
+        """
+        return (
+            self.series, self.reportedSeason, self.reportedEpisode, self.title)
+
+
+
+class EpisodeCache(object):
+    """
+    Persistent TV episode metadata cache.
+
+    @type store: L{axiom.store.Store}
+
+    @type ttl: C{datetime.timedelta}
+    @ivar ttl: Maximum age of cached metadata.
+
+    @type maxEntries: C{int}
+    @ivar maxEntries: Maximum number of cached episodes, the least recently
+        fetched episodes are evicted first. Stale and excess entries are only
+        evicted by L{evict}, rather than every time an episode is cached.
+    """
+    def __init__(self, store, ttl, maxEntries):
+        self.store = store
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+
+
+    def _query(self, key, season, episode):
+        return self.store.query(
+            EpisodeCacheEntry,
+            AND(EpisodeCacheEntry.key == key,
+                EpisodeCacheEntry.season == season,
+                EpisodeCacheEntry.episode == episode))
+
+
+    def get(self, seriesName, season, episode):
+        """
+        Get cached metadata for an episode.
+
+        @return: Metadata in the form returned by
+            L{renamer.plugins.tv.TVRage.extractMetadata} or C{None} if there is
+            no fresh metadata cached for this episode.
+        """
+        key = normalizeSeriesName(seriesName)
+        for entry in self._query(key, int(season), int(episode)):
+            if entry.fetched >= Time() - self.ttl:
+                return entry.asMetadata()
+        return None
+
+
+    def put(self, seriesName, season, episode, metadata):
+        """
+        Cache metadata for an episode, replacing any previously cached
+        metadata for it.
+        """
+        self.store.transact(
+            self._put, normalizeSeriesName(seriesName), int(season),
+            int(episode), metadata)
+
+
+    def _put(self, key, season, episode,
+             (series, reportedSeason, reportedEpisode, title)):
+        self._query(key, season, episode).deleteFromStore()
+        EpisodeCacheEntry(
+            store=self.store,
+            key=key,
+            season=season,
+            episode=episode,
+            series=series,
+            reportedSeason=int(reportedSeason),
+            reportedEpisode=int(reportedEpisode),
+            title=title)
+
+
+    def evict(self):
+        """
+        Evict stale entries and the least recently fetched entries beyond
+        C{maxEntries}.
+        """
+        self.store.transact(self._evict)
+
+
+    def _evict(self):
+        self.store.query(
+            EpisodeCacheEntry,
+            EpisodeCacheEntry.fetched < Time() - self.ttl).deleteFromStore()
+        excess = self.store.query(EpisodeCacheEntry).count() - self.maxEntries
+        if excess > 0:
+            self.store.query(
+                EpisodeCacheEntry,
+                sort=EpisodeCacheEntry.fetched.ascending,
+                limit=excess).deleteFromStore()
 
 
 
@@ -98,10 +350,37 @@ class TVRage(RenamingCommand):
         u'$series [${season}x${padded_episode}] - $title')
 
 
+    placeholders = [
+        'series', 'season', 'padded_season', 'episode', 'padded_episode',
+        'title']
+
+
+    baseURL = 'http://services.tvrage.com'
+
+
+    optFlags = [
+        ('no-cache', None, 'Do not cache episode metadata.'),
+        ('bulk', None,
+         'Fetch the episode list of each series once, instead of looking up '
+         'episodes individually.')]
+
+
     optParameters = [
         ('series',  None, None, 'Override series name.'),
         ('season',  None, None, 'Override season number.', int),
-        ('episode', None, None, 'Override episode number.', int)]
+        ('episode', None, None, 'Override episode number.', int),
+        ('cache', None, '~/.renamer/tvrage.axiom',
+         'Episode metadata cache path.'),
+        ('cache-ttl', None, 168,
+         'Hours to keep cached episode metadata for.', int),
+        ('cache-size', None, 10000,
+         'Maximum number of episodes to cache.', int),
+        ('max-connections', None, 2,
+         'Maximum number of persistent connections to TVRage.', int),
+        ('idle-timeout', None, 240,
+         'Seconds to keep idle connections to TVRage open for.', int),
+        ('timeout', None, 30,
+         'Seconds to wait for a response from TVRage.', int)]
 
 
     def postOptions(self):
@@ -110,7 +389,47 @@ class TVRage(RenamingCommand):
                 'The "pymeta" package is required for this command')
         if self['series'] is not None:
             self['series'] = self.decodeCommandLine(self['series'])
-        self.agent = Agent(reactor)
+        self.pool = CountingConnectionPool(reactor)
+        self.pool.maxPersistentPerHost = self['max-connections']
+        self.pool.cachedConnectionTimeout = self['idle-timeout']
+        self.agent = Agent(
+            reactor, connectTimeout=self['timeout'], pool=self.pool)
+        self.cache = None
+        self._lookups = Coalescer()
+        self._seriesLookups = Coalescer()
+        self._episodeLists = {}
+
+
+    def getCache(self):
+        """
+        Get the episode metadata cache, opening it, and evicting stale and
+        excess entries from it, on first use.
+
+        @rtype:  L{renamer.plugins.tv.EpisodeCache}
+        @return: The episode metadata cache, or C{None} if caching is disabled.
+        """
+        if self.cache is None and not self['no-cache']:
+            store = Store(os.path.expanduser(self['cache']))
+            self.cache = EpisodeCache(
+                store,
+                ttl=timedelta(hours=self['cache-ttl']),
+                maxEntries=self['cache-size'])
+            self.cache.evict()
+        return self.cache
+
+
+    def beginRun(self, options):
+        """
+        Prepare for a run.
+
+        The episode metadata cache is not used at all for C{'no-act'} runs.
+        """
+        RenamingCommand.beginRun(self, options)
+        if options['no-act']:
+            logging.msg(
+                'Not using the episode metadata cache for a trial run',
+                verbosity=4)
+            self['no-cache'] = True
 
 
     def buildMapping(self, (seriesName, season, episode, episodeName)):
@@ -126,6 +445,9 @@ class TVRage(RenamingCommand):
     def extractParts(self, filename, overrides=None):
         """
         Get TV episode information from a filename.
+
+        Common filename forms are matched by L{fastParse}, the filename grammar
+        is only consulted, via L{parseRules}, for filenames it does not match.
         """
         if overrides is None:
             overrides = {}
@@ -139,50 +461,83 @@ class TVRage(RenamingCommand):
                 'only_series',
                 'only_episode_silly'])
 
-        for rule in rules:
-            g = FilenameGrammar(filename)
-            logging.msg('Trying grammar rule "%s"' % (rule,),
+        def _parts((series, (season, episode))):
+            parts = (
+                overrides.get('series') or series,
+                overrides.get('season') or season,
+                overrides.get('episode') or episode)
+            if None not in parts:
+                logging.msg('Found parts in "%s": %r', filename, parts,
+                            verbosity=4)
+                return parts
+
+        fast = fastParse(filename)
+        if fast is not None:
+            rule, res = fast
+            logging.msg('Matched pattern for grammar rule "%s"', rule,
                         verbosity=5)
-            try:
-                res, err = g.apply(rule)
-            except ParseError, e:
-                try:
-                    logging.msg('Parsing error:', verbosity=5)
-                    for line in (e.formatError(filename).strip()).splitlines():
-                        logging.msg(line, verbosity=5)
-                except:
-                    pass
-                continue
-            else:
-                series, (season, episode) = res
-                parts = (
-                    overrides.get('series') or series,
-                    overrides.get('season') or season,
-                    overrides.get('episode') or episode)
-                if None not in parts:
-                    logging.msg('Found parts in "%s": %r' % (filename, parts),
-                                verbosity=4)
-                    return parts
+            parts = _parts(res)
+            if parts is not None:
+                return parts
+
+        for rule, res in parseRules(filename, rules):
+            parts = _parts(res)
+            if parts is not None:
+                return parts
 
         raise PluginError(
             'No patterns could be found in "%s"' % (filename))
 
 
-    def extractMetadata(self, pageData):
+    def _parseQuickinfo(self, pageData):
         """
-        Extract TV episode metadata from a TVRage response.
+        Parse a TVRage quickinfo response into a mapping of keys to lists of
+        values.
         """
         data = {}
         for line in pageData.splitlines():
             key, value = line.strip().split('@', 1)
             data[key] = value.split('^')
+        return data
+
 
+    def extractMetadata(self, pageData):
+        """
+        Extract TV episode metadata from a TVRage response.
+        """
+        data = self._parseQuickinfo(pageData)
         series = data['Show Name'][0]
         season, episode = map(int, data['Episode Info'][0].split('x'))
         title = data['Episode Info'][1]
         return series, season, episode, title
 
 
+    def extractShowID(self, pageData):
+        """
+        Extract the TVRage show identifier from a TVRage response.
+        """
+        return self._parseQuickinfo(pageData)['Show ID'][0]
+
+
+    def extractEpisodeList(self, pageData):
+        """
+        Extract a TV series episode list from a TVRage response.
+
+        @rtype:  C{(unicode, dict)}
+        @return: The series name and a mapping of C{(season, episode)} to
+            episode titles.
+        """
+        root = ElementTree.fromstring(pageData.encode('utf-8'))
+        episodes = {}
+        for season in root.iter('Season'):
+            seasonNumber = int(season.get('no'))
+            for episode in season.findall('episode'):
+                episodeNumber = int(episode.findtext('seasonnum'))
+                episodes[seasonNumber, episodeNumber] = unicode(
+                    episode.findtext('title'))
+        return unicode(root.findtext('name')), episodes
+
+
     def buildURL(self, seriesName, season, episode):
         """
         Construct the TVRage URL to the quickinfo page for the seriesName,
@@ -190,23 +545,141 @@ class TVRage(RenamingCommand):
         """
         ep = '%dx%02d' % (int(season), int(episode))
         qs = urllib.urlencode({'show': seriesName, 'ep': ep})
-        return 'http://services.tvrage.com/tools/quickinfo.php?%s' % (qs,)
+        return '%s/tools/quickinfo.php?%s' % (self.baseURL, qs)
 
 
-    def lookupMetadata(self, seriesName, season, episode):
+    def buildShowURL(self, seriesName):
         """
-        Look up TV episode metadata on TVRage.
+        Construct the TVRage URL to the quickinfo page for the seriesName.
         """
-        url = self.buildURL(seriesName, season, episode)
-        logging.msg('Looking up TVRage metadata at %s' % (url,),
-                    verbosity=4)
+        qs = urllib.urlencode({'show': seriesName})
+        return '%s/tools/quickinfo.php?%s' % (self.baseURL, qs)
+
+
+    def buildEpisodeListURL(self, showID):
+        """
+        Construct the TVRage URL to the episode list for a TVRage show
+        identifier.
+        """
+        qs = urllib.urlencode({'sid': showID})
+        return '%s/feeds/episode_list.php?%s' % (self.baseURL, qs)
+
 
-        d = self.agent.request('GET', url)
+    def _fetch(self, url):
+        """
+        Fetch the body of a TVRage page.
+        """
+        logging.msg('Looking up TVRage metadata at %s', url,
+                    verbosity=4)
+        d = timeout(self.agent.request('GET', url), self['timeout'])
+        d.addCallback(self._logConnections)
         d.addCallback(deliverBody, BodyReceiver)
+        return d
+
+
+    def fetchMetadata(self, seriesName, season, episode):
+        """
+        Fetch TV episode metadata from TVRage.
+        """
+        d = self._fetch(self.buildURL(seriesName, season, episode))
         d.addCallback(self.extractMetadata)
         return d
 
 
+    def fetchEpisodeList(self, seriesName):
+        """
+        Fetch a TV series episode list from TVRage.
+
+        @see: L{renamer.plugins.tv.TVRage.extractEpisodeList}
+        """
+        d = self._fetch(self.buildShowURL(seriesName))
+        d.addCallback(self.extractShowID)
+        d.addCallback(lambda showID: self._fetch(
+            self.buildEpisodeListURL(showID)))
+        d.addCallback(self.extractEpisodeList)
+        return d
+
+
+    def lookupEpisodeList(self, seriesName):
+        """
+        Look up a TV series episode list, fetching it from TVRage only once
+        for all equivalent series names.
+
+        @see: L{renamer.plugins.tv.TVRage.extractEpisodeList}
+        """
+        key = normalizeSeriesName(seriesName)
+        if key in self._episodeLists:
+            return defer.succeed(self._episodeLists[key])
+
+        def _indexEpisodeList(episodeList):
+            self._episodeLists[key] = episodeList
+            return episodeList
+
+        return self._seriesLookups.call(
+            key, lambda: self.fetchEpisodeList(seriesName).addCallback(
+                _indexEpisodeList))
+
+
+    def fetchMetadataFromEpisodeList(self, seriesName, season, episode):
+        """
+        Get TV episode metadata from the series episode list, falling back to
+        fetching the episode individually if it is not in the episode list.
+        """
+        def _findEpisode((series, episodes)):
+            title = episodes.get((int(season), int(episode)))
+            if title is None:
+                logging.msg(
+                    'Episode %sx%s not in the episode list for "%s"',
+                    season, episode, series,
+                    verbosity=3)
+                return self.fetchMetadata(seriesName, season, episode)
+            return series, int(season), int(episode), title
+
+        d = self.lookupEpisodeList(seriesName)
+        d.addCallback(_findEpisode)
+        return d
+
+
+    def _logConnections(self, result):
+        logging.msg(
+            'TVRage connections: %d new, %d reused',
+            self.pool.newConnections, self.pool.reusedConnections,
+            verbosity=4)
+        return result
+
+
+    def lookupMetadata(self, seriesName, season, episode):
+        """
+        Look up TV episode metadata, consulting the cache before TVRage.
+
+        Concurrent lookups of the same episode share a single request to
+        TVRage. If the C{'bulk'} option is specified, the metadata is taken
+        from the series episode list.
+        """
+        cache = self.getCache()
+        if cache is not None:
+            metadata = cache.get(seriesName, season, episode)
+            if metadata is not None:
+                logging.msg(
+                    'Using cached TVRage metadata for %r', metadata,
+                    verbosity=4)
+                return defer.succeed(metadata)
+
+        def _cacheMetadata(metadata):
+            if cache is not None:
+                cache.put(seriesName, season, episode, metadata)
+            return metadata
+
+        fetch = self.fetchMetadata
+        if self['bulk']:
+            fetch = self.fetchMetadataFromEpisodeList
+
+        key = (normalizeSeriesName(seriesName), int(season), int(episode))
+        return self._lookups.call(
+            key, lambda: fetch(
+                seriesName, season, episode).addCallback(_cacheMetadata))
+
+
     # IRenamerCommand
 
     def processArgument(self, arg):
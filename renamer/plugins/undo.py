@@ -1,7 +1,16 @@
+import gzip
+import os
+from datetime import timedelta
+
+from epsilon.extime import Time
+
+from axiom.attributes import AND, OR
+
 from twisted.python import usage
+from twisted.python.filepath import FilePath
 
 from renamer import logging
-from renamer.history import Action, Changeset
+from renamer.history import Action, Changeset, ParallelUndo, vacuumStore
 from renamer.plugin import Command, SubCommand
 
 
@@ -30,6 +39,16 @@ class _UndoMixin(object):
         ('ignore-errors', None, 'Do not stop the process when encountering OS errors.')]
 
 
+    def forgetDirectories(self, options):
+        """
+        Forget every directory known to exist, the directories involved in
+        previous actions may have changed since they were performed.
+        """
+        cache = getattr(options, 'directoryCache', None)
+        if cache is not None:
+            cache.clear()
+
+
     def undoActions(self, options, changeset, actions):
         """
         Undo specific actions from a changeset.
@@ -39,14 +58,15 @@ class _UndoMixin(object):
             if not options['no-act']:
                 msg = 'Undo'
 
-            logging.msg('%s: %s' % (msg, action.asHumanly()), verbosity=3)
+            logging.msg('%s: %s', msg, logging.Lazy(action.asHumanly),
+                        verbosity=3)
             if not options['no-act']:
                 try:
                     changeset.undo(action, options)
                 except OSError, e:
                     if not self['ignore-errors']:
                         raise e
-                    logging.msg('Ignoring %r' % (e,), verbosity=3)
+                    logging.msg('Ignoring %r', e, verbosity=3)
 
 
 
@@ -69,6 +89,8 @@ class UndoAction(SubCommand, _UndoMixin):
 
     def process(self, renamer, options):
         action = getItem(renamer.store, self['action'], Action)
+        renamer.touchedChangesets.add(action.changeset)
+        self.forgetDirectories(options)
         self.undoActions(options, action.changeset, [action])
 
 
@@ -82,6 +104,8 @@ class UndoChangeset(SubCommand, _UndoMixin):
 
     longdesc = """
     Undo an entire changeset. Consult "undo list" for changeset identifiers.
+    Actions that do not involve the same paths are undone concurrently, up to
+    the global --fs-concurrency option.
     """
 
 
@@ -91,10 +115,21 @@ class UndoChangeset(SubCommand, _UndoMixin):
 
     def process(self, renamer, options):
         changeset = getItem(renamer.store, self['changeset'], Changeset)
-        logging.msg('Undoing: %s' % (changeset.asHumanly(),),
+        renamer.touchedChangesets.add(changeset)
+        logging.msg('Undoing: %s', logging.Lazy(changeset.asHumanly),
                     verbosity=3)
         actions = list(changeset.getActions())
-        self.undoActions(options, changeset, reversed(actions))
+        actions.reverse()
+        self.forgetDirectories(options)
+        if options['no-act']:
+            self.undoActions(options, changeset, actions)
+            return
+
+        undo = ParallelUndo(
+            changeset, actions, options,
+            concurrency=options['fs-concurrency'],
+            ignoreErrors=self['ignore-errors'])
+        return undo.run()
 
 
 
@@ -102,20 +137,62 @@ class UndoList(SubCommand):
     name = 'list'
 
 
+    optParameters = [
+        ('limit',  None, 10,
+         'Maximum number of changesets to list, 0 for no limit.', int),
+        ('offset', None, 0,
+         'Number of changesets to skip.', int),
+        ('since',  None, None,
+         'Only list changesets modified since this ISO 8601 date and time.'),
+        ('path',   None, None,
+         'Only list actions involving this path, or anything beneath it.')]
+
+
     longdesc = """
-    List undoable changesets and actions.
+    List undoable changesets and actions, most recently modified first.
     """
 
 
+    def postOptions(self):
+        if self['limit'] < 0 or self['offset'] < 0:
+            raise usage.UsageError('Limit and offset must not be negative')
+        if self['since'] is not None:
+            try:
+                self['since'] = Time.fromISO8601TimeAndDate(self['since'])
+            except ValueError:
+                raise usage.UsageError(
+                    'Invalid ISO 8601 date and time %r' % (self['since'],))
+        if self['path'] is not None:
+            self['path'] = FilePath(
+                self.decodeCommandLine(self['path'])).path
+
+
     def process(self, renamer, options):
-        changesets = list(renamer.history.getChangesets())
+        # Ask for one more changeset than the limit, to find out whether
+        # there are any more.
+        limit = self['limit'] or None
+        if limit is not None:
+            limit += 1
+        changesets = renamer.history.getChangesets(
+            newestFirst=True,
+            since=self['since'],
+            path=self['path'],
+            limit=limit,
+            offset=self['offset'] or None)
+
+        count = 0
         for cs in changesets:
+            if count == self['limit'] and limit is not None:
+                print 'More changesets are available, use --offset=%d' % (
+                    self['offset'] + count,)
+                break
+            count += 1
             print 'Changeset ID=%d:  %s' % (cs.storeID, cs.asHumanly())
-            for a in cs.getActions():
+            for a in cs.getActions(path=self['path']):
                 print '   Action ID=%d:  %s' % (a.storeID, a.asHumanly())
             print
 
-        if not changesets:
+        if not count:
             print 'No changesets!'
 
 
@@ -140,8 +217,70 @@ class UndoForget(SubCommand):
     def process(self, renamer, options):
         item = getItem(renamer.store, self['identifier'], (Action, Changeset))
         if not options['no-act']:
-            logging.msg('Forgetting: %s' % (item.asHumanly(),), verbosity=2)
-            item.deleteFromStore()
+            logging.msg('Forgetting: %s', logging.Lazy(item.asHumanly),
+                        verbosity=2)
+            if isinstance(item, Action) and item.changeset is not None:
+                renamer.touchedChangesets.add(item.changeset)
+                item.changeset.forget(item)
+            else:
+                item.deleteFromStore()
+
+
+
+class UndoCompact(SubCommand):
+    name = 'compact'
+
+
+    optFlags = [
+        ('no-vacuum', None,
+         'Do not rebuild the database to reclaim space.')]
+
+
+    optParameters = [
+        ('older-than', None, 90,
+         'Archive changesets not modified for this many days.', int),
+        ('archive',    None, '~/.renamer/history-archive.jsonl.gz',
+         'Path of the compressed archive to append changesets to.')]
+
+
+    longdesc = """
+    Archive old changesets, removing them from the undo history, and reclaim
+    the space they used. Archived changesets are appended to a compressed
+    file, one JSON object per line, and can no longer be undone with Renamer.
+    """
+
+
+    def postOptions(self):
+        if self['older-than'] < 0:
+            raise usage.UsageError('--older-than must not be negative')
+
+
+    def process(self, renamer, options):
+        history = renamer.history
+        before = Time() - timedelta(days=self['older-than'])
+        if options['no-act']:
+            # Count the changesets pruning would adopt, without pruning.
+            count = renamer.store.query(
+                Changeset,
+                AND(OR(Changeset.history == history,
+                       AND(Changeset.history == None,
+                           Changeset.actionCount > 0)),
+                    Changeset.modified < before)).count()
+            logging.msg('Simulating: Archive %d changesets', count)
+            return
+
+        history.pruneChangesets()
+        path = os.path.expanduser(self['archive'])
+        archive = gzip.open(path, 'ab')
+        try:
+            count = history.archiveChangesets(before, archive)
+        finally:
+            archive.close()
+        logging.msg('Archived %d changesets to "%s"', count, path)
+
+        if not self['no-vacuum']:
+            logging.msg('Vacuuming history', verbosity=2)
+            vacuumStore(renamer.store)
 
 
 
@@ -165,6 +304,7 @@ class Undo(Command):
     subCommands = [
         ('action',    None, UndoAction,    'Undo a single action from a changeset'),
         ('changeset', None, UndoChangeset, 'Undo a whole changeset'),
+        ('compact',   None, UndoCompact,   'Archive old changesets'),
         ('forget',    None, UndoForget,    'Forget an undo history item'),
         ('list',      None, UndoList,      'List changesets')]
 
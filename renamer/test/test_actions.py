@@ -55,6 +55,42 @@ class _ActionTestMixin(object):
         self.assertEquals(parent.listdir(), ['dst'])
 
 
+    def test_doCachedDirectory(self):
+        """
+        Directories created by an action are remembered by the options'
+        directory cache, and are not checked for again by later actions.
+        """
+        self.dst = self.path.child('subdir').child('dst')
+        self.test_do()
+        self.assertIn(self.dst.parent(), self.options.directoryCache)
+
+        checked = []
+        parent = self.dst.parent()
+        self.patch(parent, 'exists', lambda: checked.append(True))
+        action = self.createAction()
+        action.makedirs(parent, self.options.directoryCache)
+        self.assertEquals(checked, [])
+
+
+    def test_doRemovedDirectory(self):
+        """
+        If a cached directory is removed, the action fails and the directory is
+        forgotten so that the next action creates it again.
+        """
+        self.dst = self.path.child('subdir').child('dst')
+        parent = self.dst.parent()
+        self.options.directoryCache.add(parent)
+        self.assertFalse(parent.exists())
+        self.src.touch()
+        action = self.createAction()
+        self.assertRaises(OSError, action.do, self.options)
+        self.assertNotIn(parent, self.options.directoryCache)
+
+        self.src.remove()
+        self.test_do()
+        self.assertTrue(parent.exists())
+
+
     def test_doClobber(self):
         """
         Performing an action raises L{renames.errors.NoClobber} when the
@@ -66,6 +102,20 @@ class _ActionTestMixin(object):
             errors.NoClobber, action.do, self.options)
 
 
+    def test_doDestinationsChecked(self):
+        """
+        The destination is not checked for again when the options' destinations
+        have already been checked, such as by a rename plan.
+        """
+        checked = []
+        self.patch(
+            self.actionType, 'checkExisting',
+            lambda action, dst: checked.append(dst))
+        self.options.destinationsChecked = True
+        self.test_do()
+        self.assertEquals(checked, [])
+
+
     def test_undo(self):
         """
         Perform the reverse action.
@@ -1,10 +1,13 @@
 import string
 
+from axiom.store import Store
+
+from twisted.internet.defer import Deferred
 from twisted.python.filepath import FilePath
 from twisted.trial.unittest import TestCase
 
-from renamer import config
-from renamer.application import Options
+from renamer import config, errors, plugin
+from renamer.application import Options, Renamer
 
 
 
@@ -36,3 +39,141 @@ class OptionsTests(TestCase):
         self.options.parseOptions(['--name=foo'])
         self.assertIdentical(string.Template, type(self.options['name']))
         self.assertIdentical(unicode, type(self.options['name'].template))
+
+
+    def test_parseRecursive(self):
+        """
+        Directory arguments are walked recursively with C{'recursive'},
+        include and exclude patterns are comma-separated and decoded to
+        C{unicode}.
+        """
+        path = FilePath(self.mktemp())
+        path.child('sub').makedirs()
+        for name in ['a.mp3', 'b.txt', 'c.mp3']:
+            path.child('sub').child(name).touch()
+        self.options.parseOptions(
+            ['--recursive', '--include=*.mp3,*.ogg', '--exclude=c*'])
+        self.options.parseArgs(path.path)
+        self.assertEquals(self.options['include'], [u'*.mp3', u'*.ogg'])
+        self.assertEquals(
+            list(self.options.args),
+            [path.child('sub').child('a.mp3')])
+
+
+    def test_subCommandsFromIndex(self):
+        """
+        Commands are listed from the plugin index, without importing them.
+        """
+        index = plugin.PluginIndex()
+        index._plugins = [
+            plugin.IndexedPlugin(
+                name='fake',
+                description='A fake command.',
+                interfaces=['renamer.irenamer.ICommand'],
+                module='renamer.test.no_such_module',
+                attribute='Fake'),
+            plugin.IndexedPlugin(
+                name='move',
+                description=None,
+                interfaces=['renamer.irenamer.IRenamingAction'],
+                module='renamer.test.no_such_module',
+                attribute='Move')]
+        options = Options(self.config, index)
+        self.assertEquals(
+            [(name, short, desc)
+             for name, short, factory, desc in options.subCommands],
+            [('fake', None, 'A fake command.')])
+
+
+
+class FixedNameCommand(plugin.RenamingCommand):
+    """
+    Renaming command that renames every argument to the same name.
+    """
+    name = 'fixed'
+    defaultNameTemplate = string.Template(u'fixed')
+    placeholders = []
+
+
+    def processArgument(self, argument):
+        return {}
+
+
+
+class SuffixCommand(plugin.RenamingCommand):
+    """
+    Renaming command that appends a suffix to the name of every argument.
+    """
+    name = 'suffix'
+    defaultNameTemplate = string.Template(u'${name}.new')
+    placeholders = ['name']
+
+
+    def processArgument(self, argument):
+        return dict(name=argument.basename())
+
+
+
+class RenamerTests(TestCase):
+    """
+    Tests for L{renamer.application.Renamer}.
+    """
+    def setUp(self):
+        path = FilePath(__file__).sibling('data').child('test.conf')
+        self.renamer = Renamer.__new__(Renamer)
+        self.renamer.options = Options(config.ConfigFile(path))
+        self.renamer._store = Store()
+        self.renamer._history = None
+        self.renamer.touchedChangesets = set()
+
+
+    def test_planConflict(self):
+        """
+        With C{'plan'}, when two arguments would be renamed to the same
+        destination, no files are renamed at all.
+        """
+        path = FilePath(self.mktemp())
+        path.makedirs()
+        a, b = path.child('a.txt'), path.child('b.txt')
+        a.setContent('a')
+        b.setContent('b')
+        self.renamer.options.parseOptions(['--plan'])
+        self.renamer.args = [a, b]
+
+        d = self.renamer.runRenamingCommand(FixedNameCommand())
+        self.assertFailure(d, errors.ConflictingRenames)
+        def _check(ignored):
+            self.assertEquals(len(
+                self.flushLoggedErrors(errors.ConflictingRenames)), 1)
+            self.assertEquals(
+                sorted(path.listdir()), ['a.txt', 'b.txt'])
+            self.assertEquals(
+                list(self.renamer.history.getChangesets()), [])
+        return d.addCallback(_check)
+
+
+    def test_planConcurrent(self):
+        """
+        With C{'plan'}, independent planned renames are performed
+        concurrently, and actions are told that their destinations have
+        already been checked.
+        """
+        path = FilePath(self.mktemp())
+        a, b = path.child('a'), path.child('b')
+        self.renamer.options.parseOptions(['--plan'])
+        self.renamer.args = [a, b]
+        performed = []
+        def _performRename(dst, src):
+            d = Deferred()
+            performed.append(((src, dst), d))
+            return d
+        self.patch(self.renamer, 'performRename', _performRename)
+
+        d = self.renamer.runRenamingCommand(SuffixCommand())
+        self.assertEquals(
+            [rename for rename, d in performed],
+            [(a, path.child('a.new')), (b, path.child('b.new'))])
+        self.assertTrue(self.renamer.options.destinationsChecked)
+        for rename, pending in performed:
+            pending.callback(None)
+        return d
@@ -0,0 +1,254 @@
+from twisted.internet.defer import succeed
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import TestCase
+
+from renamer.application import Options
+from renamer.plugins import audio
+
+
+
+class FakePicture(object):
+    def __init__(self, data):
+        self.data = data
+
+
+
+class FakeMetadata(dict):
+    """
+    Fake C{mutagen.File} result.
+    """
+    def __init__(self, tags, pictures=()):
+        dict.__init__(self, tags)
+        self.tags = tags
+        self.pictures = list(pictures)
+
+
+
+class FakeMutagen(object):
+    """
+    Fake C{mutagen} module that records the files opened.
+    """
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self.opened = []
+
+
+    def File(self, filename):
+        self.opened.append(filename)
+        return self.metadata
+
+
+
+class AudioTests(TestCase):
+    """
+    Tests for L{renamer.plugins.audio.Audio}.
+    """
+    def setUp(self):
+        self.metadata = FakeMetadata(
+            {u'artist': [u'Artist'],
+             u'TALB': [u'Album'],
+             u'title': [u'Title'],
+             u'date': [u'2010'],
+             u'tracknumber': [u'3/12'],
+             u'comment': [u'Comment']},
+            [FakePicture('x' * 1000)])
+        self.mutagen = FakeMutagen(self.metadata)
+        self.patch(audio, 'mutagen', self.mutagen)
+
+
+    def createCommand(self, *args):
+        """
+        Create an audio command, without a tag index unless one is specified.
+        """
+        args = list(args)
+        if not [arg for arg in args if arg.startswith('--index')]:
+            args.append('--no-index')
+        command = audio.Audio()
+        command.parent = Options(None)
+        command.parseOptions(args)
+        return command
+
+
+    def test_processArgument(self):
+        """
+        Template values are taken from the first present tag for each field.
+        """
+        command = self.createCommand()
+        self.assertEquals(
+            command.processArgument(FilePath(u'a.mp3')),
+            dict(artist=u'Artist', album=u'Album', title=u'Title',
+                 date=u'2010', tracknumber=3))
+
+
+    def test_metadataCache(self):
+        """
+        Metadata is only read once for each file, until it is evicted.
+        """
+        command = self.createCommand('--cache-size=1')
+        a, b = FilePath(u'a.mp3'), FilePath(u'b.mp3')
+        command.processArgument(a)
+        command.processArgument(a)
+        self.assertEquals(self.mutagen.opened, [a.path])
+        self.assertEquals(command._metadataCache.maxSize, 1024 * 1024)
+
+        command._metadataCache.maxSize = 1
+        command.processArgument(b)
+        command.processArgument(b)
+        self.assertEquals(self.mutagen.opened, [a.path, b.path, b.path])
+
+
+    def test_tagsOnly(self):
+        """
+        With C{'tags-only'} only the tags used for renaming are cached,
+        without any pictures.
+        """
+        command = self.createCommand('--tags-only')
+        path = FilePath(u'a.mp3')
+        command.processArgument(path)
+        cached = command._metadataCache.get(path.path)
+        self.assertEquals(
+            cached,
+            {u'artist': [u'Artist'],
+             u'TALB': [u'Album'],
+             u'title': [u'Title'],
+             u'date': [u'2010'],
+             u'tracknumber': [u'3/12']})
+        self.assertTrue(
+            audio.metadataSize(cached) < audio.metadataSize(self.metadata))
+
+
+    def test_metadataSize(self):
+        """
+        The size of metadata is estimated from its tags and pictures.
+        """
+        self.assertEquals(audio.metadataSize(None), 256)
+        self.assertEquals(
+            audio.metadataSize({u'a': [u'bc']}),
+            256 + 1 + len(repr([u'bc'])))
+        self.assertEquals(
+            audio.metadataSize(FakeMetadata({}, [FakePicture('x' * 10)])),
+            256 + 10)
+
+
+    def test_processes(self):
+        """
+        With C{'processes'}, tags are read in worker processes and cached.
+        By default tags are read in the main process.
+        """
+        self.assertIdentical(self.createCommand()._tagReader, None)
+        command = self.createCommand('--processes=2')
+        self.assertEquals(command._tagReader.processes, 2)
+        calls = []
+        def _call(filename):
+            calls.append(filename)
+            return succeed(audio.readTags(filename, command.tagNames))
+        self.patch(command._tagReader, 'call', _call)
+
+        path = FilePath(u'a.mp3')
+        results = []
+        command.processArgument(path).addCallback(results.append)
+        command.processArgument(path)
+        self.assertEquals(calls, [path.path])
+        self.assertEquals(results[0]['album'], u'Album')
+        self.assertEquals(
+            command._metadataCache.get(path.path)[u'tracknumber'], [u'3/12'])
+
+
+    def test_index(self):
+        """
+        Tags are indexed as they are read, files that have not changed since
+        they were indexed, even if they were renamed, are not read again and
+        their entries are updated with their new paths.
+        """
+        path = FilePath(self.mktemp())
+        path.makedirs()
+        a, b = path.child('a.mp3'), path.child('b.mp3')
+        a.setContent('a')
+        b.setContent('bb')
+        index = '--index=' + path.child('audio.axiom').path
+        command = self.createCommand(index)
+        command.processArgument(a)
+        command.processArgument(b)
+        self.assertEquals(command.index.flush(), 2)
+        self.assertEquals(self.mutagen.opened, [a.path, b.path])
+
+        c = path.child('c.mp3')
+        a.moveTo(c)
+        b.setContent('bbb')
+        command = self.createCommand(index)
+        self.assertEquals(
+            command.processArgument(c),
+            dict(artist=u'Artist', album=u'Album', title=u'Title',
+                 date=u'2010', tracknumber=3))
+        command.processArgument(b)
+        self.assertEquals(self.mutagen.opened, [a.path, b.path, b.path])
+
+        command.index.flush()
+        self.assertEquals(
+            sorted(entry.path for entry in
+                   command.index.store.query(audio.TagIndexEntry)),
+            [b.path, c.path])
+
+
+    def test_indexReplaced(self):
+        """
+        Indexing a file replaces any previous entry for the same file, even
+        under a different path, and the least recently indexed files are
+        evicted beyond C{'index-size'}.
+        """
+        path = FilePath(self.mktemp())
+        path.makedirs()
+        index = '--index=' + path.child('audio.axiom').path
+        command = self.createCommand(index, '--index-size=2')
+        tagIndex = command.getIndex()
+        identify = lambda name: (1, ord(name), 10, 1.0)
+        for name in ['a', 'b', 'c']:
+            tagIndex.put(u'/' + name, identify(name), {})
+        tagIndex.put(u'/moved', identify('c'), {u'title': [u'C']})
+        tagIndex.flush()
+        self.assertEquals(
+            sorted((entry.path, entry.inode) for entry in
+                   tagIndex.store.query(audio.TagIndexEntry)),
+            [(u'/b', ord('b')), (u'/moved', ord('c'))])
+        self.assertEquals(tagIndex.get(identify('c')), {u'title': [u'C']})
+
+
+    def test_pruneIndex(self):
+        """
+        With C{'prune-index'}, entries whose path no longer holds the file
+        they were indexed from are removed before any argument is processed.
+        """
+        path = FilePath(self.mktemp())
+        path.makedirs()
+        a, b, c = [path.child(name) for name in ['a.mp3', 'b.mp3', 'c.mp3']]
+        for p in [a, b, c]:
+            p.setContent('a')
+        index = '--index=' + path.child('audio.axiom').path
+        command = self.createCommand(index)
+        for p in [a, b, c]:
+            command.processArgument(p)
+        command.index.flush()
+        command.index.store.close()
+
+        a.remove()
+        b.setContent('bb')
+        command = self.createCommand(index, '--prune-index')
+        command.beginRun(command.parent)
+        self.assertEquals(
+            [entry.path for entry in
+             command.index.store.query(audio.TagIndexEntry)],
+            [c.path])
+
+
+    def test_noActIndex(self):
+        """
+        The tag index is neither opened nor pruned for C{'no-act'} runs.
+        """
+        index = FilePath(self.mktemp())
+        command = self.createCommand(
+            '--index=' + index.path, '--prune-index')
+        command.parent['no-act'] = True
+        command.beginRun(command.parent)
+        command.processArgument(FilePath(u'a.mp3'))
+        self.assertIdentical(command.getIndex(), None)
+        self.assertFalse(index.exists())
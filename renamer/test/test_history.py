@@ -1,5 +1,13 @@
+import json
+import tarfile
+from StringIO import StringIO
+
+from epsilon.extime import Time
+
 from axiom.store import Store
 
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
 from twisted.python.filepath import FilePath
 from twisted.trial.unittest import TestCase
 
@@ -83,6 +91,121 @@ class HistoryTests(TestCase):
 
 
 
+    def test_getChangesets(self):
+        """
+        L{renamer.history.History.getChangesets} sorts, filters and pages
+        through changesets.
+        """
+        changesets = []
+        for i, path in enumerate([u'/a/x', u'/b/x', u'/a/y', u'/ab']):
+            cs = self.history.newChangeset()
+            action = cs.newAction(
+                u'fake', FilePath(path), FilePath(path + u'.new'),
+                verify=False)
+            cs.do(action, FakeOptions(), _adapter=lambda action: FakeAction())
+            cs.modified = Time.fromPOSIXTimestamp(1000 + i)
+            changesets.append(cs)
+        self.history.pruneChangesets()
+
+        getChangesets = lambda **kw: list(self.history.getChangesets(**kw))
+        self.assertEquals(getChangesets(), changesets)
+        self.assertEquals(
+            getChangesets(newestFirst=True), changesets[::-1])
+        self.assertEquals(
+            getChangesets(newestFirst=True, limit=2, offset=1),
+            [changesets[2], changesets[1]])
+        self.assertEquals(
+            getChangesets(since=Time.fromPOSIXTimestamp(1002)),
+            changesets[2:])
+        self.assertEquals(
+            getChangesets(path=u'/a'), [changesets[0], changesets[2]])
+        self.assertEquals(getChangesets(path=u'/a/'), getChangesets(path=u'/a'))
+        self.assertEquals(getChangesets(path=u'/b/x.new'), [changesets[1]])
+        self.assertEquals(getChangesets(path=u'/'), changesets)
+        self.assertEquals(getChangesets(path=u'/c'), [])
+        self.assertEquals(
+            [a.src for a in changesets[0].getActions(path=u'/a')], [u'/a/x'])
+        self.assertEquals(list(changesets[0].getActions(path=u'/b')), [])
+
+
+
+    def test_pruneChangesetsIncremental(self):
+        """
+        L{renamer.history.History.pruneChangesets} only examines the
+        changesets it is given, if any, but always adopts non-empty changesets
+        left by an interrupted run.
+        """
+        touched = self.history.newChangeset()
+        untouched = self.history.newChangeset()
+        interrupted = self.history.newChangeset()
+        active = self.history.newChangeset()
+        for cs in [interrupted, active]:
+            action = cs.newAction(
+                u'fake', FilePath(u'src'), FilePath(u'dst'), verify=False)
+            cs.do(action, FakeOptions(), _adapter=lambda action: FakeAction())
+
+        prunedChangesets, prunedActions = self.history.pruneChangesets(
+            [touched, active])
+        self.assertEquals(prunedChangesets, 1)
+        self.assertEquals(
+            list(self.store.query(history.Changeset)),
+            [untouched, interrupted, active])
+        self.assertIdentical(active.history, self.history)
+        self.assertIdentical(interrupted.history, self.history)
+        self.assertIdentical(untouched.history, None)
+
+
+    def test_archiveChangesets(self):
+        """
+        L{renamer.history.History.archiveChangesets} writes changesets last
+        modified before a certain time to an archive, as JSON, and removes
+        them and their actions from the store.
+        """
+        changesets = []
+        for i in xrange(3):
+            cs = self.history.newChangeset()
+            for j in xrange(2):
+                action = cs.newAction(
+                    u'fake',
+                    FilePath(u'/src%d%d' % (i, j)),
+                    FilePath(u'/dst%d%d' % (i, j)),
+                    verify=False)
+                cs.do(action, FakeOptions(),
+                      _adapter=lambda action: FakeAction())
+            cs.modified = Time.fromPOSIXTimestamp(1000 + i)
+            changesets.append(cs)
+        self.history.pruneChangesets()
+
+        archived = [cs.asArchived() for cs in changesets[:2]]
+        archive = StringIO()
+        count = self.history.archiveChangesets(
+            Time.fromPOSIXTimestamp(1002), archive, batchSize=1)
+        self.assertEquals(count, 2)
+        self.assertEquals(
+            [json.loads(line) for line in archive.getvalue().splitlines()],
+            archived)
+        self.assertEquals(
+            [a['src'] for a in archived[1]['actions']],
+            [u'/src10', u'/src11'])
+        self.assertEquals(
+            list(self.history.getChangesets()), changesets[2:])
+        self.assertEquals(
+            [a.src for a in self.store.query(history.Action)],
+            [u'/src20', u'/src21'])
+
+
+    def test_vacuumStore(self):
+        """
+        L{renamer.history.vacuumStore} rebuilds the store's database, leaving
+        its contents intact.
+        """
+        store = Store(FilePath(self.mktemp()))
+        h = history.History(store=store)
+        history.vacuumStore(store)
+        self.assertEquals(list(store.query(history.History)), [h])
+
+
+
 class ChangesetTests(TestCase):
     """
     Tests for L{renamer.history.Changeset}.
@@ -141,6 +264,43 @@ class ChangesetTests(TestCase):
 
 
 
+    def test_forget(self):
+        """
+        L{renamer.history.Changeset.forget} removes an action from the
+        changeset without undoing it.
+        """
+        cs = self.history.newChangeset()
+        action = cs.newAction(
+            u'fake', FilePath(u'src'), FilePath(u'dst'), verify=False)
+        cs.do(action, FakeOptions(), _adapter=lambda action: FakeAction())
+        self.assertEquals(cs.actionCount, 1)
+
+        cs.forget(action)
+        self.assertEquals(cs.actionCount, 0)
+        self.assertEquals(list(cs.getActions()), [])
+
+
+    def test_upgrade(self):
+        """
+        Upgrading a version 1 L{renamer.history.Changeset} counts its actions.
+        """
+        path = FilePath(self.mktemp())
+        stub = FilePath(__file__).sibling('data').child('history1.axiom.tbz2')
+        archive = tarfile.open(stub.path)
+        archive.extractall(path.path)
+        archive.close()
+
+        store = Store(path.child('history1.axiom'))
+        history.upgradeStore(store)
+        [cs] = store.query(history.Changeset)
+        self.assertEquals(cs.actionCount, 2)
+        self.assertEquals(
+            [(a.src, a.dst) for a in cs.getActions()],
+            [(u'/src0', u'/dst0'), (u'/src1', u'/dst1')])
+        self.assertEquals(list(cs.history.getChangesets()), [cs])
+
+
+
 class ActionTests(TestCase):
     """
     Tests for L{renamer.history.Action}.
@@ -184,3 +344,449 @@ class ActionTests(TestCase):
             repr(action),
             '<Action name=%r src=%r dst=%r created=%r>' % (
                 action.name, action.src, action.dst, action.created))
+
+
+
+class BatchedChangesetTests(TestCase):
+    """
+    Tests for L{renamer.history.BatchedChangeset}.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.history = history.History(store=self.store)
+        self.changeset = self.history.newChangeset()
+        self.clock = Clock()
+        self.performed = []
+
+
+    def getAction(self, name):
+        """
+        Get a fake action type that records the actions performed.
+        """
+        performed = self.performed
+
+        class _FakeAction(FakeAction):
+            def __init__(self, src, dst):
+                self.src = src
+                self.dst = dst
+
+            def do(self, options):
+                performed.append((name, self.src, self.dst))
+
+        return _FakeAction
+
+
+    def createBatch(self, **kw):
+        return history.BatchedChangeset(self.changeset, clock=self.clock, **kw)
+
+
+    def doAction(self, batch, src=u'src', dst=u'dst'):
+        batch.do(
+            u'fake', FilePath(src), FilePath(dst), FakeOptions(),
+            _getAction=self.getAction)
+
+
+    def test_size(self):
+        """
+        Actions are performed immediately but only committed to the changeset
+        once C{size} actions are pending.
+        """
+        batch = self.createBatch(size=3)
+        self.doAction(batch, u'a', u'b')
+        self.doAction(batch, u'c', u'd')
+        self.assertEquals(len(self.performed), 2)
+        self.assertEquals(len(batch), 2)
+        self.assertEquals(self.changeset.numActions, 0)
+
+        self.doAction(batch, u'e', u'f')
+        self.assertEquals(len(batch), 0)
+        self.assertEquals(
+            [(a.name, a.src, a.dst) for a in self.changeset.getActions()],
+            [(u'fake', FilePath(src).path, FilePath(dst).path)
+             for src, dst in [(u'a', u'b'), (u'c', u'd'), (u'e', u'f')]])
+
+
+    def test_interval(self):
+        """
+        Pending actions are committed C{interval} milliseconds after the first
+        pending action was performed.
+        """
+        batch = self.createBatch(size=0, interval=500)
+        self.doAction(batch)
+        self.clock.advance(0.25)
+        self.doAction(batch)
+        self.assertEquals(self.changeset.numActions, 0)
+        self.clock.advance(0.25)
+        self.assertEquals(self.changeset.numActions, 2)
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+
+    def test_flush(self):
+        """
+        L{renamer.history.BatchedChangeset.flush} commits all pending actions
+        and cancels any scheduled commit.
+        """
+        batch = self.createBatch(size=0, interval=500)
+        self.assertEquals(batch.flush(), 0)
+        self.doAction(batch)
+        self.doAction(batch)
+        self.assertEquals(batch.flush(), 2)
+        self.assertEquals(self.changeset.numActions, 2)
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+
+    def test_changesetFactory(self):
+        """
+        When no changeset is given, one is only created, with
+        C{changesetFactory}, when actions are first committed.
+        """
+        created = []
+        def _changesetFactory():
+            created.append(self.changeset)
+            return self.changeset
+
+        batch = history.BatchedChangeset(
+            size=0, clock=self.clock, changesetFactory=_changesetFactory)
+        self.assertEquals(batch.flush(), 0)
+        self.doAction(batch)
+        self.assertEquals(created, [])
+        self.assertEquals(batch.flush(), 1)
+        self.doAction(batch)
+        self.assertEquals(batch.flush(), 1)
+        self.assertEquals(created, [self.changeset])
+        self.assertEquals(self.changeset.numActions, 2)
+
+        self.assertRaises(ValueError, history.BatchedChangeset)
+
+
+    def test_failedAction(self):
+        """
+        Actions that fail to be performed are never committed.
+        """
+        def _getAction(name):
+            class _FailingAction(FakeAction):
+                def __init__(self, src, dst):
+                    pass
+
+                def do(self, options):
+                    raise OSError()
+            return _FailingAction
+
+        batch = self.createBatch(size=1)
+        d = batch.do(
+            u'fake', FilePath(u'src'), FilePath(u'dst'), FakeOptions(),
+            _getAction=_getAction)
+        self.assertFailure(d, OSError)
+        self.assertEquals(len(batch), 0)
+        self.assertEquals(self.changeset.numActions, 0)
+        return d
+
+
+    def test_bytePaths(self):
+        """
+        Byte string paths are decoded with the filesystem encoding before the
+        action is performed, actions whose paths cannot be decoded fail
+        without being performed.
+        """
+        self.patch(history.sys, 'getfilesystemencoding', lambda: 'utf-8')
+        batch = self.createBatch(size=1)
+        self.doAction(batch, src='caf\xc3\xa9', dst='dst')
+        [action] = self.changeset.getActions()
+        self.assertEquals(
+            (action.src, action.dst),
+            (FilePath(u'caf\xe9').path, FilePath(u'dst').path))
+
+        d = batch.do(
+            u'fake', FilePath('\xff'), FilePath(u'dst2'), FakeOptions(),
+            _getAction=self.getAction)
+        self.assertFailure(d, UnicodeDecodeError)
+        self.assertEquals(len(self.performed), 1)
+        return d
+
+
+    def test_commitFailed(self):
+        """
+        When committing pending actions fails, they remain pending and are
+        committed by a later flush.
+        """
+        batch = self.createBatch(size=0)
+        self.doAction(batch)
+        self.doAction(batch)
+        def _transact(f, *a):
+            raise RuntimeError('Disk full')
+        self.patch(self.store, 'transact', _transact)
+        self.assertRaises(RuntimeError, batch.flush)
+        self.assertEquals(len(batch), 2)
+
+        del self.store.transact
+        self.doAction(batch)
+        self.assertEquals(batch.flush(), 3)
+        self.assertEquals(self.changeset.numActions, 3)
+
+
+    def test_runInThread(self):
+        """
+        Actions are performed with C{runInThread}, and only queued once the
+        deferred it returns fires.
+        """
+        calls = []
+        def runInThread(f, *a, **kw):
+            d = Deferred()
+            d.addCallback(lambda ignored: f(*a, **kw))
+            calls.append(d)
+            return d
+
+        batch = self.createBatch(size=1, runInThread=runInThread)
+        done = []
+        d = batch.do(
+            u'fake', FilePath(u'src'), FilePath(u'dst'), FakeOptions(),
+            _getAction=self.getAction)
+        d.addCallback(done.append)
+        self.assertEquals(self.performed, [])
+        self.assertEquals(self.changeset.numActions, 0)
+
+        calls[0].callback(None)
+        self.assertEquals(len(self.performed), 1)
+        self.assertEquals(self.changeset.numActions, 1)
+        self.assertEquals(done, [None])
+
+
+    def test_sameDestinationInFlight(self):
+        """
+        A second action to a destination that an action still in flight is
+        renaming to fails with L{renamer.errors.NoClobber}, without being
+        performed; once the first action is done the destination is free
+        again.
+        """
+        calls = []
+        def runInThread(f, *a, **kw):
+            d = Deferred()
+            d.addCallback(lambda ignored: f(*a, **kw))
+            calls.append(d)
+            return d
+
+        batch = self.createBatch(size=0, runInThread=runInThread)
+        def _do(src):
+            return batch.do(
+                u'fake', FilePath(src), FilePath(u'dst'), FakeOptions(),
+                _getAction=self.getAction)
+
+        _do(u'a')
+        self.assertFailure(_do(u'b'), errors.NoClobber)
+        self.assertEquals(len(calls), 1)
+
+        calls[0].callback(None)
+        self.assertEquals(
+            self.performed, [(u'fake', FilePath(u'a'), FilePath(u'dst'))])
+        _do(u'c')
+        self.assertEquals(len(calls), 2)
+
+
+
+class UndoDependenciesTests(TestCase):
+    """
+    Tests for L{renamer.history.undoDependencies}.
+    """
+    def test_independent(self):
+        """
+        Actions that involve unrelated paths do not depend on each other.
+        """
+        self.assertEquals(
+            history.undoDependencies([
+                (u'/a/1', u'/b/1'),
+                (u'/a/2', u'/b/2'),
+                (u'/a/3', u'/b/3')]),
+            [set(), set(), set()])
+
+
+    def test_samePath(self):
+        """
+        An action depends on the last action to involve the same path, such
+        as a symlink created at the source of a move.
+        """
+        self.assertEquals(
+            history.undoDependencies([
+                (u'/b/1', u'/a/1'),
+                (u'/a/1', u'/b/1'),
+                (u'/a/2', u'/b/2'),
+                (u'/b/1', u'/c/1')]),
+            [set(), set([0]), set(), set([1])])
+
+
+    def test_nestedPaths(self):
+        """
+        An action depends on earlier actions involving paths beneath, or
+        above, the paths it involves.
+        """
+        self.assertEquals(
+            history.undoDependencies([
+                (u'/a/b/1', u'/x/1'),
+                (u'/a/c/2', u'/x/2'),
+                (u'/a', u'/y'),
+                (u'/a/b/3', u'/x/3'),
+                (u'/z', u'/y/4')]),
+            [set(), set(), set([0, 1]), set([2]), set([2])])
+
+
+
+class FakeUndoAction(object):
+    """
+    Undoable action whose undo results are controlled by the test.
+    """
+    def __init__(self, action, undone):
+        self.action = action
+        self.undone = undone
+
+
+    def undo(self, options):
+        self.undone.append(self.action)
+
+
+
+class ParallelUndoTests(TestCase):
+    """
+    Tests for L{renamer.history.ParallelUndo}.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.history = history.History(store=self.store)
+        self.changeset = self.history.newChangeset()
+        self.calls = []
+
+
+    def createActions(self, *paths):
+        """
+        Create and perform actions, in undo order.
+        """
+        actions = []
+        for src, dst in reversed(paths):
+            action = self.changeset.newAction(
+                u'fake', FilePath(src), FilePath(dst), verify=False)
+            self.changeset.do(
+                action, FakeOptions(), _adapter=lambda action: FakeAction())
+            actions.insert(0, action)
+        return actions
+
+
+    def runInThread(self, f, *a, **kw):
+        """
+        Record calls instead of running them in a thread.
+        """
+        d = Deferred()
+        d.addCallback(lambda ignored: f(*a, **kw))
+        self.calls.append((f.im_self.action, d))
+        return d
+
+
+    def createUndo(self, actions, **kw):
+        undone = self.undone = []
+        return history.ParallelUndo(
+            self.changeset, actions, FakeOptions(),
+            runInThread=self.runInThread,
+            _adapter=lambda action: FakeUndoAction(action, undone),
+            **kw)
+
+
+    def test_concurrency(self):
+        """
+        At most C{concurrency} independent actions are undone at once, and
+        undone actions are only removed from the changeset once all are done.
+        """
+        actions = self.createActions(
+            (u'/a/1', u'/b/1'), (u'/a/2', u'/b/2'), (u'/a/3', u'/b/3'))
+        d = self.createUndo(actions, concurrency=2).run()
+        self.assertEquals([a for a, _ in self.calls], actions[:2])
+
+        self.calls[1][1].callback(None)
+        self.assertEquals([a for a, _ in self.calls], actions)
+        self.assertEquals(self.changeset.actionCount, 3)
+
+        self.calls[0][1].callback(None)
+        self.calls[2][1].callback(None)
+        self.assertEquals(
+            self.successResultOf(d), [actions[1], actions[0], actions[2]])
+        self.assertEquals(self.changeset.actionCount, 0)
+        self.assertEquals(list(self.changeset.getActions()), [])
+
+
+    def test_ordering(self):
+        """
+        Conflicting actions are only undone once the actions they depend on
+        have been undone.
+        """
+        actions = self.createActions(
+            (u'/b/1', u'/a/1'), (u'/a/1', u'/b/1'), (u'/a/2', u'/b/2'))
+        d = self.createUndo(actions, concurrency=4).run()
+        self.assertEquals(
+            [a for a, _ in self.calls], [actions[0], actions[2]])
+
+        self.calls[0][1].callback(None)
+        self.assertEquals(
+            [a for a, _ in self.calls], [actions[0], actions[2], actions[1]])
+        self.calls[1][1].callback(None)
+        self.calls[2][1].callback(None)
+        self.assertEquals(self.undone, [actions[0], actions[2], actions[1]])
+        self.successResultOf(d)
+
+
+    def test_failure(self):
+        """
+        When an action fails to be undone no more actions are started, the
+        actions that were undone are removed from the changeset and the
+        failure is reported.
+        """
+        actions = self.createActions(
+            (u'/b/1', u'/a/1'), (u'/a/1', u'/b/1'), (u'/a/2', u'/b/2'))
+        d = self.createUndo(actions, concurrency=4).run()
+        self.calls[0][1].errback(OSError())
+        self.assertNoResult(d)
+        self.calls[1][1].callback(None)
+        self.failureResultOf(d, OSError)
+        self.assertEquals(len(self.calls), 2)
+        self.assertEquals(
+            list(self.changeset.getActions()), [actions[1], actions[0]])
+        self.assertEquals(self.changeset.actionCount, 2)
+
+
+    def test_ignoreErrors(self):
+        """
+        With C{ignoreErrors}, actions failing with C{OSError} are left in the
+        changeset and undoing carries on.
+        """
+        actions = self.createActions((u'/b/1', u'/a/1'), (u'/a/1', u'/b/1'))
+        d = self.createUndo(actions, ignoreErrors=True).run()
+        self.calls[0][1].errback(OSError())
+        self.calls[1][1].callback(None)
+        self.assertEquals(self.successResultOf(d), [actions[1]])
+        self.assertEquals(list(self.changeset.getActions()), [actions[0]])
+
+
+    def test_threaded(self):
+        """
+        By default actions are undone on a thread pool.
+        """
+        path = FilePath(unicode(self.mktemp()))
+        path.makedirs()
+        paths = []
+        for i in xrange(10):
+            src = path.child(u'src%d' % (i,))
+            src.touch()
+            dst = path.child(u'dst').child(unicode(i % 2)).child(
+                u'dst%d' % (i,))
+            action = self.changeset.newAction(u'move', src, dst)
+            self.changeset.do(action, {'one-file-system': False})
+            paths.append((src, dst))
+
+        actions = list(self.changeset.getActions())
+        actions.reverse()
+        undo = history.ParallelUndo(
+            self.changeset, actions, {'one-file-system': False},
+            concurrency=4)
+        d = undo.run()
+        def _check(undone):
+            self.assertEquals(len(undone), 10)
+            for src, dst in paths:
+                self.assertTrue(src.exists())
+                self.assertFalse(dst.exists())
+            self.assertEquals(self.changeset.actionCount, 0)
+        return d.addCallback(_check)
@@ -0,0 +1,73 @@
+from twisted.python import log
+from twisted.trial.unittest import TestCase
+
+from renamer import logging
+
+
+
+class Formatted(object):
+    """
+    Format argument that records how many times it is formatted.
+    """
+    def __init__(self):
+        self.formatted = 0
+
+
+    def __repr__(self):
+        self.formatted += 1
+        return '<Formatted>'
+
+
+
+class MsgTests(TestCase):
+    """
+    Tests for L{renamer.logging.msg}.
+    """
+    def setUp(self):
+        self.messages = []
+        self.patch(
+            log, 'msg',
+            lambda message, **kw: self.messages.append((message, kw)))
+        self.patch(logging, '_observer', logging.RenamerObserver(2))
+
+
+    def test_suppressed(self):
+        """
+        Messages more verbose than the observer are discarded without
+        formatting them or computing their L{renamer.logging.Lazy} arguments.
+        """
+        arg = Formatted()
+        calls = []
+        logging.msg('%r %s', arg, logging.Lazy(calls.append, 1), verbosity=3)
+        self.assertEquals(arg.formatted, 0)
+        self.assertEquals(calls, [])
+        self.assertEquals(self.messages, [])
+
+
+    def test_emitted(self):
+        """
+        Messages within the observer's verbosity are formatted with their
+        arguments, L{renamer.logging.Lazy} arguments are computed first.
+        """
+        arg = Formatted()
+        logging.msg(
+            u'%r %s %d%%', arg, logging.Lazy(u'lazy'.upper), 5, verbosity=2)
+        logging.msg('100%')
+        self.assertEquals(arg.formatted, 1)
+        self.assertEquals(
+            [message for message, kw in self.messages],
+            ['<Formatted> LAZY 5%', '100%'])
+        self.assertEquals(
+            self.messages[0][1], dict(source='renamer', verbosity=2))
+
+
+    def test_noObserver(self):
+        """
+        Without a L{renamer.logging.RenamerObserver}, every message is logged
+        for the benefit of other observers.
+        """
+        self.patch(logging, '_observer', None)
+        self.assertTrue(logging.isEnabled(5))
+        logging.msg('%d', 1, verbosity=5)
+        self.assertEquals(
+            self.messages, [('1', dict(source='renamer', verbosity=5))])
@@ -0,0 +1,207 @@
+import os
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import TestCase
+
+from renamer import errors
+from renamer.planner import RenamePlan
+
+
+
+class RenamePlanTests(TestCase):
+    """
+    Tests for L{renamer.planner.RenamePlan}.
+    """
+    def setUp(self):
+        self.path = FilePath(self.mktemp())
+        self.path.makedirs()
+        self.listed = []
+
+
+    def listdir(self, path):
+        self.listed.append(path)
+        return os.listdir(path)
+
+
+    def createFiles(self, *names):
+        """
+        Create files, containing their own names, in the test directory.
+        """
+        for name in names:
+            self.path.child(name).setContent(name)
+
+
+    def perform(self, plan):
+        """
+        Rename files according to a plan.
+        """
+        for src, dst in plan.steps(listdir=self.listdir):
+            self.assertFalse(dst.exists())
+            src.moveTo(dst)
+
+
+    def contents(self):
+        """
+        Map the names of the files in the test directory to their contents.
+        """
+        return dict((child.basename(), child.getContent())
+                    for child in self.path.children())
+
+
+    def test_independent(self):
+        """
+        Independent renames are ordered by destination.
+        """
+        a, b, c, d = map(self.path.child, 'abcd')
+        plan = RenamePlan()
+        plan.add(a, d)
+        plan.add(b, c)
+        self.assertEquals(plan.steps(), [(b, c), (a, d)])
+
+
+    def test_chain(self):
+        """
+        A rename whose destination is the source of another is performed after
+        it.
+        """
+        self.createFiles('a', 'b', 'c')
+        a, b, c, d = map(self.path.child, 'abcd')
+        plan = RenamePlan()
+        plan.add(a, b)
+        plan.add(b, c)
+        plan.add(c, d)
+        self.assertEquals(plan.steps(), [(c, d), (b, c), (a, b)])
+        self.perform(plan)
+        self.assertEquals(self.contents(), {'b': 'a', 'c': 'b', 'd': 'c'})
+
+
+    def test_cycle(self):
+        """
+        Cycles of renames are broken with a temporary name.
+        """
+        self.createFiles('a', 'b', 'c', 'x')
+        a, b, c, x, y = map(self.path.child, 'abcxy')
+        plan = RenamePlan()
+        plan.add(a, b)
+        plan.add(b, c)
+        plan.add(c, a)
+        plan.add(x, y)
+        steps = plan.steps()
+        self.assertEquals(len(steps), 5)
+        temporary = steps[0][1]
+        self.assertEquals(temporary.parent(), self.path)
+        self.assertEquals(
+            steps,
+            [(c, temporary), (b, c), (a, b), (temporary, a), (x, y)])
+        self.perform(plan)
+        self.assertEquals(
+            self.contents(), {'a': 'c', 'b': 'a', 'c': 'b', 'y': 'x'})
+
+
+    def test_groups(self):
+        """
+        Renames are grouped so that each group only depends on renames within
+        it, the renames in a group are in the order they should be performed.
+        """
+        self.createFiles('a', 'b', 'c', 'd', 'x')
+        a, b, c, d, e, x, y = map(self.path.child, 'abcdexy')
+        plan = RenamePlan()
+        plan.add(a, b)
+        plan.add(b, a)
+        plan.add(c, d)
+        plan.add(d, e)
+        plan.add(x, y)
+        groups = plan.groups()
+        temporary = groups[0][0][1]
+        self.assertEquals(
+            groups,
+            [[(b, temporary), (a, b), (temporary, a)],
+             [(d, e), (c, d)],
+             [(x, y)]])
+
+        plan = RenamePlan(sourcesVacated=False)
+        plan.add(a, e)
+        plan.add(x, y)
+        self.assertEquals(plan.groups(), [[(a, e)], [(x, y)]])
+
+
+    def test_swap(self):
+        """
+        Two files can swap names.
+        """
+        self.createFiles('a', 'b')
+        a, b = map(self.path.child, 'ab')
+        plan = RenamePlan()
+        plan.add(a, b)
+        plan.add(b, a)
+        self.perform(plan)
+        self.assertEquals(self.contents(), {'a': 'b', 'b': 'a'})
+
+
+    def test_duplicateDestination(self):
+        """
+        Renaming two sources to the same destination is a conflict.
+        """
+        a, b, c = map(self.path.child, 'abc')
+        plan = RenamePlan()
+        plan.add(a, c)
+        self.assertRaises(errors.ConflictingRenames, plan.add, b, c)
+
+
+    def test_duplicateSource(self):
+        """
+        Renaming a source to two different destinations is a conflict, adding
+        exactly the same rename again is not.
+        """
+        a, b, c = map(self.path.child, 'abc')
+        plan = RenamePlan()
+        plan.add(a, b)
+        plan.add(a, b)
+        self.assertRaises(errors.ConflictingRenames, plan.add, a, c)
+        self.assertEquals(len(plan), 1)
+
+
+    def test_noop(self):
+        """
+        Renaming a file to itself is skipped.
+        """
+        plan = RenamePlan()
+        plan.add(self.path.child('a'), self.path.child('a'))
+        self.assertEquals(plan.steps(), [])
+
+
+    def test_existingDestination(self):
+        """
+        A destination that already exists, and is not being renamed, is
+        detected before anything is renamed. Each destination directory is
+        only listed once.
+        """
+        self.createFiles('a', 'b', 'c')
+        a, b, c, d = map(self.path.child, 'abcd')
+        other = self.path.child('other').child('e')
+        plan = RenamePlan()
+        plan.add(a, d)
+        plan.add(b, other)
+        plan.add(c, a)
+        self.assertEquals(
+            plan.steps(listdir=self.listdir), [(a, d), (c, a), (b, other)])
+        self.assertEquals(
+            sorted(self.listed), sorted([self.path.path, other.dirname()]))
+
+        self.createFiles('z')
+        plan.add(self.path.child('x'), self.path.child('z'))
+        self.assertRaises(errors.NoClobber, plan.steps)
+
+
+    def test_sourcesNotVacated(self):
+        """
+        When sources are not vacated, such as when creating symlinks, a
+        destination that is also a source is a clobber.
+        """
+        self.createFiles('a', 'b')
+        a, b, c = map(self.path.child, 'abc')
+        plan = RenamePlan(sourcesVacated=False)
+        plan.add(a, c)
+        self.assertEquals(plan.steps(), [(a, c)])
+        plan.add(b, a)
+        self.assertRaises(errors.NoClobber, plan.steps)
@@ -1,8 +1,16 @@
+import json
+import os
+import string
 import sys
 
+from twisted.python import usage
+from twisted.python.filepath import FilePath
 from twisted.trial.unittest import TestCase
 
-from renamer import plugin
+from renamer import errors, plugin
+from renamer.irenamer import ICommand, IRenamingAction, IRenamingCommand
+from renamer.plugins.actions import MoveAction, SymlinkAction
+from renamer.plugins.tv import TVRage
 
 
 
@@ -32,3 +40,233 @@ class RenamerCommandTests(TestCase):
         self.assertEquals(
             decodeCommandLine(u'hello'.encode(sys.getdefaultencoding())),
             u'hello')
+
+
+
+class RenamingCommandTests(TestCase):
+    """
+    Tests for L{renamer.plugin.RenamingCommand}.
+    """
+    def setUp(self):
+        class Command(plugin.RenamingCommand):
+            defaultPrefixTemplate = string.Template(u'~/$a')
+            defaultNameTemplate = string.Template(u'$a - $b')
+            placeholders = ['a', 'b']
+        self.command = Command()
+        self.options = dict(prefix=None, name=None)
+
+
+    def test_buildDestination(self):
+        """
+        Destinations are built from the compiled templates, the expanded
+        prefixes are cached for the run.
+        """
+        src = FilePath(u'foo.mp3')
+        dst = self.command.buildDestination(
+            dict(a=u'x', b=1), self.options, src)
+        self.assertEquals(
+            dst, FilePath(os.path.expanduser(u'~/x')).child(u'x - 1.mp3'))
+        self.assertEquals(self.command._prefixes.keys(), [u'~/x'])
+
+        expanded = []
+        self.patch(os.path, 'expanduser', expanded.append)
+        self.command.buildDestination(dict(a=u'x', b=2), self.options, src)
+        self.assertEquals(expanded, [])
+
+
+    def test_noPrefix(self):
+        """
+        Without a prefix template the destination is in the same directory as
+        the source.
+        """
+        self.command.defaultPrefixTemplate = None
+        self.options['name'] = string.Template(u'$b')
+        src = FilePath(self.mktemp()).child(u'foo.mp3')
+        self.assertEquals(
+            self.command.buildDestination(dict(b=u'y'), self.options, src),
+            src.sibling(u'y.mp3'))
+
+
+    def test_unknownPlaceholder(self):
+        """
+        Compiling templates that use placeholders the command does not provide
+        raises L{twisted.python.usage.UsageError}.
+        """
+        self.options['name'] = string.Template(u'$a $c')
+        e = self.assertRaises(
+            usage.UsageError, self.command.compileTemplates, self.options)
+        self.assertIn('name template: c', str(e))
+
+        self.command.placeholders = None
+        self.command.compileTemplates(self.options)
+
+
+
+class PluginIndexTests(TestCase):
+    """
+    Tests for L{renamer.plugin.PluginIndex}.
+    """
+    def setUp(self):
+        self.path = FilePath(self.mktemp())
+        self.scans = []
+
+
+    def createIndex(self):
+        """
+        Create a L{renamer.plugin.PluginIndex} that records when it scans for
+        plugins.
+        """
+        index = plugin.PluginIndex(self.path)
+        scan = index.scan
+        def _scan():
+            self.scans.append(index)
+            return scan()
+        index.scan = _scan
+        return index
+
+
+    def test_scan(self):
+        """
+        L{renamer.plugin.PluginIndex.scan} finds plugins and describes them
+        without needing to keep the plugin objects around.
+        """
+        index = plugin.PluginIndex()
+        plugins = dict((p.name, p) for p in index.plugins())
+        tvrage = plugins['tvrage']
+        self.assertEquals(tvrage.description, TVRage.description)
+        self.assertEquals(tvrage.module, 'renamer.plugins.tv')
+        self.assertEquals(tvrage.attribute, 'TVRage')
+        self.assertIdentical(tvrage.load(), TVRage)
+        self.assertIn(tvrage, list(index.getPlugins(ICommand)))
+        self.assertIn(tvrage, list(index.getPlugins(IRenamingCommand)))
+        self.assertNotIn(tvrage, list(index.getPlugins(IRenamingAction)))
+        self.assertIn(
+            'move', [p.name for p in index.getPlugins(IRenamingAction)])
+
+
+    def test_persisted(self):
+        """
+        The plugin index is written to disk and used, instead of scanning for
+        plugins, while it is up to date.
+        """
+        plugins = self.createIndex().plugins()
+        self.assertTrue(self.path.exists())
+        self.assertEquals(len(self.scans), 1)
+
+        index = self.createIndex()
+        self.assertEquals(
+            [p.asDict() for p in index.plugins()],
+            [p.asDict() for p in plugins])
+        self.assertEquals(len(self.scans), 1)
+
+
+    def test_outdatedSources(self):
+        """
+        The plugin index is rebuilt when a plugin module changes.
+        """
+        self.createIndex().plugins()
+        index = json.loads(self.path.getContent())
+        source = sorted(index['sources'])[0]
+        index['sources'][source] -= 1
+        self.path.setContent(json.dumps(index))
+
+        self.createIndex().plugins()
+        self.assertEquals(len(self.scans), 2)
+        index = json.loads(self.path.getContent())
+        self.assertEquals(
+            index['sources'], plugin.PluginIndex(self.path).sources())
+
+
+    def test_outdatedVersion(self):
+        """
+        The plugin index is rebuilt when the version of Renamer changes.
+        """
+        self.createIndex().plugins()
+        self.patch(plugin, '__version__', 'something else')
+        self.createIndex().plugins()
+        self.assertEquals(len(self.scans), 2)
+
+
+    def test_unreadable(self):
+        """
+        A corrupt plugin index is ignored and rebuilt.
+        """
+        self.path.setContent('this is not an index')
+        plugins = self.createIndex().plugins()
+        self.assertIn('tvrage', [p.name for p in plugins])
+        self.assertEquals(len(self.scans), 1)
+        json.loads(self.path.getContent())
+
+
+    def test_unwritable(self):
+        """
+        Failing to write the plugin index is not fatal.
+        """
+        self.path.setContent('')
+        self.path = self.path.child('index')
+        plugins = self.createIndex().plugins()
+        self.assertIn('tvrage', [p.name for p in plugins])
+        self.assertFalse(self.path.exists())
+
+
+
+class ActionRegistryTests(TestCase):
+    """
+    Tests for the action registry in L{renamer.plugin}.
+    """
+    def setUp(self):
+        self.scans = []
+        def _getActions():
+            self.scans.append(None)
+            return iter(self.actions)
+        self.actions = [MoveAction, SymlinkAction]
+        self.patch(plugin, 'getActions', _getActions)
+        plugin.invalidateActionRegistry()
+        self.addCleanup(plugin.invalidateActionRegistry)
+
+
+    def test_getActionByName(self):
+        """
+        L{renamer.plugin.getActionByName} finds actions by name, only looking
+        for available actions once.
+        """
+        self.assertIdentical(plugin.getActionByName(u'move'), MoveAction)
+        self.assertIdentical(plugin.getActionByName('symlink'), SymlinkAction)
+        self.assertIdentical(plugin.getActionByName(u'move'), MoveAction)
+        self.assertEquals(len(self.scans), 1)
+
+
+    def test_noSuchAction(self):
+        """
+        L{renamer.plugin.getActionByName} raises
+        L{renamer.errors.NoSuchAction} for unknown action names.
+        """
+        self.assertRaises(
+            errors.NoSuchAction, plugin.getActionByName, u'frobnicate')
+
+
+    def test_firstActionWins(self):
+        """
+        When several actions have the same name, the first one found is used.
+        """
+        class AnotherMoveAction(MoveAction):
+            pass
+        self.actions.append(AnotherMoveAction)
+        self.assertIdentical(plugin.getActionByName(u'move'), MoveAction)
+
+
+    def test_invalidate(self):
+        """
+        L{renamer.plugin.invalidateActionRegistry} causes the available actions
+        to be found again.
+        """
+        plugin.getActionByName(u'move')
+        class CopyAction(MoveAction):
+            name = 'copy'
+        self.actions.append(CopyAction)
+        self.assertRaises(
+            errors.NoSuchAction, plugin.getActionByName, u'copy')
+
+        plugin.invalidateActionRegistry()
+        self.assertIdentical(plugin.getActionByName(u'copy'), CopyAction)
+        self.assertEquals(len(self.scans), 2)
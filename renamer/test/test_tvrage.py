@@ -1,10 +1,24 @@
 import cgi
+import sys
 import urllib
+from datetime import timedelta
 
+from epsilon.extime import Time
+
+from axiom.store import Store
+
+from pymeta.runtime import ParseError
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, gatherResults
 from twisted.python.filepath import FilePath
 from twisted.trial.unittest import TestCase
+from twisted.web.resource import Resource
+from twisted.web.server import Site
 
-from renamer import errors
+import renamer
+from renamer import errors, grammars
+from renamer.application import Options
 from renamer.plugins import tv
 
 
@@ -13,6 +27,8 @@ class DummyPluginParent(object):
     """
     Dummy plugin parent.
     """
+    def parseArgs(self, *args):
+        self.args = args
 
 
 
@@ -60,6 +76,150 @@ class TVRageTests(TestCase):
             self.plugin.extractParts, 'thiswillnotwork')
 
 
+    def test_fastParseParity(self):
+        """
+        Where L{renamer.plugins.tv.fastParse} matches a filename it produces
+        the same result as the first matching C{complete_strict} or
+        C{complete_lenient} grammar rule, it never matches filenames that
+        neither rule matches. Filenames with non-ASCII series names, or
+        non-ASCII words following a lenient match, are left to the grammar.
+        """
+        def _grammarParse(filename):
+            for rule in ['complete_strict', 'complete_lenient']:
+                try:
+                    res, err = tv.getFilenameGrammar()(filename).apply(rule)
+                except ParseError:
+                    continue
+                series, (season, episode) = res
+                return rule, (series, (season, episode))
+            return None
+
+        filenames = [case[0] for case in self.cases] + [
+            'thiswillnotwork',
+            's01e01.avi',
+            'Lost S01E01',
+            'Lost.12345.avi',
+            'A_-_B.S01E01.avi',
+            'Lost -S01E01.avi',
+            'Lost.1x01abc.S01E02.avi',
+            'Lost (2004) S01E02.avi',
+            'flash.gordon.2007.avi',
+            'Lost_-_[2x03]_-_Orientation.avi',
+            'Lost.-.s02e03.-.Orientation.avi',
+            u'Caf\xe9.S01E02.avi',
+            u'Lost.S01E02.\xe9.avi',
+            u'Show.123.Caf\xe9.S01E02.avi',
+            u'Show.123.Caf\xe9.1x02.avi']
+        for filename in filenames:
+            result = tv.fastParse(filename)
+            if result is None:
+                continue
+            expected = _grammarParse(filename)
+            self.assertEquals((filename, result), (filename, expected))
+            self.assertIdentical(type(result[1][0]), type(expected[1][0]))
+
+        self.assertIdentical(tv.fastParse(u'Caf\xe9.S01E02.avi'), None)
+        self.assertIdentical(
+            tv.fastParse(u'Show.123.Caf\xe9.S01E02.avi'), None)
+        self.assertIdentical(tv.fastParse(u'Show.123.Caf\xe9.1x02.avi'), None)
+        self.assertIdentical(tv.fastParse('thiswillnotwork'), None)
+        self.assertIdentical(tv.fastParse('Lost S01E01'), None)
+
+
+    def test_parseRules(self):
+        """
+        L{renamer.plugins.tv.parseRules} yields the same results as applying
+        each rule with a separate grammar instance, while only applying each
+        rule once at each position of the input.
+        """
+        rules = [
+            'complete_strict', 'complete_lenient', 'only_episode',
+            'partial_silly', 'only_series', 'only_episode_silly']
+
+        def _separately(filename):
+            for rule in rules:
+                try:
+                    res, err = tv.getFilenameGrammar()(filename).apply(rule)
+                except ParseError:
+                    continue
+                yield rule, res
+
+        filenames = [case[0] for case in self.cases] + [
+            'House - 1.avi', 'Chuck.avi', '1.avi', 'thiswillnotwork']
+        for filename in filenames:
+            self.assertEquals(
+                list(tv.parseRules(filename, rules)),
+                list(_separately(filename)))
+
+        applied = []
+        FilenameGrammar = tv.getFilenameGrammar()
+        class CountingGrammar(FilenameGrammar):
+            def rule_series_word(self):
+                applied.append(self.input.position)
+                return FilenameGrammar.rule_series_word(self)
+
+        self.patch(tv, 'FilenameGrammar', CountingGrammar)
+        list(tv.parseRules('How I Met Your Mother.avi', rules))
+        self.assertEquals(sorted(applied), sorted(set(applied)))
+
+
+    def _installCompiledGrammars(self):
+        """
+        Compile the grammars into a temporary L{renamer._compiled_grammar}
+        package, as a build would.
+        """
+        path = FilePath(self.mktemp()).child('_compiled_grammar')
+        grammars.writeCompiledGrammars(path.path)
+        self.patch(renamer, '__path__', renamer.__path__ + [path.parent().path])
+        self.patch(tv, 'FilenameGrammar', None)
+        def _cleanup():
+            for name in ['renamer._compiled_grammar',
+                         'renamer._compiled_grammar.tv']:
+                sys.modules.pop(name, None)
+            if hasattr(renamer, '_compiled_grammar'):
+                del renamer._compiled_grammar
+        self.addCleanup(_cleanup)
+
+
+    def test_compiledGrammar(self):
+        """
+        L{renamer.plugins.tv.getFilenameGrammar} uses the grammar compiled at
+        build time when it was compiled from the current grammar.
+        """
+        self._installCompiledGrammars()
+        from renamer._compiled_grammar import tv as compiled
+        self.assertEquals(
+            compiled.grammarHash, grammars.grammarHash(tv.filenameGrammar))
+        self.assertIdentical(tv.getFilenameGrammar(), compiled.Parser)
+        self.assertIdentical(tv.getFilenameGrammar(), compiled.Parser)
+        res, err = compiled.Parser('Lost.S01E01.avi').apply('complete_strict')
+        self.assertEquals(res, ('Lost', ['01', '01']))
+
+
+    def test_outdatedCompiledGrammar(self):
+        """
+        L{renamer.plugins.tv.getFilenameGrammar} compiles the grammar when the
+        grammar compiled at build time is out of date.
+        """
+        self._installCompiledGrammars()
+        from renamer._compiled_grammar import tv as compiled
+        self.patch(tv, 'filenameGrammar', tv.filenameGrammar + '\n')
+        FilenameGrammar = tv.getFilenameGrammar()
+        self.assertNotIdentical(FilenameGrammar, compiled.Parser)
+        res, err = FilenameGrammar('Lost.S01E01.avi').apply('complete_strict')
+        self.assertEquals(res, ('Lost', ['01', '01']))
+
+
+    def test_fastParseMatches(self):
+        """
+        L{renamer.plugins.tv.fastParse} matches all of the common filename
+        forms in L{cases}.
+        """
+        for case in self.cases:
+            rule, (series, (season, episode)) = tv.fastParse(case[0])
+            self.assertEquals((series, season, episode), case[1:])
+
+
     def test_extractPartsWithOverrides(self):
         """
         Override parts take preference when extracting TV show information from
@@ -146,3 +306,274 @@ class TVRageTests(TestCase):
         self.assertEquals(
             query,
             dict(show=['Dexter'], ep=['1x02']))
+
+
+    def test_connectionPool(self):
+        """
+        The TVRage agent uses a persistent connection pool configured by the
+        C{'max-connections'} and C{'idle-timeout'} options.
+        """
+        plugin = tv.TVRage()
+        plugin.parent = DummyPluginParent()
+        plugin.parseOptions(['--max-connections=5', '--idle-timeout=10'])
+        self.assertTrue(plugin.pool.persistent)
+        self.assertEquals(plugin.pool.maxPersistentPerHost, 5)
+        self.assertEquals(plugin.pool.cachedConnectionTimeout, 10)
+        self.assertIdentical(plugin.agent._pool, plugin.pool)
+
+
+    def test_noActCache(self):
+        """
+        The episode metadata cache is not used for C{'no-act'} runs.
+        """
+        options = Options(None)
+        options['no-act'] = True
+        self.plugin.beginRun(options)
+        self.assertIdentical(self.plugin.getCache(), None)
+
+
+    def test_lookupMetadataCached(self):
+        """
+        L{renamer.plugins.tv.TVRage.lookupMetadata} only fetches metadata from
+        TVRage when it is not already cached, and caches fetched metadata.
+        Concurrent lookups of the same episode share a single fetch.
+        """
+        fetches = []
+        def _fetchMetadata(seriesName, season, episode):
+            d = Deferred()
+            fetches.append(d)
+            return d
+
+        self.plugin.cache = tv.EpisodeCache(
+            Store(), ttl=timedelta(hours=1), maxEntries=10)
+        self.patch(self.plugin, 'fetchMetadata', _fetchMetadata)
+
+        results = []
+        self.plugin.lookupMetadata('Dexter', '1', '02').addCallback(
+            results.append)
+        self.plugin.lookupMetadata('dexter', 1, 2).addCallback(
+            results.append)
+        self.assertEquals(len(fetches), 1)
+
+        metadata = (u'Dexter', 1, 2, u'Crocodile')
+        fetches[0].callback(metadata)
+        self.assertEquals(results, [metadata, metadata])
+
+        self.plugin.lookupMetadata('Dexter', 1, 2).addCallback(
+            results.append)
+        self.assertEquals(len(fetches), 1)
+        self.assertEquals(results, [metadata] * 3)
+
+
+
+class FakeTVRagePage(Resource):
+    """
+    Stand-in for a TVRage page, serving canned content and recording the
+    query arguments of each request.
+    """
+    isLeaf = True
+
+
+    def __init__(self, content):
+        Resource.__init__(self)
+        self.content = content
+        self.requests = []
+
+
+    def render_GET(self, request):
+        self.requests.append(request.args)
+        request.setHeader('Content-Type', 'text/plain; charset=utf-8')
+        return self.content(request.args)
+
+
+
+class TVRageBulkTests(TestCase):
+    """
+    Tests for looking up TV episode metadata from series episode lists, using
+    a local stand-in for TVRage.
+    """
+    def setUp(self):
+        dataPath = FilePath(__file__).sibling('data')
+        show = dataPath.child('tvrage_show').getContent()
+        episode = dataPath.child('tvrage').getContent()
+        self.quickinfo = FakeTVRagePage(
+            lambda args: episode if 'ep' in args else show)
+        episodeList = dataPath.child('tvrage_episode_list').getContent()
+        self.episodeList = FakeTVRagePage(lambda args: episodeList)
+
+        root = Resource()
+        tools = Resource()
+        feeds = Resource()
+        root.putChild('tools', tools)
+        root.putChild('feeds', feeds)
+        tools.putChild('quickinfo.php', self.quickinfo)
+        feeds.putChild('episode_list.php', self.episodeList)
+        self.port = reactor.listenTCP(0, Site(root), interface='127.0.0.1')
+
+        self.plugin = tv.TVRage()
+        self.plugin.parent = DummyPluginParent()
+        self.plugin.parseOptions(['--bulk', '--no-cache'])
+        self.plugin.baseURL = 'http://127.0.0.1:%d' % (
+            self.port.getHost().port,)
+
+
+    def tearDown(self):
+        d = self.plugin.pool.closeCachedConnections()
+        d.addCallback(lambda ign: self.port.stopListening())
+        return d
+
+
+    def test_extractEpisodeList(self):
+        """
+        L{renamer.plugins.tv.TVRage.extractEpisodeList} extracts the series
+        name and a mapping of season and episode numbers to titles from a
+        TVRage episode list.
+        """
+        path = FilePath(__file__).sibling('data').child('tvrage_episode_list')
+        series, episodes = self.plugin.extractEpisodeList(
+            path.getContent().decode('utf-8'))
+        self.assertEquals(series, u'Dexter')
+        self.assertEquals(episodes, {
+            (1, 1): u'Dexter',
+            (1, 2): u'Crocodile',
+            (1, 3): u'Popping Cherry',
+            (2, 1): u"It's Alive!"})
+
+
+    def test_buildEpisodeListURLs(self):
+        """
+        L{renamer.plugins.tv.TVRage.buildShowURL} and
+        L{renamer.plugins.tv.TVRage.buildEpisodeListURL} construct URLs for
+        looking up a TVRage show identifier and the episode list for it.
+        """
+        path, query = urllib.splitquery(self.plugin.buildShowURL('Dexter'))
+        self.assertEquals(cgi.parse_qs(query), dict(show=['Dexter']))
+        path, query = urllib.splitquery(
+            self.plugin.buildEpisodeListURL('7926'))
+        self.assertTrue(path.endswith('/feeds/episode_list.php'))
+        self.assertEquals(cgi.parse_qs(query), dict(sid=['7926']))
+
+
+    def test_oneRequestPerSeries(self):
+        """
+        Looking up several episodes of the same series fetches the series
+        episode list once and answers every episode from it.
+        """
+        filenames = [
+            'Dexter.S01E01.avi',
+            'dexter.1x02.avi',
+            'Dexter - 103 - Popping Cherry.avi',
+            'Dexter [2x01].avi']
+        d = gatherResults([
+            self.plugin.processArgument(FilePath(filename))
+            for filename in filenames])
+
+        def _checkMappings(mappings):
+            self.assertEquals(
+                [(m['series'], m['season'], m['episode'], m['title'])
+                 for m in mappings],
+                [(u'Dexter', 1, 1, u'Dexter'),
+                 (u'Dexter', 1, 2, u'Crocodile'),
+                 (u'Dexter', 1, 3, u'Popping Cherry'),
+                 (u'Dexter', 2, 1, u"It's Alive!")])
+            self.assertEquals(self.quickinfo.requests, [{'show': ['Dexter']}])
+            self.assertEquals(self.episodeList.requests, [{'sid': ['7926']}])
+        d.addCallback(_checkMappings)
+        return d
+
+
+    def test_missingEpisode(self):
+        """
+        Episodes that are not in the series episode list are looked up
+        individually.
+        """
+        d = self.plugin.lookupMetadata('Dexter', 1, 20)
+
+        def _checkMetadata(metadata):
+            self.assertEquals(metadata, (u'Dexter', 1, 2, u'Crocodile'))
+            self.assertEquals(
+                self.quickinfo.requests,
+                [{'show': ['Dexter']}, {'show': ['Dexter'], 'ep': ['1x20']}])
+        d.addCallback(_checkMetadata)
+        return d
+
+
+
+class EpisodeCacheTests(TestCase):
+    """
+    Tests for L{renamer.plugins.tv.EpisodeCache}.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.cache = tv.EpisodeCache(
+            self.store, ttl=timedelta(hours=1), maxEntries=3)
+
+
+    def test_normalizeSeriesName(self):
+        """
+        L{renamer.plugins.tv.normalizeSeriesName} ignores case, punctuation
+        and whitespace between words.
+        """
+        for name in ['Arrested.Development', ' arrested_-_development ',
+                     u'ARRESTED DEVELOPMENT']:
+            self.assertEquals(
+                tv.normalizeSeriesName(name), u'arrested development')
+
+
+    def test_getPut(self):
+        """
+        Metadata that is put into the cache can be retrieved by equivalent
+        series names and season and episode numbers.
+        """
+        metadata = (u'Dexter', 1, 2, u'Crocodile')
+        self.assertIdentical(self.cache.get('Dexter', 1, 2), None)
+        self.cache.put('Dexter', '1', '02', metadata)
+        self.assertEquals(self.cache.get('dexter', 1, 2), metadata)
+        self.assertIdentical(self.cache.get('Dexter', 1, 3), None)
+
+        self.cache.put('Dexter', 1, 2, metadata)
+        self.assertEquals(
+            self.store.query(tv.EpisodeCacheEntry).count(), 1)
+
+
+    def test_reported(self):
+        """
+        Cached metadata has the season and episode numbers reported by TVRage,
+        rather than those that were looked up.
+        """
+        metadata = (u'Dexter', 1, 3, u'Popping Cherry')
+        self.cache.put('Dexter', 1, 2, metadata)
+        self.assertEquals(self.cache.get('Dexter', 1, 2), metadata)
+        self.assertIdentical(self.cache.get('Dexter', 1, 3), None)
+
+
+    def test_expired(self):
+        """
+        Metadata older than the cache TTL is not returned and is evicted by
+        L{renamer.plugins.tv.EpisodeCache.evict}.
+        """
+        self.cache.put('Dexter', 1, 2, (u'Dexter', 1, 2, u'Crocodile'))
+        entry = self.store.findUnique(tv.EpisodeCacheEntry)
+        entry.fetched = Time() - timedelta(hours=2)
+        self.assertIdentical(self.cache.get('Dexter', 1, 2), None)
+
+        self.cache.put('Dexter', 1, 3, (u'Dexter', 1, 3, u'Popping Cherry'))
+        self.cache.evict()
+        self.assertEquals(
+            [e.episode for e in self.store.query(tv.EpisodeCacheEntry)], [3])
+
+
+    def test_maxEntries(self):
+        """
+        L{renamer.plugins.tv.EpisodeCache.evict} evicts the least recently
+        fetched metadata when there are more than C{maxEntries} entries in the
+        cache.
+        """
+        for episode in xrange(1, 6):
+            self.cache.put(
+                'Dexter', 1, episode, (u'Dexter', 1, episode, u'Title'))
+        self.assertEquals(self.store.query(tv.EpisodeCacheEntry).count(), 5)
+        self.cache.evict()
+        self.assertEquals(
+            sorted(e.episode for e in self.store.query(tv.EpisodeCacheEntry)),
+            [3, 4, 5])
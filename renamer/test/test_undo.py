@@ -0,0 +1,151 @@
+import sys
+from StringIO import StringIO
+
+from epsilon.extime import Time
+
+from axiom.store import Store
+
+from twisted.python import usage
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import TestCase
+
+from renamer import history
+from renamer.plugins.undo import UndoCompact, UndoList
+
+
+
+class FakeAction(object):
+    def do(self, options):
+        pass
+
+
+
+class FakeRenamer(object):
+    def __init__(self, history):
+        self.history = history
+        self.store = history.store
+
+
+
+class UndoListTests(TestCase):
+    """
+    Tests for L{renamer.plugins.undo.UndoList}.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.history = history.History(store=self.store)
+        self.changesets = []
+        for i, path in enumerate([u'/a/x', u'/b/x', u'/a/y', u'/ab']):
+            cs = self.history.newChangeset()
+            action = cs.newAction(
+                u'fake', FilePath(path), FilePath(path + u'.new'),
+                verify=False)
+            cs.do(action, {}, _adapter=lambda action: FakeAction())
+            cs.modified = Time.fromPOSIXTimestamp(1000 + i)
+            self.changesets.append(cs)
+        self.history.pruneChangesets()
+
+
+    def listChangesets(self, *args):
+        """
+        Run the C{undo list} command, with command-line arguments, and return
+        the IDs of the changesets listed and any further output.
+        """
+        command = UndoList()
+        command.parseOptions(list(args))
+        output = StringIO()
+        self.patch(sys, 'stdout', output)
+        command.process(FakeRenamer(self.history), {})
+        listed = []
+        other = []
+        for line in output.getvalue().splitlines():
+            if line.startswith('Changeset ID='):
+                listed.append(int(line.split('=')[1].split(':')[0]))
+            elif line and not line.startswith('   Action'):
+                other.append(line)
+        return listed, other
+
+
+    def ids(self, *indexes):
+        return [self.changesets[i].storeID for i in indexes]
+
+
+    def test_limit(self):
+        """
+        At most C{'limit'} changesets are listed, most recent first, with a
+        hint when more are available; a limit of 0 lists every changeset.
+        """
+        self.assertEquals(
+            self.listChangesets('--limit=2'),
+            (self.ids(3, 2),
+             ['More changesets are available, use --offset=2']))
+        self.assertEquals(
+            self.listChangesets('--limit=0'), (self.ids(3, 2, 1, 0), []))
+
+
+    def test_offset(self):
+        """
+        C{'offset'} changesets are skipped, with or without a limit.
+        """
+        self.assertEquals(
+            self.listChangesets('--limit=1', '--offset=1'),
+            (self.ids(2), ['More changesets are available, use --offset=2']))
+        self.assertEquals(
+            self.listChangesets('--limit=0', '--offset=1'),
+            (self.ids(2, 1, 0), []))
+        self.assertEquals(
+            self.listChangesets('--offset=4'), ([], ['No changesets!']))
+
+
+    def test_since(self):
+        """
+        Only changesets modified since C{'since'} are listed, invalid dates
+        are rejected.
+        """
+        since = Time.fromPOSIXTimestamp(1002).asISO8601TimeAndDate()
+        self.assertEquals(
+            self.listChangesets('--since=' + since), (self.ids(3, 2), []))
+        self.assertRaises(
+            usage.UsageError, UndoList().parseOptions, ['--since=never'])
+
+
+    def test_path(self):
+        """
+        Only changesets with actions involving C{'path'}, or anything beneath
+        it, are listed.
+        """
+        self.assertEquals(
+            self.listChangesets('--path=/a'), (self.ids(2, 0), []))
+        self.assertEquals(
+            self.listChangesets('--path=/b/x.new'), (self.ids(1), []))
+        self.assertEquals(
+            self.listChangesets('--path=/a', '--limit=1'),
+            (self.ids(2), ['More changesets are available, use --offset=1']))
+
+
+
+class UndoCompactTests(TestCase):
+    """
+    Tests for L{renamer.plugins.undo.UndoCompact}.
+    """
+    def test_noAct(self):
+        """
+        With C{'no-act'} the history is neither pruned nor archived.
+        """
+        store = Store()
+        h = history.History(store=store)
+        empty = h.newChangeset()
+        cs = h.newChangeset()
+        action = cs.newAction(
+            u'fake', FilePath(u'/a'), FilePath(u'/b'), verify=False)
+        cs.do(action, {}, _adapter=lambda action: FakeAction())
+        cs.modified = Time.fromPOSIXTimestamp(1000)
+
+        command = UndoCompact()
+        archive = FilePath(self.mktemp())
+        command.parseOptions(['--archive=' + archive.path])
+        command.process(FakeRenamer(h), {'no-act': True})
+        self.assertEquals(
+            list(store.query(history.Changeset)), [empty, cs])
+        self.assertIdentical(cs.history, None)
+        self.assertFalse(archive.exists())
@@ -1,7 +1,19 @@
 import errno
+import os
+import string
+import threading
 from zope.interface import Interface
 
+from twisted.internet import reactor
+from twisted.internet.defer import (
+    CancelledError, Deferred, gatherResults, inlineCallbacks)
+from twisted.internet.error import TimeoutError
+from twisted.internet.task import Clock
 from twisted.python.filepath import FilePath
+from twisted.web.client import Agent, readBody
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+from twisted.web.static import Data
 from twisted.trial.unittest import TestCase
 
 from renamer import errors, util
@@ -54,6 +66,113 @@ class UtilTests(TestCase):
         self.assertTrue(dst.exists())
 
 
+    def test_renameErrors(self):
+        """
+        Errors other than C{EXDEV} are raised, regardless of
+        C{oneFileSystem}.
+        """
+        src = self.path.child('src')
+        dst = self.path.child('dst')
+        for oneFileSystem in [True, False]:
+            e = self.assertRaises(
+                OSError, util.rename, src, dst, oneFileSystem=oneFileSystem)
+            self.assertEquals(e.errno, errno.ENOENT)
+
+
+    def test_renameAcrossDevices(self):
+        """
+        Renaming a file across file systems copies it to the destination and
+        removes the original.
+        """
+        src = self.path.child('src')
+        src.setContent('x' * 1000)
+        src.chmod(0600)
+        dst = self.path.child('dst')
+        util.rename(src, dst, renamer=self.exdev, verify=True)
+        self.assertFalse(src.exists())
+        self.assertEquals(dst.getContent(), 'x' * 1000)
+        self.assertEquals(dst.getPermissions().shorthand(), 'rw-------')
+        self.assertEquals(self.path.listdir(), ['dst'])
+
+
+    def test_renameVerificationFailed(self):
+        """
+        If verifying a copy fails, the original file is left in place and the
+        copy is removed.
+        """
+        self.patch(util, 'filesEqual', lambda a, b, bufferSize: False)
+        src = self.path.child('src')
+        src.setContent('x')
+        dst = self.path.child('dst')
+        self.assertRaises(
+            errors.VerificationFailed,
+            util.rename, src, dst, renamer=self.exdev, verify=True)
+        self.assertEquals(self.path.listdir(), ['src'])
+
+
+    def test_copyFileBuffered(self):
+        """
+        Without C{sendfile}, files are copied through a buffer, a chunk at a
+        time.
+        """
+        src = self.path.child('src')
+        content = ''.join(chr(i % 256) for i in xrange(1000))
+        src.setContent(content)
+        dst = self.path.child('dst')
+        self.assertEquals(
+            util.copyFile(src, dst, bufferSize=64, sendfile=None), 1000)
+        self.assertEquals(dst.getContent(), content)
+        self.assertTrue(util.filesEqual(src, dst, bufferSize=64))
+
+
+    def test_copyFileSendfile(self):
+        """
+        With C{sendfile}, files are copied a chunk at a time until it reports
+        that nothing more was sent.
+        """
+        calls = []
+        def sendfile(outFD, inFD, offset, count):
+            calls.append((offset, count))
+            os.lseek(inFD, offset, os.SEEK_SET)
+            return os.write(outFD, os.read(inFD, count))
+
+        src = self.path.child('src')
+        src.setContent('x' * 100)
+        dst = self.path.child('dst')
+        self.assertEquals(
+            util.copyFile(src, dst, bufferSize=64, sendfile=sendfile), 100)
+        self.assertEquals(dst.getContent(), 'x' * 100)
+        self.assertEquals(calls, [(0, 64), (64, 64), (100, 64)])
+
+
+    def test_copyFileSendfileUnsupported(self):
+        """
+        If C{sendfile} does not support copying between the files, they are
+        copied through a buffer instead.
+        """
+        def sendfile(outFD, inFD, offset, count):
+            raise OSError(errno.EINVAL, 'Invalid argument')
+
+        src = self.path.child('src')
+        src.setContent('hello')
+        dst = self.path.child('dst')
+        self.assertEquals(util.copyFile(src, dst, sendfile=sendfile), 5)
+        self.assertEquals(dst.getContent(), 'hello')
+
+
+    def test_filesEqual(self):
+        """
+        Files are only equal if their contents are identical.
+        """
+        a = self.path.child('a')
+        a.setContent('abcd')
+        b = self.path.child('b')
+        for content, expected in [('abcd', True), ('abce', False),
+                                  ('abc', False)]:
+            b.setContent(content)
+            self.assertEquals(util.filesEqual(a, b, bufferSize=2), expected)
+
+
 
 class GlobTests(TestCase):
     """
@@ -108,6 +227,744 @@ class GlobTests(TestCase):
 
 
 
+class _FakeDirEntry(object):
+    """
+    Fake C{scandir.DirEntry} that reports a particular device.
+    """
+    def __init__(self, entry, device):
+        self.name = entry.name
+        self.path = entry.path
+        self._entry = entry
+        self._device = device
+
+
+    def is_dir(self, follow_symlinks=True):
+        return self._entry.is_dir(follow_symlinks=follow_symlinks)
+
+
+    def stat(self, follow_symlinks=True):
+        return FakeStat(st_dev=self._device)
+
+
+
+class FakeStat(object):
+    """
+    Fake C{os.stat} result.
+    """
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+
+
+class WalkTests(TestCase):
+    """
+    Tests for L{renamer.util.walkArguments}.
+    """
+    def setUp(self):
+        self.path = FilePath(self.mktemp())
+        self.path.makedirs()
+        for segments in [('a.mp3',), ('b.txt',), ('x', 'c.mp3'),
+                         ('x', 'y', 'd.mp3'), ('z', 'e.mp3')]:
+            path = self.path.descendant(segments)
+            if not path.parent().exists():
+                path.parent().makedirs()
+            path.touch()
+        self.listed = []
+
+
+    def scandir(self, directory):
+        self.listed.append(directory)
+        return util._listdirEntries(directory)
+
+
+    def walk(self, args=None, **kw):
+        """
+        Walk C{args}, by default L{path}, and return the paths found relative
+        to L{path}.
+        """
+        if args is None:
+            args = [self.path]
+        kw.setdefault('scandir', self.scandir)
+        return sorted(
+            '/'.join(path.segmentsFrom(self.path))
+            for path in util.walkArguments(args, **kw))
+
+
+    def test_walk(self):
+        """
+        Directory arguments are expanded into all of the files within them,
+        other arguments are produced unchanged.
+        """
+        self.assertEquals(
+            self.walk(),
+            ['a.mp3', 'b.txt', 'x/c.mp3', 'x/y/d.mp3', 'z/e.mp3'])
+        self.assertEquals(
+            self.walk([self.path.child('b.txt'), self.path.child('z')]),
+            ['b.txt', 'z/e.mp3'])
+
+
+    def test_listdir(self):
+        """
+        Without C{scandir}, directories are listed with C{os.listdir}.
+        """
+        self.assertEquals(
+            self.walk(scandir=None),
+            ['a.mp3', 'b.txt', 'x/c.mp3', 'x/y/d.mp3', 'z/e.mp3'])
+
+
+    def test_patterns(self):
+        """
+        Only files found by walking that match an include pattern are
+        produced, files and directories matching an exclude pattern are
+        skipped entirely.
+        """
+        self.assertEquals(
+            self.walk(include=[u'*.mp3'], exclude=[u'y', u'e*']),
+            ['a.mp3', 'x/c.mp3'])
+        self.assertNotIn(self.path.descendant(['x', 'y']).path, self.listed)
+        self.assertEquals(
+            self.walk([self.path.child('b.txt')], include=[u'*.mp3']),
+            ['b.txt'])
+
+
+    def test_symlinks(self):
+        """
+        Symlinks to directories are produced, rather than followed.
+        """
+        self.path.child('x').linkTo(self.path.child('link'))
+        self.assertIn('link', self.walk())
+        self.assertNotIn('link/c.mp3', self.walk())
+
+
+    def test_oneFileSystem(self):
+        """
+        Directories on a different filesystem from the argument are not
+        descended into when C{oneFileSystem} is C{True}.
+        """
+        def scandir(directory):
+            for entry in util._listdirEntries(directory):
+                device = os.stat(self.path.path).st_dev
+                if entry.name == 'x':
+                    device += 1
+                yield _FakeDirEntry(entry, device)
+
+        self.assertEquals(
+            self.walk(oneFileSystem=True, scandir=scandir),
+            ['a.mp3', 'b.txt', 'z/e.mp3'])
+        self.assertEquals(
+            self.walk(scandir=scandir),
+            ['a.mp3', 'b.txt', 'x/c.mp3', 'x/y/d.mp3', 'z/e.mp3'])
+
+
+    def test_lazy(self):
+        """
+        Files are produced as soon as the directory containing them has been
+        listed, before the rest of the tree is walked.
+        """
+        paths = util.walkArguments([self.path], scandir=self.scandir)
+        paths.next()
+        self.assertEquals(self.listed, [self.path.path])
+
+
+    def test_unreadable(self):
+        """
+        Directories that cannot be listed are skipped.
+        """
+        def scandir(directory):
+            if directory.endswith('x'):
+                raise OSError(errno.EACCES, 'Permission denied')
+            return util._listdirEntries(directory)
+
+        self.assertEquals(
+            self.walk(scandir=scandir),
+            ['a.mp3', 'b.txt', 'z/e.mp3'])
+
+
+
+class PipelineTests(TestCase):
+    """
+    Tests for L{renamer.util.Pipeline}.
+    """
+    def setUp(self):
+        self.consumed = []
+        self.waiting = {'first': [], 'second': []}
+        self.results = []
+
+
+    def values(self, count):
+        """
+        Generate C{count} values, recording each one that is consumed.
+        """
+        for value in xrange(count):
+            self.consumed.append(value)
+            yield value
+
+
+    def createPipeline(self, firstConcurrency, secondConcurrency, **kw):
+        def _first(value):
+            d = Deferred()
+            self.waiting['first'].append((d, value))
+            return d
+
+        def _second(value):
+            d = Deferred()
+            self.waiting['second'].append((d, value))
+            d.addCallback(self.results.append)
+            return d
+
+        return util.Pipeline([
+            util.Stage('first', _first, firstConcurrency),
+            util.Stage('second', _second, secondConcurrency)], **kw)
+
+
+    def fire(self, stageName, transform=lambda value: value):
+        """
+        Fire all waiting tasks in C{stageName}.
+        """
+        waiting, self.waiting[stageName] = self.waiting[stageName], []
+        for d, value in waiting:
+            d.callback(transform(value))
+
+
+    def test_stageConcurrency(self):
+        """
+        Each stage runs at most C{concurrency} tasks at once, independently of
+        the other stages, and values are passed from one stage to the next.
+        """
+        pipeline = self.createPipeline(3, 1)
+        finished = []
+        pipeline.run(self.values(5)).addCallback(finished.append)
+        self.assertEquals(
+            [value for d, value in self.waiting['first']], [0, 1, 2])
+
+        self.fire('first', lambda value: value * 10)
+        self.assertEquals(
+            [value for d, value in self.waiting['first']], [3, 4])
+        self.assertEquals(
+            [value for d, value in self.waiting['second']], [0])
+        self.assertEquals(len(pipeline.stages[1].queue), 2)
+
+        self.fire('first', lambda value: value * 10)
+        while self.waiting['second']:
+            self.fire('second')
+        self.assertEquals(self.results, [0, 10, 20, 30, 40])
+        self.assertEquals(finished, [0])
+
+
+    def test_backpressure(self):
+        """
+        Values are only consumed from the input while fewer than
+        C{maxPending} values are in the pipeline.
+        """
+        pipeline = self.createPipeline(2, 1, maxPending=3)
+        pipeline.run(self.values(100))
+        self.assertEquals(self.consumed, [0, 1])
+
+        self.fire('first')
+        self.assertEquals(self.consumed, [0, 1, 2])
+        self.assertEquals(pipeline.pending, 3)
+
+        self.fire('second')
+        self.assertEquals(self.consumed, [0, 1, 2, 3])
+
+
+    def test_failures(self):
+        """
+        Failed values are logged and dropped, other values continue to be
+        processed and the number of failures is reported on completion.
+        """
+        def _maybeFail(value):
+            if value % 2:
+                raise ValueError(value)
+            return value
+
+        results = []
+        pipeline = util.Pipeline([
+            util.Stage('first', _maybeFail, 2),
+            util.Stage('second', results.append, 1)])
+        finished = []
+        pipeline.run(xrange(5)).addCallback(finished.append)
+        self.assertEquals(results, [0, 2, 4])
+        self.assertEquals(finished, [2])
+        self.assertEquals(len(self.flushLoggedErrors(ValueError)), 2)
+
+
+    def test_synchronous(self):
+        """
+        Synchronous stages do not recurse for every value.
+        """
+        results = []
+        pipeline = util.Pipeline([util.Stage('only', results.append, 1)])
+        pipeline.run(xrange(10000))
+        self.assertEquals(len(results), 10000)
+
+
+    def test_invalidConcurrency(self):
+        """
+        Stages must allow at least one concurrent task.
+        """
+        self.assertRaises(ValueError, util.Stage, 'bad', None, 0)
+
+
+    def test_parallel(self):
+        """
+        L{renamer.util.parallel} fires a callable, with additional arguments,
+        for each value.
+        """
+        results = []
+        util.parallel(xrange(3), 2, lambda v, x: results.append(v * x), 2)
+        self.assertEquals(results, [0, 2, 4])
+
+
+
+class CoalescerTests(TestCase):
+    """
+    Tests for L{renamer.util.Coalescer}.
+    """
+    def setUp(self):
+        self.coalescer = util.Coalescer()
+        self.calls = []
+
+
+    def operation(self, value):
+        d = Deferred()
+        self.calls.append((d, value))
+        return d
+
+
+    def test_coalesce(self):
+        """
+        Operations for a key that is already in progress are not started, all
+        callers receive the result of the in-progress operation.
+        """
+        results = []
+        self.coalescer.call('a', self.operation, 1).addCallback(results.append)
+        self.coalescer.call('a', self.operation, 2).addCallback(results.append)
+        self.coalescer.call('b', self.operation, 3).addCallback(results.append)
+        self.assertEquals([value for d, value in self.calls], [1, 3])
+        self.assertIn('a', self.coalescer)
+
+        self.calls[0][0].callback('A')
+        self.assertEquals(results, ['A', 'A'])
+        self.assertNotIn('a', self.coalescer)
+
+        self.coalescer.call('a', self.operation, 4)
+        self.assertEquals([value for d, value in self.calls], [1, 3, 4])
+
+
+    def test_failure(self):
+        """
+        Failures are delivered to all callers.
+        """
+        failures = []
+        for i in xrange(2):
+            d = self.coalescer.call('a', self.operation, i)
+            d.addErrback(lambda f: failures.append(f.trap(ValueError)))
+        self.calls[0][0].errback(ValueError())
+        self.assertEquals(failures, [ValueError, ValueError])
+
+
+    def test_synchronous(self):
+        """
+        Operations that complete synchronously are not kept in progress.
+        """
+        results = []
+        self.coalescer.call('a', lambda: 'A').addCallback(results.append)
+        self.assertEquals(results, ['A'])
+        self.assertNotIn('a', self.coalescer)
+
+
+
+class TriggerRecordingReactor(object):
+    """
+    Reactor that records system event triggers, rather than adding them, and
+    otherwise defers to the real reactor.
+    """
+    def __init__(self):
+        self.triggers = {}
+
+
+    def __getattr__(self, name):
+        return getattr(reactor, name)
+
+
+    def addSystemEventTrigger(self, phase, eventType, f, *a, **kw):
+        handle = object()
+        self.triggers[handle] = (phase, eventType, f, a, kw)
+        return handle
+
+
+    def removeSystemEventTrigger(self, handle):
+        del self.triggers[handle]
+
+
+
+class ThreadRunnerTests(TestCase):
+    """
+    Tests for L{renamer.util.ThreadRunner}.
+    """
+    def test_run(self):
+        """
+        Calls are run in a thread from a pool that is started on first use,
+        their results are delivered in the reactor thread.
+        """
+        runner = util.ThreadRunner(2, 'test')
+        self.assertIdentical(runner.pool, None)
+        d = runner(lambda a, b: (threading.currentThread(), a + b), 1, b=2)
+        self.assertNotIdentical(runner.pool, None)
+
+        def _check((thread, result)):
+            self.assertNotIdentical(thread, threading.currentThread())
+            self.assertEquals(result, 3)
+            runner.stop()
+            self.assertIdentical(runner.pool, None)
+            runner.stop()
+        return d.addCallback(_check)
+
+
+    def test_shutdownTrigger(self):
+        """
+        A running pool is stopped when the reactor shuts down, its shutdown
+        trigger is removed when it is stopped first, so restarting the pool
+        does not accumulate triggers.
+        """
+        fakeReactor = TriggerRecordingReactor()
+        runner = util.ThreadRunner(1, 'test', reactor=fakeReactor)
+        for i in xrange(3):
+            d = runner(lambda: None)
+            self.assertEquals(len(fakeReactor.triggers), 1)
+            runner.stop()
+            self.assertEquals(fakeReactor.triggers, {})
+
+        d = runner(lambda: None)
+        [(phase, eventType, f, a, kw)] = fakeReactor.triggers.values()
+        self.assertEquals((phase, eventType), ('during', 'shutdown'))
+        fakeReactor.triggers.clear()
+        f(*a, **kw)
+        self.assertIdentical(runner.pool, None)
+        return d
+
+
+
+class LRUCacheTests(TestCase):
+    """
+    Tests for L{renamer.util.LRUCache}.
+    """
+    def test_evictLeastRecentlyUsed(self):
+        """
+        Once the cache is full, the least recently used entries are evicted
+        first.
+        """
+        cache = util.LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEquals(cache.get('a'), 1)
+        cache['c'] = 3
+        self.assertNotIn('b', cache)
+        self.assertEquals(cache.get('b', 'missing'), 'missing')
+        self.assertEquals((cache.get('a'), cache.get('c')), (1, 3))
+        self.assertEquals(len(cache), 2)
+
+
+    def test_sizeOf(self):
+        """
+        Entries are evicted based on their combined size, values larger than
+        the cache are not cached at all.
+        """
+        cache = util.LRUCache(10, sizeOf=len)
+        cache['a'] = 'x' * 4
+        cache['b'] = 'x' * 4
+        self.assertEquals(cache.size, 8)
+        cache['a'] = 'x' * 6
+        self.assertEquals(cache.size, 10)
+        cache['c'] = 'x' * 2
+        self.assertEquals(cache.size, 8)
+        self.assertNotIn('b', cache)
+        cache['d'] = 'x' * 11
+        self.assertNotIn('d', cache)
+        self.assertEquals(cache.size, 8)
+        cache.discard('a')
+        self.assertEquals(cache.size, 2)
+
+
+
+class CompiledTemplateTests(TestCase):
+    """
+    Tests for L{renamer.util.CompiledTemplate}.
+    """
+    def test_substitute(self):
+        """
+        Substitution gives the same result as
+        C{string.Template.safe_substitute}, including for escaped delimiters,
+        literal percent signs and missing placeholders.
+        """
+        mapping = dict(a=u'x', b=3, c=u'%s')
+        for template in [u'$a ${b}', u'$$a 100% $c', u'$a $missing ${d}',
+                         u'$ $1 $a$', u'']:
+            self.assertEquals(
+                util.CompiledTemplate(template).substitute(mapping),
+                string.Template(template).safe_substitute(mapping))
+
+
+    def test_placeholders(self):
+        """
+        The placeholders of a template, which may be given as a
+        C{string.Template}, are found when it is compiled.
+        """
+        template = util.CompiledTemplate(
+            string.Template(u'${a}/$b/$$c/$a'))
+        self.assertEquals(template.template, u'${a}/$b/$$c/$a')
+        self.assertEquals(template.placeholders, set([u'a', u'b']))
+
+
+
+def _double(value):
+    """
+    Double a non-negative value, in a worker process.
+    """
+    if value < 0:
+        raise ValueError('%d is negative' % (value,))
+    return os.getpid(), value * 2
+
+
+
+def _exit(value):
+    """
+    Exit a worker process abruptly.
+    """
+    os._exit(1)
+
+
+
+def _unpicklable(value):
+    """
+    Return a result that cannot be pickled.
+    """
+    return lambda: value
+
+
+
+class ProcessPoolTests(TestCase):
+    """
+    Tests for L{renamer.util.ProcessPool}.
+    """
+    def setUp(self):
+        self.pool = util.ProcessPool(_double, 2, batchSize=3)
+        self.addCleanup(self.pool.stop)
+
+
+    def test_call(self):
+        """
+        Calls are made in worker processes, in batches of at most
+        C{batchSize}, and their results delivered in the reactor thread.
+        """
+        submitted = []
+        submit = self.pool._submit
+        def _submit():
+            submitted.append(len(self.pool._batch))
+            submit()
+        self.patch(self.pool, '_submit', _submit)
+
+        d = gatherResults([self.pool.call(i) for i in xrange(5)])
+        self.assertEquals(submitted, [3])
+
+        def _check(results):
+            self.assertEquals(submitted, [3, 2])
+            self.assertEquals(
+                [value for pid, value in results], [0, 2, 4, 6, 8])
+            self.assertNotIn(os.getpid(), [pid for pid, value in results])
+        return d.addCallback(_check)
+
+
+    def test_failure(self):
+        """
+        Calls that fail in a worker fail with L{renamer.errors.WorkerError},
+        without affecting other calls in the same batch.
+        """
+        d1 = self.pool.call(-1)
+        d2 = self.pool.call(1)
+        self.assertFailure(d1, errors.WorkerError)
+        d1.addCallback(
+            lambda e: self.assertEquals(str(e), 'ValueError: -1 is negative'))
+        d2.addCallback(lambda (pid, value): self.assertEquals(value, 2))
+        return gatherResults([d1, d2])
+
+
+    def test_unpicklableResult(self):
+        """
+        Calls whose results cannot be pickled fail with
+        L{renamer.errors.WorkerError}.
+        """
+        pool = util.ProcessPool(_unpicklable, 1, pollInterval=0.01)
+        self.addCleanup(pool.stop)
+        d = self.assertFailure(pool.call(1), errors.WorkerError)
+        d.addCallback(lambda ignored: self.assertEquals(pool._outstanding, {}))
+        return d
+
+
+    def test_workerDied(self):
+        """
+        Calls in a batch whose worker process dies fail with
+        L{renamer.errors.WorkerError}, and the pool can still be stopped.
+        """
+        pool = util.ProcessPool(_exit, 1, pollInterval=0.01)
+        self.addCleanup(pool.stop)
+        d = gatherResults(
+            [self.assertFailure(pool.call(i), errors.WorkerError)
+             for i in xrange(2)])
+        def _check(failures):
+            self.assertIn('exited unexpectedly', str(failures[0]))
+            pool.stop()
+            self.assertIdentical(pool._pool, None)
+        return d.addCallback(_check)
+
+
+    def test_shutdownTrigger(self):
+        """
+        The pool's shutdown trigger is removed when it is stopped, so
+        restarting the pool does not accumulate triggers.
+        """
+        fakeReactor = TriggerRecordingReactor()
+        pool = util.ProcessPool(_double, 1, reactor=fakeReactor)
+        self.addCleanup(pool.stop)
+
+        def _restart(result):
+            self.assertEquals(len(fakeReactor.triggers), 1)
+            pool.stop()
+            self.assertEquals(fakeReactor.triggers, {})
+            return pool.call(2)
+
+        def _check(result):
+            [(phase, eventType, f, a, kw)] = fakeReactor.triggers.values()
+            self.assertEquals((phase, eventType), ('before', 'shutdown'))
+        return pool.call(1).addCallback(_restart).addCallback(_check)
+
+
+
+class DirectoryCacheTests(TestCase):
+    """
+    Tests for L{renamer.util.DirectoryCache}.
+    """
+    def setUp(self):
+        self.cache = util.DirectoryCache()
+        self.path = FilePath('/a/b/c')
+
+
+    def test_add(self):
+        """
+        Adding a directory also adds all of its ancestors.
+        """
+        self.cache.add(self.path)
+        self.assertIn(self.path, self.cache)
+        self.assertIn(FilePath('/a/b'), self.cache)
+        self.assertIn(FilePath('/'), self.cache)
+        self.assertNotIn(FilePath('/a/d'), self.cache)
+        self.assertEquals(len(self.cache), 4)
+
+
+    def test_discard(self):
+        """
+        Discarding a directory also discards its descendants, but not its
+        ancestors or siblings with a common prefix.
+        """
+        self.cache.add(self.path)
+        self.cache.add(FilePath('/a/bb'))
+        self.cache.discard(FilePath('/a/b'))
+        self.assertNotIn(self.path, self.cache)
+        self.assertNotIn(FilePath('/a/b'), self.cache)
+        self.assertIn(FilePath('/a'), self.cache)
+        self.assertIn(FilePath('/a/bb'), self.cache)
+
+
+    def test_clear(self):
+        """
+        Clearing the cache forgets every directory.
+        """
+        self.cache.add(self.path)
+        self.cache.clear()
+        self.assertEquals(len(self.cache), 0)
+        self.assertNotIn(self.path, self.cache)
+
+
+
+class TimeoutTests(TestCase):
+    """
+    Tests for L{renamer.util.timeout}.
+    """
+    def setUp(self):
+        self.clock = Clock()
+
+
+    def test_timeout(self):
+        """
+        Deferreds that do not fire within the timeout are cancelled and fail
+        with L{twisted.internet.error.TimeoutError}.
+        """
+        d = util.timeout(Deferred(), 5, self.clock)
+        self.clock.advance(5)
+        self.assertFailure(d, TimeoutError)
+        return d
+
+
+    def test_noTimeout(self):
+        """
+        Deferreds that fire within the timeout are not affected and the
+        timeout is cancelled.
+        """
+        d = Deferred()
+        util.timeout(d, 5, self.clock)
+        d.callback(42)
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+        self.assertEquals(self.successResultOf(d), 42)
+
+
+    def test_cancelled(self):
+        """
+        Deferreds cancelled for reasons other than the timeout still fail with
+        L{twisted.internet.defer.CancelledError}.
+        """
+        d = util.timeout(Deferred(), 5, self.clock)
+        d.cancel()
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+        self.failureResultOf(d, CancelledError)
+
+
+
+class CountingConnectionPoolTests(TestCase):
+    """
+    Tests for L{renamer.util.CountingConnectionPool}.
+    """
+    def setUp(self):
+        root = Resource()
+        root.putChild('', Data('hello', 'text/plain'))
+        self.port = reactor.listenTCP(0, Site(root), interface='127.0.0.1')
+        self.url = 'http://127.0.0.1:%d/' % (self.port.getHost().port,)
+        self.pool = util.CountingConnectionPool(reactor)
+        self.agent = Agent(reactor, pool=self.pool)
+
+
+    def tearDown(self):
+        d = self.pool.closeCachedConnections()
+        d.addCallback(lambda ign: self.port.stopListening())
+        return d
+
+
+    @inlineCallbacks
+    def test_counts(self):
+        """
+        Connections reused from the pool and newly created connections are
+        counted.
+        """
+        for i in xrange(3):
+            response = yield self.agent.request('GET', self.url)
+            body = yield readBody(response)
+            self.assertEquals(body, 'hello')
+        self.assertEquals(self.pool.requests, 3)
+        self.assertEquals(self.pool.newConnections, 1)
+        self.assertEquals(self.pool.reusedConnections, 2)
+
+
+
 class IThing(Interface):
     """
     Silly test interface.
@@ -1,19 +1,237 @@
 import cgi
 import errno
+import fnmatch
 import glob
+import io
 import itertools
+import multiprocessing
 import os
+import shutil
+import stat
+import string
 import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from multiprocessing.queues import SimpleQueue
 from StringIO import StringIO
 from zope.interface import alsoProvides
 
-from twisted.internet.defer import DeferredList, Deferred
-from twisted.internet.task import Cooperator
+try:
+    from scandir import scandir
+except ImportError:
+    scandir = getattr(os, 'scandir', None)
+
+try:
+    from sendfile import sendfile
+except ImportError:
+    sendfile = getattr(os, 'sendfile', None)
+
+from twisted.internet import reactor
+from twisted.internet.defer import CancelledError, Deferred, maybeDeferred
+from twisted.internet.error import TimeoutError
 from twisted.internet.protocol import Protocol
-from twisted.web.client import ResponseDone
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.failure import Failure
+from twisted.python.filepath import FilePath
+from twisted.python.threadpool import ThreadPool
+from twisted.web.client import HTTPConnectionPool, ResponseDone
 from twisted.web.http import PotentialDataLoss
 
-from renamer import errors
+from renamer import errors, logging
+
+
+
+class Stage(object):
+    """
+    A single stage of a L{renamer.util.Pipeline}.
+
+    @type name: C{str}
+    @ivar name: Stage name, used for diagnostics.
+
+    @type callable: C{callable}
+    @ivar callable: Callable to fire with each value entering the stage, its
+        result (or the result of the C{Deferred} it returns) is passed on to
+        the next stage.
+
+    @type concurrency: C{int}
+    @ivar concurrency: Limit of the number of concurrent tasks in this stage.
+
+    @type active: C{int}
+    @ivar active: Number of tasks currently running in this stage.
+
+    @type queue: C{deque}
+    @ivar queue: Values waiting for this stage to have capacity.
+    """
+    def __init__(self, name, callable, concurrency):
+        if concurrency < 1:
+            raise ValueError(
+                'Stage %r concurrency must be at least 1' % (name,))
+        self.name = name
+        self.callable = callable
+        self.concurrency = concurrency
+        self.active = 0
+        self.queue = deque()
+
+
+    def __repr__(self):
+        return '<%s %r active=%d/%d queued=%d>' % (
+            type(self).__name__,
+            self.name,
+            self.active,
+            self.concurrency,
+            len(self.queue))
+
+
+    @property
+    def idle(self):
+        """
+        Can this stage start another task?
+        """
+        return self.active < self.concurrency
+
+
+
+class Pipeline(object):
+    """
+    Bounded scheduler that passes values through a sequence of stages, each
+    with an independent concurrency limit.
+
+    Values are only consumed from the input iterable while the first stage is
+    idle and fewer than C{maxPending} values are in the pipeline, so slow later
+    stages apply backpressure to earlier ones and the input is never
+    materialized. Idle tasks in each stage take the next queued value as soon
+    as they finish, later stages are serviced before earlier ones to drain
+    the pipeline.
+
+    Failures are logged and the failed value is dropped from the pipeline;
+    processing of other values continues.
+
+    @type stages: C{list} of L{renamer.util.Stage}
+
+    @type maxPending: C{int}
+    @ivar maxPending: Limit of the number of values in the pipeline at once.
+
+    @type pending: C{int}
+    @ivar pending: Number of values in the pipeline.
+
+    @type failures: C{list} of L{twisted.python.failure.Failure}
+    @ivar failures: Failures that occurred while processing values.
+    """
+    def __init__(self, stages, maxPending=None):
+        if not stages:
+            raise ValueError('A pipeline must have at least one stage')
+        self.stages = list(stages)
+        if maxPending is None:
+            maxPending = 2 * sum(stage.concurrency for stage in self.stages)
+        self.maxPending = maxPending
+        self.pending = 0
+        self.failures = []
+        self._iterator = None
+        self._finished = None
+        self._pumping = False
+        self._dirty = False
+
+
+    def run(self, iterable):
+        """
+        Pass each value in C{iterable} through the pipeline.
+
+        @rtype:  C{Deferred<int>}
+        @return: A deferred that fires with the number of failures once every
+            value has been through the pipeline.
+        """
+        if self._finished is not None:
+            raise RuntimeError('Pipeline is already running')
+        self._iterator = iter(iterable)
+        self._finished = Deferred()
+        d = self._finished
+        self._pump()
+        return d
+
+
+    def _pump(self):
+        """
+        Start as much queued work as the stage limits allow and consume new
+        values from the input.
+
+        Tasks that complete synchronously call back into this method, in which
+        case the outermost call performs another pass instead of recursing.
+        """
+        if self._pumping:
+            self._dirty = True
+            return
+
+        self._pumping = True
+        try:
+            self._dirty = True
+            while self._dirty:
+                self._dirty = False
+                for index in reversed(xrange(len(self.stages))):
+                    stage = self.stages[index]
+                    while stage.queue and stage.idle:
+                        self._start(index, stage.queue.popleft())
+                self._consume()
+        finally:
+            self._pumping = False
+
+        if (self._iterator is None and not self.pending and
+            self._finished is not None):
+            logging.msg(
+                'Pipeline finished: %r', self.stages,
+                verbosity=4)
+            d, self._finished = self._finished, None
+            d.callback(len(self.failures))
+
+
+    def _consume(self):
+        """
+        Consume values from the input while there is capacity for them.
+        """
+        first = self.stages[0]
+        while (self._iterator is not None and first.idle and
+               self.pending < self.maxPending):
+            try:
+                value = self._iterator.next()
+            except StopIteration:
+                self._iterator = None
+            except:
+                self._iterator = None
+                self._failed(Failure())
+            else:
+                self.pending += 1
+                self._start(0, value)
+
+
+    def _start(self, index, value):
+        """
+        Start a task in the stage at C{index}.
+        """
+        stage = self.stages[index]
+        stage.active += 1
+        d = maybeDeferred(stage.callable, value)
+        d.addBoth(self._taskFinished, index)
+
+
+    def _taskFinished(self, result, index):
+        """
+        Pass the result of a task on to the next stage.
+        """
+        self.stages[index].active -= 1
+        if isinstance(result, Failure):
+            self.pending -= 1
+            self._failed(result)
+        elif index + 1 < len(self.stages):
+            self.stages[index + 1].queue.append(result)
+        else:
+            self.pending -= 1
+        self._pump()
+
+
+    def _failed(self, f):
+        self.failures.append(f)
+        logging.err(f)
 
 
 
@@ -33,14 +251,726 @@ def parallel(iterable, count, callable, *a, **kw):
     @param callable: Callable to fire concurrently.
 
     @rtype:  L{twisted.internet.defer.Deferred}
+    @return: A deferred that fires with the number of failures once
+        C{callable} has been fired for every element.
+    """
+    stage = Stage(
+        'parallel', lambda elem: callable(elem, *a, **kw), count)
+    return Pipeline([stage]).run(iterable)
+
+
+
+class Coalescer(object):
+    """
+    Share the result of an in-progress operation between all callers that
+    request it with the same key.
+
+    @type _waiting: C{dict} mapping keys to C{list} of C{Deferred}s
+    @ivar _waiting: Deferreds waiting on the result of the in-progress
+        operation for each key.
+    """
+    def __init__(self):
+        self._waiting = {}
+
+
+    def __contains__(self, key):
+        return key in self._waiting
+
+
+    def call(self, key, f, *a, **kw):
+        """
+        Fire C{f} with any additional arguments, unless an operation for
+        C{key} is already in progress, in which case wait for its result.
+
+        @rtype:  C{Deferred}
+        @return: A deferred that fires with the result of the operation for
+            C{key}.
+        """
+        d = Deferred()
+        if key in self._waiting:
+            self._waiting[key].append(d)
+        else:
+            self._waiting[key] = [d]
+            maybeDeferred(f, *a, **kw).addBoth(self._finished, key)
+        return d
+
+
+    def _finished(self, result, key):
+        for d in self._waiting.pop(key):
+            d.callback(result)
+
+
+
+class ThreadRunner(object):
+    """
+    Run blocking calls in a dedicated thread pool, so that they neither block
+    the reactor thread nor compete for threads used for anything else.
+
+    The pool is only started once it is first needed, and stopped when the
+    reactor shuts down if L{stop} has not been called by then.
+
+    @type size: C{int}
+    @ivar size: Maximum number of threads in the pool.
+
+    @type name: C{str}
+    @ivar name: Thread pool name, used for diagnostics.
+
+    @type pool: L{twisted.python.threadpool.ThreadPool}
+    @ivar pool: Running thread pool, or C{None} if it is not running.
+    """
+    def __init__(self, size, name, reactor=reactor):
+        self.size = size
+        self.name = name
+        self.reactor = reactor
+        self.pool = None
+        self._trigger = None
+
+
+    def __call__(self, f, *a, **kw):
+        """
+        Call C{f} with any additional arguments in a thread from the pool.
+
+        @rtype:  C{Deferred}
+        @return: A deferred that fires, in the reactor thread, with the
+            result of C{f}.
+        """
+        if self.pool is None:
+            self.pool = ThreadPool(
+                minthreads=0, maxthreads=self.size, name=self.name)
+            self.pool.start()
+            self._trigger = self.reactor.addSystemEventTrigger(
+                'during', 'shutdown', self._shutdown)
+        return deferToThreadPool(self.reactor, self.pool, f, *a, **kw)
+
+
+    def _shutdown(self):
+        # The trigger is spent once it has fired.
+        self._trigger = None
+        self.stop()
+
+
+    def stop(self):
+        """
+        Stop the thread pool, waiting for any calls in progress to finish.
+        """
+        if self._trigger is not None:
+            self.reactor.removeSystemEventTrigger(self._trigger)
+            self._trigger = None
+        if self.pool is not None:
+            pool, self.pool = self.pool, None
+            pool.stop()
+
+
+
+_started = None
+
+
+
+def _initWorker(started):
+    """
+    Initialize a worker process of a L{renamer.util.ProcessPool}.
+
+    @type  started: C{multiprocessing.queues.SimpleQueue}
+    @param started: Queue to report the batches a worker starts on to.
+    """
+    global _started
+    _started = started
+
+
+
+def _callBatch(f, batchID, args):
+    """
+    Call C{f} with each of C{args}, in a worker process, capturing failures.
+
+    The worker reports that it started on the batch, with its process ID, so
+    that the batch can be failed if the worker dies before finishing it.
+
+    @rtype:  C{list} of C{(bool, object)}
+    @return: For each argument, C{(True, result)} or C{(False, message)} if
+        the call failed.
+    """
+    if _started is not None:
+        _started.put((batchID, os.getpid()))
+    results = []
+    for arg in args:
+        try:
+            results.append((True, f(arg)))
+        except Exception, e:
+            results.append((False, '%s: %s' % (type(e).__name__, e)))
+    return results
+
+
+
+class ProcessPool(object):
+    """
+    Call a function in a pool of worker processes, passing arguments to the
+    workers in batches so that the cost of communicating with them is shared.
+
+    Arguments are batched until C{batchSize} of them are waiting or the
+    reactor gets a chance to run, whichever comes first. The pool is only
+    started once it is first needed, and stopped when the reactor shuts down
+    if L{stop} has not been called by then.
+
+    While batches are outstanding, the pool is checked every C{pollInterval}
+    seconds for batches that failed outside of C{f}, such as when a result
+    cannot be pickled, or whose worker process died; calls in those batches
+    fail rather than never finishing.
+
+    @type f: C{callable}
+    @ivar f: Picklable function, such as a module-level function, called with
+        each argument in a worker process. Its results must be picklable.
+
+    @type processes: C{int}
+    @ivar processes: Number of worker processes.
+
+    @type batchSize: C{int}
+    @ivar batchSize: Maximum number of arguments to pass to a worker at once.
+
+    @type pollInterval: C{float}
+    @ivar pollInterval: Seconds between checks for failed batches.
+
+    @type _outstanding: C{dict} mapping C{int} to C{list}
+    @ivar _outstanding: Batches submitted to the pool, by batch ID, that have
+        not yet been delivered, as C{[asyncResult, deferreds, pid]} where
+        C{pid} is the process ID of the worker that started on the batch, if
+        known.
+    """
+    def __init__(self, f, processes, batchSize=16, reactor=reactor,
+                 pollInterval=0.1):
+        self.f = f
+        self.processes = processes
+        self.batchSize = batchSize
+        self.reactor = reactor
+        self.pollInterval = pollInterval
+        self._pool = None
+        self._started = None
+        self._broken = False
+        self._batch = []
+        self._batchIDs = itertools.count()
+        self._outstanding = {}
+        self._delayedCall = None
+        self._poller = None
+        self._trigger = None
+
+
+    def call(self, arg):
+        """
+        Call L{f} with C{arg} in a worker process.
+
+        @rtype:  C{Deferred}
+        @return: A deferred that fires with the result of the call, or fails
+            with L{renamer.errors.WorkerError} if the call failed.
+        """
+        d = Deferred()
+        self._batch.append((arg, d))
+        if len(self._batch) >= self.batchSize:
+            self._submit()
+        elif self._delayedCall is None:
+            self._delayedCall = self.reactor.callLater(0, self._submit)
+        return d
+
+
+    def _getPool(self):
+        if self._pool is None:
+            self._started = SimpleQueue()
+            self._pool = multiprocessing.Pool(
+                self.processes, _initWorker, (self._started,))
+            self._trigger = self.reactor.addSystemEventTrigger(
+                'before', 'shutdown', self._shutdown)
+        return self._pool
+
+
+    def _shutdown(self):
+        # The trigger is spent once it has fired.
+        self._trigger = None
+        self.stop()
+
+
+    def _submit(self):
+        """
+        Pass the waiting arguments to a worker.
+        """
+        if self._delayedCall is not None:
+            if self._delayedCall.active():
+                self._delayedCall.cancel()
+            self._delayedCall = None
+
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        args = [arg for arg, d in batch]
+        deferreds = [d for arg, d in batch]
+        batchID = self._batchIDs.next()
+
+        def _finished(results):
+            # Called in one of the pool's threads.
+            self.reactor.callFromThread(self._deliver, batchID, results)
+
+        result = self._getPool().apply_async(
+            _callBatch, (self.f, batchID, args), callback=_finished)
+        self._outstanding[batchID] = [result, deferreds, None]
+        if self._poller is None:
+            self._poller = LoopingCall(self._poll)
+            self._poller.clock = self.reactor
+            self._poller.start(self.pollInterval, now=False)
+
+
+    def _deliver(self, batchID, results):
+        entry = self._outstanding.pop(batchID, None)
+        if entry is None:
+            return
+        asyncResult, deferreds, pid = entry
+        for d, (succeeded, result) in zip(deferreds, results):
+            if succeeded:
+                d.callback(result)
+            else:
+                d.errback(errors.WorkerError(result))
+        self._stopPolling()
+
+
+    def _fail(self, batchID, message):
+        """
+        Fail every call in a batch with L{renamer.errors.WorkerError}.
+        """
+        asyncResult, deferreds, pid = self._outstanding.pop(batchID)
+        for d in deferreds:
+            d.errback(errors.WorkerError(message))
+
+
+    def _poll(self):
+        """
+        Fail outstanding batches that failed in the pool, rather than in
+        L{f}, or whose worker process is no longer alive.
+        """
+        while not self._started.empty():
+            batchID, pid = self._started.get()
+            if batchID in self._outstanding:
+                self._outstanding[batchID][2] = pid
+
+        # Dead workers are replaced by the pool, but their batches are lost.
+        alive = set(
+            process.pid for process in multiprocessing.active_children())
+        for batchID, (asyncResult, deferreds, pid) in (
+                self._outstanding.items()):
+            if asyncResult.ready():
+                # Successful batches are delivered by the pool's callback.
+                try:
+                    asyncResult.get(0)
+                except Exception, e:
+                    self._fail(batchID, '%s: %s' % (type(e).__name__, e))
+            elif pid is not None and pid not in alive:
+                self._broken = True
+                self._fail(
+                    batchID, 'Worker process %d exited unexpectedly' % (pid,))
+        self._stopPolling()
+
+
+    def _stopPolling(self):
+        if not self._outstanding and self._poller is not None:
+            if self._poller.running:
+                self._poller.stop()
+            self._poller = None
+
+
+    def stop(self):
+        """
+        Stop the worker processes, once they have finished any calls in
+        progress.
+
+        If a worker process died, the pool is terminated instead, since it
+        would otherwise wait forever for the batch that worker lost.
+        """
+        if self._trigger is not None:
+            self.reactor.removeSystemEventTrigger(self._trigger)
+            self._trigger = None
+        if self._poller is not None:
+            if self._poller.running:
+                self._poller.stop()
+            self._poller = None
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            if self._broken:
+                pool.terminate()
+            else:
+                pool.close()
+            pool.join()
+
+
+
+class DirectoryCache(object):
+    """
+    Set of directories known to exist, shared by the actions performed during
+    a single run so that each distinct directory is only checked for, or
+    created, once.
+
+    Directories removed by anything other than Renamer while the cache is in
+    use are not noticed, use L{discard} or L{clear} when they might have been.
+    The cache may be used from multiple threads.
+
+    @type _known: C{set} of C{str}
+    @ivar _known: Paths of directories known to exist.
+    """
+    def __init__(self):
+        self._known = set()
+        self._lock = threading.Lock()
+
+
+    def __contains__(self, path):
+        return path.path in self._known
+
+
+    def __len__(self):
+        return len(self._known)
+
+
+    def add(self, path):
+        """
+        Note that a directory, and therefore all of its ancestors, exists.
+
+        @type  path: L{twisted.python.filepath.FilePath}
+        """
+        with self._lock:
+            while path.path not in self._known:
+                self._known.add(path.path)
+                parent = path.parent()
+                if parent == path:
+                    break
+                path = parent
+
+
+    def discard(self, path):
+        """
+        Forget that a directory, and any of its descendants, exists.
+
+        @type  path: L{twisted.python.filepath.FilePath}
+        """
+        prefix = os.path.join(path.path, '')
+        with self._lock:
+            self._known = set(
+                known for known in self._known
+                if known != path.path and not known.startswith(prefix))
+
+
+    def clear(self):
+        """
+        Forget every known directory.
+        """
+        with self._lock:
+            self._known.clear()
+
+
+
+class LRUCache(object):
     """
-    coop = Cooperator()
-    work = (callable(elem, *a, **kw) for elem in iterable)
-    return DeferredList([coop.coiterate(work) for i in xrange(count)])
+    Mapping that evicts its least recently used entries once their combined
+    size exceeds a limit.
 
+    @type maxSize: C{int}
+    @ivar maxSize: Maximum combined size of the cached values.
 
+    @type sizeOf: C{callable}
+    @ivar sizeOf: Called with a value to determine its size, such as an
+        estimate of the number of bytes of memory it uses. By default every
+        value has a size of 1, limiting the number of entries.
 
-def rename(src, dst, oneFileSystem=False, renamer=os.rename):
+    @type size: C{int}
+    @ivar size: Combined size of the cached values.
+    """
+    def __init__(self, maxSize, sizeOf=lambda value: 1):
+        self.maxSize = maxSize
+        self.sizeOf = sizeOf
+        self.size = 0
+        self._entries = OrderedDict()
+
+
+    def __repr__(self):
+        return '<%s entries=%d size=%d/%d>' % (
+            type(self).__name__,
+            len(self),
+            self.size,
+            self.maxSize)
+
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def get(self, key, default=None):
+        """
+        Get a cached value, marking it as the most recently used.
+        """
+        try:
+            value, size = self._entries.pop(key)
+        except KeyError:
+            return default
+        self._entries[key] = value, size
+        return value
+
+
+    def __setitem__(self, key, value):
+        """
+        Cache a value, evicting the least recently used values as needed.
+
+        Values larger than C{maxSize} are not cached at all.
+        """
+        self.discard(key)
+        size = self.sizeOf(value)
+        if size > self.maxSize:
+            return
+        self._entries[key] = value, size
+        self.size += size
+        while self.size > self.maxSize:
+            evictedKey, (evicted, evictedSize) = self._entries.popitem(
+                last=False)
+            self.size -= evictedSize
+
+
+    def discard(self, key):
+        """
+        Remove a value from the cache, if it is cached.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+
+
+class CompiledTemplate(object):
+    """
+    A C{string.Template} parsed once into a format string, for substituting
+    many mappings quickly.
+
+    Substitution has the semantics of C{string.Template.safe_substitute}:
+    placeholders missing from the mapping are left as they are.
+
+    @type template: C{unicode}
+    @ivar template: Template text.
+
+    @type placeholders: C{frozenset} of C{unicode}
+    @ivar placeholders: Names of the placeholders in the template.
+    """
+    def __init__(self, template):
+        if isinstance(template, string.Template):
+            template = template.template
+        self.template = template
+        self._parts = []
+        names = []
+        format = []
+        pattern = string.Template.pattern
+        pos = 0
+        for match in pattern.finditer(template):
+            literal = template[pos:match.start()]
+            name = match.group('named') or match.group('braced')
+            if name is None:
+                # An escaped or invalid delimiter is literal text.
+                if match.group('escaped') is not None:
+                    literal += string.Template.delimiter
+                else:
+                    literal += match.group()
+            self._parts.append((literal, name, match.group()))
+            format.append(literal.replace('%', '%%'))
+            if name is not None:
+                names.append(name)
+                format.append('%%(%s)s' % (name,))
+            pos = match.end()
+        literal = template[pos:]
+        self._parts.append((literal, None, u''))
+        format.append(literal.replace('%', '%%'))
+        self._format = u''.join(format)
+        self.placeholders = frozenset(names)
+
+
+    def __repr__(self):
+        return '<%s %r>' % (type(self).__name__, self.template)
+
+
+    def substitute(self, mapping):
+        """
+        Substitute C{mapping} into the template.
+
+        @type  mapping: C{dict}
+
+        @rtype: C{unicode}
+        """
+        try:
+            return self._format % mapping
+        except KeyError:
+            return self._safeSubstitute(mapping)
+
+
+    def _safeSubstitute(self, mapping):
+        result = []
+        for literal, name, original in self._parts:
+            result.append(literal)
+            if name is not None:
+                if name in mapping:
+                    result.append(u'%s' % (mapping[name],))
+                else:
+                    result.append(original)
+        return u''.join(result)
+
+
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+
+def _sendfileCopy(fin, fout, chunkSize, sendfile):
+    """
+    Copy the contents of C{fin} to C{fout} with C{sendfile}, without the data
+    ever being copied through userspace.
+
+    @rtype:  C{int} or C{None}
+    @return: Number of bytes copied, or C{None} if C{sendfile} does not
+        support copying between these files.
+    """
+    offset = 0
+    while True:
+        try:
+            sent = sendfile(fout.fileno(), fin.fileno(), offset, chunkSize)
+        except OSError, e:
+            if offset == 0 and e.errno in (errno.EINVAL, errno.ENOSYS):
+                return None
+            raise
+        if not sent:
+            return offset
+        offset += sent
+
+
+
+def _bufferedCopy(fin, fout, bufferSize):
+    """
+    Copy the contents of C{fin} to C{fout} through a single reused buffer.
+
+    @rtype:  C{int}
+    @return: Number of bytes copied.
+    """
+    buf = bytearray(bufferSize)
+    view = memoryview(buf)
+    copied = 0
+    while True:
+        read = fin.readinto(buf)
+        if not read:
+            return copied
+        written = 0
+        while written < read:
+            written += fout.write(view[written:read])
+        copied += read
+
+
+
+def copyFile(src, dst, bufferSize=COPY_BUFFER_SIZE, sendfile=sendfile):
+    """
+    Copy a regular file's contents, permissions and times.
+
+    The contents are copied with C{sendfile} where the platform supports it
+    between the two files, otherwise through a large buffer. The copy is
+    flushed to disk before returning.
+
+    @type  src: L{twisted.python.filepath.FilePath}
+
+    @type  dst: L{twisted.python.filepath.FilePath}
+
+    @type  bufferSize: C{int}
+    @param bufferSize: Number of bytes to copy at once.
+
+    @param sendfile: C{sendfile}-style function, or C{None} to always copy
+        through a buffer.
+
+    @rtype:  C{int}
+    @return: Number of bytes copied.
+    """
+    with io.open(src.path, 'rb', buffering=0) as fin:
+        with io.open(dst.path, 'wb', buffering=0) as fout:
+            copied = None
+            if sendfile is not None:
+                copied = _sendfileCopy(fin, fout, bufferSize, sendfile)
+            if copied is None:
+                copied = _bufferedCopy(fin, fout, bufferSize)
+            os.fsync(fout.fileno())
+    shutil.copystat(src.path, dst.path)
+    return copied
+
+
+
+def filesEqual(a, b, bufferSize=COPY_BUFFER_SIZE):
+    """
+    Determine whether two files have identical contents.
+
+    @type  a: L{twisted.python.filepath.FilePath}
+
+    @type  b: L{twisted.python.filepath.FilePath}
+
+    @rtype: C{bool}
+    """
+    if a.getsize() != b.getsize():
+        return False
+    with io.open(a.path, 'rb') as fa:
+        with io.open(b.path, 'rb') as fb:
+            while True:
+                chunk = fa.read(bufferSize)
+                if chunk != fb.read(bufferSize):
+                    return False
+                if not chunk:
+                    return True
+
+
+
+def moveAcrossDevices(src, dst, verify=False, bufferSize=COPY_BUFFER_SIZE,
+                      clock=time.time):
+    """
+    Move a file to another filesystem by copying it and removing the
+    original.
+
+    Regular files are copied with L{copyFile} to a temporary sibling of
+    C{dst}, that is only renamed to C{dst}, and the original removed, once the
+    copy is complete; anything else is moved with
+    L{twisted.python.filepath.FilePath.moveTo}.
+
+    @type  src: L{twisted.python.filepath.FilePath}
+    @param src: Source path.
+
+    @type  dst: L{twisted.python.filepath.FilePath}
+    @param dst: Destination path.
+
+    @type  verify: C{bool}
+    @param verify: Compare the copy to the original before removing it?
+
+    @raise renamer.errors.VerificationFailed: If C{verify} is C{True} and the
+        copy is not identical to the original, in which case the original is
+        left in place.
+    """
+    if src.islink() or not src.isfile():
+        src.moveTo(dst)
+        return
+
+    start = clock()
+    temp = dst.temporarySibling()
+    try:
+        size = copyFile(src, temp, bufferSize)
+        if verify and not filesEqual(src, temp, bufferSize):
+            raise errors.VerificationFailed(
+                'Copy of "%s" to "%s" is not identical' % (src.path, dst.path))
+        os.rename(temp.path, dst.path)
+    except:
+        if os.path.lexists(temp.path):
+            os.remove(temp.path)
+        raise
+    src.remove()
+
+    elapsed = max(clock() - start, 1e-6)
+    logging.msg(
+        'Copied %d bytes from "%s" to "%s" in %.2fs (%.1f MB/s)',
+        size, src.path, dst.path, elapsed, size / elapsed / 1e6,
+        verbosity=2)
+
+
+
+def rename(src, dst, oneFileSystem=False, renamer=os.rename, verify=False):
     """
     Rename a file, optionally refusing to do it across file systems.
 
@@ -53,20 +983,26 @@ def rename(src, dst, oneFileSystem=False, renamer=os.rename):
     @type  oneFileSystem: C{bool}
     @param oneFileSystem: Refuse to move a file across file systems?
 
-    @raise renamer.errors.DifferentLogicalDevices: If C{src} and C{dst} reside
-        on different filesystems and cross-linking files is not supported on
-        the current platform.
+    @type  verify: C{bool}
+    @param verify: Verify files copied across file systems before removing
+        the originals?
+
+    @raise renamer.errors.DifferentLogicalDevices: If C{oneFileSystem} is
+        C{True} and C{src} and C{dst} reside on different filesystems.
     """
-    if oneFileSystem:
-        try:
-            renamer(src.path, dst.path)
-        except OSError, e:
-            if e.errno == errno.EXDEV:
-                raise errors.DifferentLogicalDevices(
-                    'Refusing to move "%s" to "%s" on another filesystem' % (
-                        src.path, dst.path))
-    else:
-        src.moveTo(dst)
+    try:
+        renamer(src.path, dst.path)
+    except OSError, e:
+        if e.errno != errno.EXDEV:
+            raise
+        if oneFileSystem:
+            raise errors.DifferentLogicalDevices(
+                'Refusing to move "%s" to "%s" on another filesystem' % (
+                    src.path, dst.path))
+        moveAcrossDevices(src, dst, verify=verify)
+    finally:
+        src.changed()
+        dst.changed()
 
 
 
@@ -105,6 +1041,116 @@ def globArguments(args, platform=sys.platform, exists=os.path.exists):
 
 
 
+class _DirEntry(object):
+    """
+    Minimal stand-in for C{scandir.DirEntry}, used when scandir is not
+    available, that determines an entry's type with a single C{lstat}.
+
+    Symlinks are never followed, regardless of C{follow_symlinks}.
+    """
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self._stat = None
+
+
+    def stat(self, follow_symlinks=True):
+        if self._stat is None:
+            self._stat = os.lstat(self.path)
+        return self._stat
+
+
+    def is_dir(self, follow_symlinks=True):
+        return stat.S_ISDIR(self.stat().st_mode)
+
+
+
+def _listdirEntries(directory):
+    """
+    List the entries of C{directory} with C{os.listdir}.
+    """
+    return (_DirEntry(directory, name) for name in os.listdir(directory))
+
+
+
+def walkArguments(args, include=None, exclude=None, oneFileSystem=False,
+                  scandir=scandir):
+    """
+    Recursively expand directory arguments into the files within them.
+
+    Files are produced as each directory is listed, so processing can begin
+    long before a large tree has been traversed and only the entries of the
+    directories currently being walked are held in memory. Each directory's
+    entries are listed entirely before any of its files are produced, so that
+    files renamed within it are not seen twice. Entry types come from the
+    directory listing where the platform provides them, symlinks to
+    directories are not followed.
+
+    @type  args: C{iterable} of L{twisted.python.filepath.FilePath}
+    @param args: Arguments to expand, arguments that are not directories are
+        produced unchanged.
+
+    @type  include: C{list} of C{unicode}
+    @param include: Shell-style patterns, if given, files found by walking are
+        only produced if their names match at least one of them.
+
+    @type  exclude: C{list} of C{unicode}
+    @param exclude: Shell-style patterns, files and directories whose names
+        match any of them are skipped.
+
+    @type  oneFileSystem: C{bool}
+    @param oneFileSystem: Don't descend into directories on a different
+        filesystem from the argument they were found in?
+
+    @param scandir: C{scandir}-style directory listing function, or C{None}
+        to use C{os.listdir} and C{os.lstat}.
+
+    @rtype:  C{iterable} of L{twisted.python.filepath.FilePath}
+    """
+    def _matches(name, patterns):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+    if scandir is None:
+        scandir = _listdirEntries
+
+    for arg in args:
+        if not arg.isdir():
+            yield arg
+            continue
+
+        device = None
+        if oneFileSystem:
+            device = os.stat(arg.path).st_dev
+
+        pending = [arg.path]
+        while pending:
+            directory = pending.pop()
+            try:
+                entries = list(scandir(directory))
+            except OSError, e:
+                logging.msg('Skipping unreadable directory "%s": %s',
+                            directory, e.strerror)
+                continue
+
+            subdirectories = []
+            for entry in entries:
+                if exclude and _matches(entry.name, exclude):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if (device is not None and
+                        entry.stat(follow_symlinks=False).st_dev != device):
+                        logging.msg(
+                            'Not crossing filesystem boundary at "%s"',
+                            entry.path,
+                            verbosity=2)
+                        continue
+                    subdirectories.append(entry.path)
+                elif not include or _matches(entry.name, include):
+                    yield FilePath(entry.path)
+            pending.extend(reversed(subdirectories))
+
+
+
 def padIterable(iterable, padding, count):
     """
     Pad C{iterable}, with C{padding}, to C{count} elements.
@@ -161,6 +1207,75 @@ class BodyReceiver(Protocol):
 
 
 
+class CountingConnectionPool(HTTPConnectionPool):
+    """
+    HTTP connection pool that counts how many connections were newly created
+    and how many were reused from the pool.
+
+    @type requests: C{int}
+    @ivar requests: Number of connections requested from the pool.
+
+    @type newConnections: C{int}
+    @ivar newConnections: Number of connections that were newly created.
+    """
+    def __init__(self, reactor, persistent=True):
+        HTTPConnectionPool.__init__(self, reactor, persistent)
+        self.requests = 0
+        self.newConnections = 0
+
+
+    @property
+    def reusedConnections(self):
+        """
+        Number of connections that were reused from the pool.
+        """
+        return max(0, self.requests - self.newConnections)
+
+
+    def getConnection(self, key, endpoint):
+        self.requests += 1
+        return HTTPConnectionPool.getConnection(self, key, endpoint)
+
+
+    def _newConnection(self, key, endpoint):
+        self.newConnections += 1
+        return HTTPConnectionPool._newConnection(self, key, endpoint)
+
+
+
+def timeout(d, seconds, clock=reactor):
+    """
+    Cancel C{d} if it has not fired within C{seconds}.
+
+    @type  d: C{Deferred}
+
+    @type  seconds: C{float}
+
+    @raise twisted.internet.error.TimeoutError: (Asynchronously) If C{d} was
+        cancelled because it did not fire in time.
+
+    @return: C{d}
+    """
+    timedOut = []
+    def _timeout():
+        timedOut.append(True)
+        d.cancel()
+
+    def _finished(result):
+        if delayedCall.active():
+            delayedCall.cancel()
+        elif timedOut and isinstance(result, Failure):
+            result.trap(CancelledError)
+            raise TimeoutError(
+                None, 'Timed out after %s seconds' % (seconds,))
+        return result
+
+    delayedCall = clock.callLater(seconds, _timeout)
+    d.addBoth(_finished)
+    return d
+
+
+
 def deliverBody(response, cls):
     """
     Invoke C{response.deliverBody} with C{cls(response, deferred)}.
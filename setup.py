@@ -3,7 +3,8 @@ import os
 import sys
 from inspect import cleandoc
 
-from setuptools import setup
+from setuptools import find_packages, setup
+from setuptools.command.build_py import build_py
 
 
 def get_version():
@@ -19,6 +20,38 @@ def get_version():
     return locals()["__version__"]
 
 
+def load_grammars():
+    """
+    Load the grammars module without importing the rest of the package.
+    """
+    grammars_module_path = os.path.join(
+        os.path.dirname(__file__), "renamer", "grammars.py")
+    namespace = {}
+    with open(grammars_module_path) as grammars_module:
+        exec(grammars_module.read(), namespace)
+    return namespace
+
+
+class build_py_with_grammars(build_py):
+    """
+    Compile the PyMeta grammars into C{renamer._compiled_grammar}, so they
+    do not need to be compiled every time Renamer runs.
+    """
+    def run(self):
+        build_py.run(self)
+        if self.dry_run:
+            return
+        grammars = load_grammars()
+        path = os.path.join(self.build_lib, "renamer", "_compiled_grammar")
+        try:
+            written = grammars["writeCompiledGrammars"](path)
+        except ImportError:
+            self.warn("PyMeta is not installed, not compiling grammars")
+        else:
+            for filename in written:
+                self.announce("compiled grammar %s" % (filename,), level=2)
+
+
 def scripts():
     if sys.platform == 'win32':
         yield 'bin/rn.cmd'
@@ -49,4 +82,6 @@ setup(
                       "twisted>=13.2.0",
                       "PyMeta>=0.5.0",
                       "mutagen>=1.31"],
+    cmdclass={"build_py": build_py_with_grammars},
+    packages=find_packages(),
     scripts=list(scripts()))